@@ -0,0 +1,128 @@
+import threading
+import numpy as np
+import pandas as pd
+from grading import load_scale
+from storage import STUDENT_KEY
+from rankings import TOTAL_COLUMNS, competition_rank, get_ordinal_position, ranked, ranking_views, student_totals
+
+TERMS = ["First Term", "Second Term", "Third Term"]
+# Cumulative results and the promotion decision go on this term's report card
+FINAL_TERM = TERMS[-1]
+# Per-term columns hold that term's Total_Obt
+ANNUAL_COLUMNS = (["Position", "Student_Name", "Class"] + TERMS
+                  + ["Terms", "Total_Obt", "Total_Max", "Average", "Percentage", "Decision"])
+# All term_aggregates reads from the progress records, for a projected load
+AGGREGATE_COLUMNS = STUDENT_KEY + ["Term", "Session"] + TOTAL_COLUMNS
+PROMOTED = "Promoted"
+NOT_PROMOTED = "Not promoted"
+
+
+def promotion_mark(scale=None):
+    # Cumulative percentage needed for promotion: the lowest passing band of
+    # the school's grading scale
+    return (scale or load_scale()).pass_percent()
+
+
+def term_aggregates(df):
+    # Per-student, per-term totals for raw subject rows, in one grouped pass;
+    # the same columns as RankingViews.term_totals plus Term
+    return student_totals(df, keys=("Student_Name", "Class", "Term"))
+
+
+def annual_results(aggregates, pass_mark=None):
+    # One cumulative row per student (a name within a class, as everywhere
+    # else) from per-term totals (Student_Name, Class, Term, Total_Obt,
+    # Total_Max, Subjects) of a single session; the average is the mean of the
+    # term averages.
+    if len(aggregates):
+        aggregates = aggregates.astype({"Student_Name": object, "Class": object, "Term": object})
+        aggregates = aggregates[aggregates["Term"].isin(TERMS)]
+    if aggregates.empty:
+        return pd.DataFrame(columns=ANNUAL_COLUMNS + ["Rank"])
+    aggregates = aggregates.iloc[np.argsort(aggregates["Term"].map(TERMS.index).to_numpy(), kind="stable")]
+    by_student = aggregates.groupby(STUDENT_KEY, sort=False)
+    annual = by_student[TOTAL_COLUMNS].sum()
+    annual["Terms"] = by_student.size()
+    term_average = aggregates["Total_Obt"] / aggregates["Subjects"]
+    annual["Average"] = term_average.groupby([aggregates[col] for col in STUDENT_KEY], sort=False).mean().round(2)
+    annual["Percentage"] = (annual["Total_Obt"] / annual["Total_Max"]) * 100
+    per_term = aggregates.pivot_table(index=STUDENT_KEY, columns="Term", values="Total_Obt", aggfunc="sum")
+    annual = annual.join(per_term.reindex(columns=TERMS)).reset_index()
+    # The decision waits for the final term's results
+    pass_mark = promotion_mark() if pass_mark is None else pass_mark
+    annual["Decision"] = np.where(annual[FINAL_TERM].isna(), "",
+                                  np.where(annual["Percentage"].round(6) >= pass_mark, PROMOTED, NOT_PROMOTED))
+    return ranked(annual).reindex(columns=ANNUAL_COLUMNS + ["Rank"])
+
+
+def annual_summaries(annual):
+    # {(student, class): summary for the report card} with positions within each class,
+    # from an annual_results table of any scope
+    if annual.empty:
+        return {}
+    annual = annual.copy()
+    annual["Rank"] = annual.groupby("Class", observed=True)["Percentage"].transform(competition_rank)
+    annual["Size"] = annual.groupby("Class", observed=True)["Student_Name"].transform("size")
+    summaries = {}
+    for row in annual.to_dict("records"):
+        summaries[(row["Student_Name"], row["Class"])] = {
+            "terms": {term: None if pd.isna(row[term]) else float(row[term]) for term in TERMS},
+            "total_obt": float(row["Total_Obt"]),
+            "total_max": float(row["Total_Max"]),
+            "average": float(row["Average"]),
+            "percentage": float(row["Percentage"]),
+            "position": get_ordinal_position(int(row["Rank"])),
+            "class_size": int(row["Size"]),
+            "decision": row["Decision"],
+        }
+    return summaries
+
+
+class AnnualViews:
+    # Cumulative session results built from the per-term student totals that
+    # RankingViews keeps per (term, session, class). A save only recomputes the
+    # totals of the class-term it touched; the session's annual table is then
+    # re-aggregated from those per-student totals, never from raw subject rows.
+
+    def __init__(self, store):
+        self.store = store
+        self.rankings = ranking_views(store)
+        self._lock = threading.Lock()
+        self._tables = {}
+
+    def _session_table(self, session):
+        pass_mark = promotion_mark(self.store.scale())
+        key = (pass_mark,) + tuple(self.rankings.term_key(term, session) for term in TERMS)
+        with self._lock:
+            cached = self._tables.get(session)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+        frames = [self.rankings.term_totals(term, session).assign(Term=term) for term in TERMS]
+        frames = [frame for frame in frames if len(frame)]
+        aggregates = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        table = annual_results(aggregates, pass_mark)
+        summaries = annual_summaries(table)
+        with self._lock:
+            self._tables[session] = (key, (table, summaries))
+        return table, summaries
+
+    def annual_ranking(self, session, class_name=None):
+        # The whole school ranked together, or one class ranked on its own
+        table, _ = self._session_table(session)
+        if class_name is None or table.empty:
+            return table
+        return ranked(table[table["Class"] == class_name])
+
+    def classes(self, session):
+        table, _ = self._session_table(session)
+        return sorted(table["Class"].dropna().unique().tolist(), key=str)
+
+    def summaries(self, session):
+        return self._session_table(session)[1]
+
+    def student_summary(self, student_name, class_name, session):
+        return self.summaries(session).get((student_name, class_name))
+
+
+def annual_views(store):
+    return store.derived("annual", AnnualViews)
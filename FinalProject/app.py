@@ -1,149 +1,200 @@
 import streamlit as st
 import pandas as pd
 import os
-from io import BytesIO
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import cm
-import base64
+import uuid
+from storage import (EXPECTED_COLUMNS, SCHOOL_ID_PATTERN, NamesakeError, StaleWriteError, create_school, get_backend,
+                     partition_key, partition_version, school_ids)
+from progress_store import add_change_listener, load_progress_store, load_school_info
+from report_card import LOGO_FILE, card_html, format_score
+from batch_reports import card_file_name, collect_cards
+from render_jobs import get_render_queue
+from pdf_cache import get_pdf_cache
+from broadsheet import XLSX_AVAILABLE, export_broadsheet
+from grading import GRADING_FILE, GradingScale, changed_grades
+from rankings import ranking_views
+from annual import FINAL_TERM, TERMS, annual_views
+from class_statistics import statistics_views, with_class_statistics
+from student_search import PAGE_SIZE, student_index
+from result_tables import TABLE_PAGE_SIZES, TOP_N_DEFAULT, score_tables, score_text, table_page, top_n
+from instrumentation import RerunTimer, profiling_default
+from score_import import (ENTERED_SCORE_COLUMNS, IMPORT_COLUMNS, MAXIMUM_COLUMNS, grade_entry_sheet,
+                          guess_mapping, keep_saved_comments, read_sheet, validate_scores)
 
 # ---------- Helper Functions ----------
-def calculate_grade_mark(obtained, max_val):
-    if max_val == 0:
-        return "-", "-"
-    percent = (obtained / max_val) * 100
-    if percent >= 70:
-        return "A", "Excellent"
-    elif percent >= 60:
-        return "B", "Very Good"
-    elif percent >= 50:
-        return "C", "Good"
-    elif percent >= 45:
-        return "D", "Fair"
-    else:
-        return "F", "Poor"
-
-def create_pdf(school_name, school_address, student_name, student_class, student_number, term, session,
-               df, total_obt, total_max, average, class_teacher_comment, principal_comment):
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4,
-                            rightMargin=1.5*cm, leftMargin=1.5*cm,
-                            topMargin=1.5*cm, bottomMargin=1.5*cm)
-    elements = []
-    styles = getSampleStyleSheet()
-    normal_style = styles["Normal"]
-    normal_style.fontSize = 7
-    center_style = ParagraphStyle(name="center", alignment=1, fontSize=7)
-
-    # School Logo (if provided)
-    logo_path = "school_logo.png"  # Default logo path
-    if os.path.exists(logo_path):
-        try:
-            logo = Image(logo_path, width=2*cm, height=2*cm)
-            logo.hAlign = 'CENTER'
-            elements.append(logo)
-            elements.append(Spacer(1, 6))
-        except:
-            # If logo loading fails, continue without logo
-            pass
-
-    # School Name & Address
-    elements.append(Paragraph(f"<b>{school_name}</b>", ParagraphStyle(name="center_title", alignment=1, fontSize=12)))
-    elements.append(Paragraph(f"{school_address}", ParagraphStyle(name="center_address", alignment=1, fontSize=10)))
-    elements.append(Spacer(1, 6))
-    
-    # Term and Session as report title
-    elements.append(Paragraph(f"<b>{term} {session} Academic Report Card</b>", 
-                              ParagraphStyle(name="center_title", alignment=1, fontSize=12)))
-    elements.append(Spacer(1, 12))
-
-    # Student Info
-    elements.append(Paragraph(f"Student Name: {student_name}", normal_style))
-    elements.append(Paragraph(f"Class: {student_class}", normal_style))
-    elements.append(Paragraph(f"No in Class: {student_number}", normal_style))
-    elements.append(Spacer(1, 12))
-
-    # Table Headers
-    table_data = [
-        ["Subject", "1st CA", "", "2nd CA", "", "Exam", "", "Total", "", "Grade", "Remark"],
-        ["",
-         Paragraph("Mark<br/>Obtained", center_style), Paragraph("Mark<br/>Obtainable", center_style),
-         Paragraph("Mark<br/>Obtained", center_style), Paragraph("Mark<br/>Obtainable", center_style),
-         Paragraph("Mark<br/>Obtained", center_style), Paragraph("Mark<br/>Obtainable", center_style),
-         Paragraph("Mark<br/>Obtained", center_style), Paragraph("Mark<br/>Obtainable", center_style),
-         "", ""]
-    ]
-
-    # Table Data Rows
-    for row in df.itertuples(index=False):
-        table_data.append([row.Subject,
-                           row.CA1_Obt, row.CA1_Max,
-                           row.CA2_Obt, row.CA2_Max,
-                           row.Exam_Obt, row.Exam_Max,
-                           row.Total_Obt, row.Total_Max,
-                           row.Grade, row.Remark])
-
-    col_widths = [3*cm] + [1.5*cm]*8 + [1.5*cm, 2.5*cm]
-    table = Table(table_data, colWidths=col_widths, repeatRows=2)
-
-    # Table Style
-    style = TableStyle([
-        ("SPAN", (1,0),(2,0)),
-        ("SPAN", (3,0),(4,0)),
-        ("SPAN", (5,0),(6,0)),
-        ("SPAN", (7,0),(8,0)),
-        ("BACKGROUND", (0,0), (-1,1), colors.grey),
-        ("TEXTCOLOR", (0,0), (-1,1), colors.whitesmoke),
-        ("ALIGN", (0,0), (-1,-1), "CENTER"),
-        ("GRID", (0,0), (-1,-1), 0.5, colors.black),
-        ("FONTNAME", (0,0), (-1,1), "Helvetica-Bold"),
-        ("FONTSIZE", (0,0), (-1,-1), 7),
-        ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
-    ])
-
-    # Red color for marks <50%
-    numeric_cols = [(1,2),(3,4),(5,6),(7,8)]
-    for row_idx, row in enumerate(df.itertuples(index=False), start=2):
-        for obt_col, max_col in numeric_cols:
-            try:
-                obt = float(getattr(row, df.columns[obt_col]))
-                mx = float(getattr(row, df.columns[max_col]))
-                if obt < 0.5 * mx:
-                    style.add('TEXTCOLOR', (obt_col,row_idx), (obt_col,row_idx), colors.red)
-            except ValueError:
-                continue
-
-    table.setStyle(style)
-    elements.append(table)
-
-    # Summary
-    elements.append(Spacer(1, 12))
-    elements.append(Paragraph(f"Total Marks: {total_obt} / {total_max}", normal_style))
-    elements.append(Paragraph(f"Average Score: {average:.2f}", normal_style))
-    percentage = (total_obt / total_max) * 100 if total_max > 0 else 0
-    elements.append(Paragraph(f"Percentage: {percentage:.2f}%", normal_style))
-
-    # Comments
-    elements.append(Spacer(1, 12))
-    if class_teacher_comment:
-        elements.append(Paragraph(f"Class Teacher's Comment: {class_teacher_comment}", normal_style))
-    elements.append(Spacer(1, 12))
-    elements.append(Paragraph(f"Principal's Comment: {'_'*40}", normal_style))
-    if principal_comment:
-        elements.append(Paragraph(principal_comment, normal_style))
-
-    doc.build(elements)
-    buffer.seek(0)
-    return buffer
-
-def get_ordinal_position(n):
-    if 10 <= n % 100 <= 20:
-        suffix = 'th'
+def calculate_grade_mark(obtained, max_val, scale):
+    # The school's configured bands (grading_scale.json), shared with report_generator.py
+    return scale.grade(obtained, max_val)
+
+def student_label(match):
+    # How a student_search match is listed, e.g. "Ada Obi (JSS1A, No. 4, 2024/2025)"
+    return (f"{match['student_name']} ({match['student_class'] or 'no class'}"
+            f"{', No. ' + match['number'] if match['number'] else ''}, {match['session']})")
+
+def saved_value(saved_row, column):
+    # Blank cells come back as "", None or NaN depending on the storage backend
+    return format_score(saved_row.get(column))
+
+def score_sheet_entry(subjects, saved_rows_by_subject, session_id, selection, scale):
+    # Whole-sheet entry: the subjects are edited together inside a form, so typing
+    # causes no reruns, and totals and grades are computed once per "Apply Marks".
+    # Returns the same (records, total_obt_all, total_max_all, subjects_with_scores)
+    # as the field-by-field inputs.
+    sheet_key = f"{session_id}_{selection}_{'|'.join(subjects)}"
+    initial = pd.DataFrame([
+        {"Subject": subject,
+         **{column: str(st.session_state.form_data.get(f"{subject}_{column.lower()}",
+                                                       saved_value(saved_rows_by_subject.get(subject, {}), column)))
+            for column in ENTERED_SCORE_COLUMNS}}
+        for subject in subjects], columns=["Subject"] + ENTERED_SCORE_COLUMNS)
+    with st.form(key=f"{sheet_key}_form"):
+        sheet = st.data_editor(initial, hide_index=True, disabled=["Subject"], key=f"{sheet_key}_sheet",
+                               column_config={column: st.column_config.TextColumn(column)
+                                              for column in ENTERED_SCORE_COLUMNS})
+        submitted = st.form_submit_button("✅ Apply Marks")
+
+    graded_sheets = st.session_state.setdefault("graded_sheets", {})
+    if submitted or sheet_key not in graded_sheets:
+        graded_sheets.clear()
+        graded_sheets[sheet_key] = grade_entry_sheet(sheet, scale)
+        # Shared with the field-by-field inputs, so switching modes keeps the marks
+        for row in sheet.itertuples(index=False):
+            for column in ENTERED_SCORE_COLUMNS:
+                value = getattr(row, column)
+                st.session_state.form_data[f"{row.Subject}_{column.lower()}"] = "" if pd.isna(value) else str(value)
+    graded = graded_sheets[sheet_key]
+
+    invalid = graded["Error"] != ""
+    if invalid.any():
+        st.error("Fix these marks and apply again; they are left out until then:\n\n" + "\n".join(
+            f"- {row.Subject}: {row.Error}" for row in graded[invalid].itertuples(index=False)))
+    valid = graded[~invalid & (graded["Total_Obt"] != "")]
+    records = [[row.Subject, *(getattr(row, column) for column in ENTERED_SCORE_COLUMNS),
+                row.Total_Obt, row.Total_Max, row.Grade, row.Remark] if not bad and row.Total_Obt != ""
+               else [row.Subject] + [""] * 10
+               for row, bad in zip(graded.itertuples(index=False), invalid)]
+    return records, float(valid["Total_Obt"].sum()), float(valid["Total_Max"].sum()), len(valid)
+
+def render_jobs_panel(render_queue, job_ids):
+    # Progress and downloads for jobs on the shared render queue. The panel is a
+    # fragment that polls on its own while a job is running, so the rest of the
+    # page stays usable; once everything is finished the page reruns once and
+    # polling stops.
+    jobs = [job for job in map(render_queue.job, job_ids) if job is not None]
+    polling = any(not job.finished for job in jobs)
+
+    @st.fragment(run_every=1 if polling else None)
+    def panel():
+        current = [job for job in map(render_queue.job, job_ids) if job is not None]
+        for job in current:
+            if job.status == "cancelled":
+                st.info(f"{job.label}: cancelled after {job.done} of {job.total} report cards.")
+            elif not job.finished:
+                waiting = " (waiting for a free worker)" if job.status == "queued" else ""
+                st.progress(job.progress(), text=f"{job.label}: {job.done} of {job.total} report cards rendered{waiting}")
+                if st.button("✖️ Cancel", key=f"cancel_job_{job.id}"):
+                    render_queue.cancel(job.id)
+                    st.rerun()
+            else:
+                if job.data is not None:
+                    st.success(f"✅ {job.label}: {job.rendered} of {job.total} report cards generated.")
+                    st.download_button(f"📥 Download {job.file_name}", data=job.data, file_name=job.file_name, mime=job.mime,
+                                       key=f"download_job_{job.id}")
+                if job.failures:
+                    st.warning(f"⚠️ {len(job.failures)} report cards could not be generated.")
+                    st.dataframe(pd.DataFrame(job.failures, columns=["Student_Name", "Class", "Error"]))
+        if polling and all(job.finished for job in current):
+            st.rerun()
+
+    panel()
+
+def paged_dataframe(df, key, columns=None, column_config=None, format_page=None):
+    # Filtering, sorting and paging happen here on the server, so only the rows
+    # of the visible page are sent to the browser however large `df` is
+    columns = list(columns if columns is not None else df.columns)
+    default_order = "Ranked order" if "Rank" in df.columns else "Saved order"
+    col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
+    with col1:
+        query = st.text_input("Filter", key=f"{key}_filter", placeholder="Name or class")
+    with col2:
+        sort_by = st.selectbox("Sort by", options=[default_order] + columns, key=f"{key}_sort")
+    with col3:
+        descending = st.checkbox("Descending", key=f"{key}_descending")
+    with col4:
+        page_size = st.selectbox("Rows per page", options=TABLE_PAGE_SIZES, key=f"{key}_page_size")
+    scope = (query, sort_by, descending, page_size)
+    if st.session_state.table_pages.get(key, (None, 0))[0] != scope:
+        st.session_state.table_pages[key] = (scope, 0)
+    page = st.session_state.table_pages[key][1]
+    rows, total = table_page(df, query=query, sort_by=None if sort_by == default_order else sort_by,
+                             descending=descending, page=page, page_size=page_size)
+    if page and not len(rows):
+        # The table shrank under this page since the last rerun
+        page = 0
+        st.session_state.table_pages[key] = (scope, page)
+        rows, total = table_page(df, query=query, sort_by=None if sort_by == default_order else sort_by,
+                                 descending=descending, page=page, page_size=page_size)
+    rows = rows[columns]
+    st.dataframe(format_page(rows) if format_page else rows, hide_index=True, column_config=column_config)
+
+    page_start = page * page_size
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("◀ Previous", key=f"{key}_previous", disabled=page_start == 0):
+            st.session_state.table_pages[key] = (scope, page - 1)
+            st.rerun()
+    with col2:
+        st.caption(f"Rows {page_start + 1 if total else 0}–{page_start + len(rows)} of {total}")
+    with col3:
+        if st.button("Next ▶", key=f"{key}_next", disabled=page_start + len(rows) >= total):
+            st.session_state.table_pages[key] = (scope, page + 1)
+            st.rerun()
+
+def ranking_view(key):
+    # "Top N" summary or the full, paged ranking; returns N, or None for the full ranking
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        view = st.radio("Show", options=["Top students", "Full ranking"], key=f"{key}_view", horizontal=True)
+    if view == "Full ranking":
+        return None
+    with col2:
+        return st.number_input("How many", min_value=1, value=TOP_N_DEFAULT, step=1, key=f"{key}_top_n")
+
+# ---------- School selection ----------
+# Several schools can share one deployment, each with its own shard of records,
+# school info, logo and grading scale (see storage.py). The school comes from the
+# ?school= URL parameter or the picker below; with no shards on disk the app runs
+# on the working directory's files as a single school.
+schools = school_ids()
+school = None
+if schools:
+    requested = st.query_params.get("school")
+    if requested in schools:
+        school = requested
     else:
-        suffix = {1: 'st', 2: 'nd', 3: 'rd'}.get(n % 10, 'th')
-    return f"{n}{suffix}"
+        st.title("📘 Academic Management System")
+        if requested:
+            st.error(f"❌ There is no school called '{requested}'.")
+        col1, col2 = st.columns(2)
+        with col1:
+            picked_school = st.selectbox("School", options=schools, key="school_pick")
+            if st.button("Open School", key="school_open"):
+                st.query_params["school"] = picked_school
+                st.rerun()
+        with col2:
+            new_school = st.text_input("New school ID", key="school_new",
+                                       help="Lowercase letters, digits, '-' and '_', e.g. st-marys")
+            if st.button("Create School", key="school_create"):
+                if SCHOOL_ID_PATTERN.fullmatch(new_school.strip()):
+                    create_school(new_school.strip())
+                    st.query_params["school"] = new_school.strip()
+                    st.rerun()
+                else:
+                    st.error("❌ School IDs are lowercase letters, digits, '-' and '_'.")
+        st.stop()
+if st.session_state.get("school", school) != school:
+    # Nothing picked for one school (students, pages, previews) carries over to another
+    st.session_state.clear()
+st.session_state.school = school
 
 # Initialize session state
 if 'form_data' not in st.session_state:
@@ -152,567 +203,963 @@ if 'subjects' not in st.session_state:
     st.session_state.subjects = ["Mathematics", "English"]
 if 'session_id' not in st.session_state:
     st.session_state.session_id = 0
+if 'render_owner' not in st.session_state:
+    # Jobs on the server-wide render queue belong to the session that submitted them
+    st.session_state.render_owner = uuid.uuid4().hex
+    st.session_state.preview_card = None
+    st.session_state.preview_html = None
+    st.session_state.preview_version = None
+if 'table_pages' not in st.session_state:
+    # Result table key -> (filter/sort scope, page shown)
+    st.session_state.table_pages = {}
+if 'search_page' not in st.session_state:
+    st.session_state.search_page = 0
+    st.session_state.search_scope = None
+    # (name, class, session) -> label: the picked student keeps the label it was
+    # picked under, since a selectbox whose label changes loses its selection
+    st.session_state.student_labels = {}
+if 'loaded_versions' not in st.session_state:
+    # Version of each (student, class, term, session) as the form first showed
+    # it, or as this form last saved it
+    st.session_state.loaded_versions = {}
+    st.session_state.save_conflict = None
+    st.session_state.save_notice = None
+if 'timing_session' not in st.session_state:
+    st.session_state.timing_session = uuid.uuid4().hex[:12]
+    st.session_state.timing_reruns = 0
+
+# Per-rerun timings; AMS_PROFILE=1 switches them on for every session
+with st.sidebar.expander("⏱️ Diagnostics"):
+    timing_on = st.checkbox("Time each rerun", value=profiling_default(), key="timing_on")
+    profile_on = st.checkbox("Profile with cProfile", key="profile_on", disabled=not timing_on)
+    memory_on = st.checkbox("Track memory with tracemalloc", key="memory_on", disabled=not timing_on)
+    timing_panel = st.container()
+timer = RerunTimer(timing_on, profile_on, memory_on).start()
 
 # ---------- Streamlit App ----------
 st.title("📘 Academic Management System")
 
-progress_file = "progress_multi.csv"
-school_info_file = "school_info.csv"
-expected_columns = ["Student_Name", "Class", "Term", "Session", "Subject", 
-                    "CA1_Obt", "CA1_Max", "CA2_Obt", "CA2_Max", 
-                    "Exam_Obt", "Exam_Max", "Total_Obt", "Total_Max", "Grade", "Remark",
-                    "Teacher_Comment", "Principal_Comment", "School_Name", "School_Address"]
-
-if os.path.exists(progress_file):
-    df_progress_all = pd.read_csv(progress_file)
-    for col in expected_columns:
-        if col not in df_progress_all.columns:
-            df_progress_all[col] = ""
-else:
-    df_progress_all = pd.DataFrame(columns=expected_columns)
-
-# Load school info
-if os.path.exists(school_info_file):
-    df_school_info = pd.read_csv(school_info_file)
-    if not df_school_info.empty:
-        default_school_name = df_school_info.iloc[0].get("School_Name", "Your School Name")
-        default_school_address = df_school_info.iloc[0].get("School_Address", "School Address Here")
-    else:
-        default_school_name = "Your School Name"
-        default_school_address = "School Address Here"
-else:
-    default_school_name = "Your School Name"
-    default_school_address = "School Address Here"
+expected_columns = EXPECTED_COLUMNS
+
+if school is not None:
+    st.sidebar.markdown(f"🏫 School: **{school}**")
+    if st.sidebar.button("Switch School", key="school_switch"):
+        del st.query_params["school"]
+        st.rerun()
+
+with timer.section("Load progress data"):
+    # SQLite by default, flat files with AMS_STORAGE=csv/journal/parquet (see storage.py); only this
+    # school's shard is loaded, cached and indexed
+    storage_backend = get_backend(school=school)
+
+    # Cached across reruns, reloaded only when the stored data changes
+    progress_store = load_progress_store(storage_backend)
+
+    # Rankings are kept per (term, session, class) and refreshed only for classes that change
+    rankings = ranking_views(progress_store)
+
+    # Cumulative session results, aggregated from the per-class term totals above
+    annual = annual_views(progress_store)
+
+    # Subject average/highest/lowest per class, kept per class like the rankings
+    class_stats = statistics_views(progress_store)
+
+    # PDF rendering runs on one worker pool shared by every session
+    render_queue = get_render_queue()
+
+    # Rendered cards are cached by content; a save drops the ones it changed
+    add_change_listener(get_pdf_cache().invalidate_partitions)
+
+    # Load school info
+    default_school_name, default_school_address = load_school_info(storage_backend)
+
+    # The logo printed on this school's report cards
+    logo_path = progress_store.file_path(LOGO_FILE)
+
+# Grading scale (per school)
+with st.sidebar.expander("⚙️ Grading Scale"):
+    grading_scale = progress_store.scale()
+    edited_bands = st.data_editor(pd.DataFrame(grading_scale.to_records()), num_rows="dynamic",
+                                  hide_index=True, key="grading_editor",
+                                  column_config={"Min_Percent": st.column_config.NumberColumn(required=True),
+                                                 "Grade": st.column_config.TextColumn(required=True)})
+    if st.button("💾 Save Grading Scale", key="save_grading_button"):
+        try:
+            # Rows left wholly blank are ignored; a band missing its percentage
+            # or grade is refused by GradingScale rather than saved as "nan"
+            GradingScale.from_records(edited_bands.dropna(how="all").to_dict("records")).save(
+                progress_store.file_path(GRADING_FILE))
+            st.success("✅ Grading scale saved.")
+        except (ValueError, KeyError) as e:
+            st.error(f"❌ {e}")
+    if st.button("🔁 Apply Scale to Saved Results", key="regrade_button",
+                 help="Recompute Grade and Remark for every saved record with the current scale"):
+        regraded = changed_grades(progress_store.df, grading_scale)
+        if not regraded.empty:
+            progress_store.save_records(regraded, replace_partitions=False)
+        st.success(f"✅ {len(regraded)} saved records regraded.")
 
 # Add term and session selection
 terms = ["First Term", "Second Term", "Third Term"]
 # Generate sessions from 2020 to 2030
 sessions = [f"{year}/{year+1}" for year in range(2020, 2031)]
 
-tab1, tab2, tab3, tab4 = st.tabs(["Record Student Marks", "Saved Data / Export", "Overall Best Students", "Subject Best Students"])
+# Only the open tab's code runs: switching tabs reruns the script, and typing in one
+# tab no longer recomputes the pivots and rankings of the others
+tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(["Record Student Marks", "Saved Data / Export", "Overall Best Students", "Subject Best Students", "Batch Report Cards", "Import Scores", "Class Statistics"],
+                                                   key="active_tab", on_change="rerun")
 
-with tab1:
-    # School Logo Upload Section - IMPROVED VERSION
-    st.subheader("🏫 School Logo Setup")
-    st.info("Upload your school logo to appear on all report cards")
+with tab1, timer.section("Record Student Marks"):
+    if tab1.open:
+        # School Logo Upload Section - IMPROVED VERSION
+        st.subheader("🏫 School Logo Setup")
+        st.info("Upload your school logo to appear on all report cards")
 
-    # Create columns for better layout
-    col1, col2 = st.columns([2, 1])
+        # Create columns for better layout
+        col1, col2 = st.columns([2, 1])
 
-    with col1:
-        uploaded_logo = st.file_uploader(
-            "Choose your school logo image", 
-            type=['png', 'jpg', 'jpeg'], 
-            key="logo_upload",
-            help="Upload a clear logo in PNG, JPG, or JPEG format. Recommended size: 150x150 pixels for best quality."
-        )
-        
-        if uploaded_logo is not None:
-            # Save the uploaded logo
-            try:
-                with open("school_logo.png", "wb") as f:
-                    f.write(uploaded_logo.getbuffer())
-                st.success("✅ School logo uploaded successfully! It will appear on all report cards.")
-                st.rerun()
-            except Exception as e:
-                st.error(f"❌ Error saving logo: {e}")
+        with col1:
+            uploaded_logo = st.file_uploader(
+                "Choose your school logo image", 
+                type=['png', 'jpg', 'jpeg'], 
+                key="logo_upload",
+                help="Upload a clear logo in PNG, JPG, or JPEG format. Recommended size: 150x150 pixels for best quality."
+            )
         
-        # Logo management options
-        if os.path.exists("school_logo.png"):
-            if st.button("🗑️ Remove Current Logo", key="remove_logo"):
+            if uploaded_logo is not None:
+                # Save the uploaded logo
                 try:
-                    os.remove("school_logo.png")
-                    st.success("✅ Logo removed successfully!")
-                    st.rerun()  # Refresh the app to show changes
+                    with open(logo_path, "wb") as f:
+                        f.write(uploaded_logo.getbuffer())
+                    st.success("✅ School logo uploaded successfully! It will appear on all report cards.")
+                    st.rerun()
                 except Exception as e:
-                    st.error(f"❌ Error removing logo: {e}")
+                    st.error(f"❌ Error saving logo: {e}")
+        
+            # Logo management options
+            if os.path.exists(logo_path):
+                if st.button("🗑️ Remove Current Logo", key="remove_logo"):
+                    try:
+                        os.remove(logo_path)
+                        st.success("✅ Logo removed successfully!")
+                        st.rerun()  # Refresh the app to show changes
+                    except Exception as e:
+                        st.error(f"❌ Error removing logo: {e}")
 
-    with col2:
-        # Logo preview section
-        if uploaded_logo is not None:
-            st.image(uploaded_logo, width=150, caption="New Logo Preview")
-        elif os.path.exists("school_logo.png"):
-            try:
-                st.image("school_logo.png", width=150, caption="Current School Logo")
-                st.success("✅ Logo is set up!")
-            except:
-                st.warning("⚠️ Could not load current logo")
-        else:
-            st.info("👆 Upload a logo to see preview")
+        with col2:
+            # Logo preview section
+            if uploaded_logo is not None:
+                st.image(uploaded_logo, width=150, caption="New Logo Preview")
+            elif os.path.exists(logo_path):
+                try:
+                    st.image(logo_path, width=150, caption="Current School Logo")
+                    st.success("✅ Logo is set up!")
+                except:
+                    st.warning("⚠️ Could not load current logo")
+            else:
+                st.info("👆 Upload a logo to see preview")
 
-    # Additional information
-    st.markdown("---")
-    st.caption("💡 **Tips:** For best results, use a square logo with transparent background in PNG format.")
+        # Additional information
+        st.markdown("---")
+        st.caption("💡 **Tips:** For best results, use a square logo with transparent background in PNG format.")
     
-    # Student Info - Select first
-    student_names = df_progress_all['Student_Name'].unique().tolist() if not df_progress_all.empty else []
-    student_name = st.selectbox("Select Student", options=[""] + student_names, key="student_select")
+        # Student Info - Find the student first: a name search over an index kept on
+        # the store, a page of matches at a time, each listed with class and session
+        search_index = student_index(progress_store)
+        col1, col2, col3 = st.columns([2, 1, 1])
+        with col1:
+            student_query = st.text_input("Search Students", key="student_search", placeholder="Type part of a name")
+        with col2:
+            search_session = st.selectbox("In Session", options=["All sessions"] + sessions, key="search_session")
+        with col3:
+            search_class = st.selectbox("In Class", options=["All classes"] + search_index.classes(
+                None if search_session == "All sessions" else search_session), key="search_class")
+        search_scope = (student_query, search_session, search_class)
+        if st.session_state.search_scope != search_scope:
+            st.session_state.search_scope = search_scope
+            st.session_state.search_page = 0
+        matches, match_count = search_index.search(
+            student_query, class_name=None if search_class == "All classes" else search_class,
+            session=None if search_session == "All sessions" else search_session, page=st.session_state.search_page)
+
+        if st.session_state.get("reselect_student"):
+            # A saved class change moves the student to that class's entry
+            st.session_state.student_select = st.session_state.reselect_student
+            st.session_state.reselect_student = None
+        selected_student = st.session_state.get("student_select")
+        match_keys = [(match["student_name"], match["student_class"], match["session"]) for match in matches]
+        cached_labels = st.session_state.student_labels
+        student_labels = {key: student_label(match) for key, match in zip(match_keys, matches)}
+        if selected_student:
+            picked = cached_labels.get(selected_student)
+            if picked is None:
+                match = search_index.match(*selected_student)
+                picked = student_label(match) if match else student_labels.get(selected_student)
+            if picked is not None:
+                student_labels[selected_student] = picked
+        st.session_state.student_labels = student_labels
+        options = [None] + ([selected_student] if selected_student in student_labels
+                            and selected_student not in match_keys else []) + match_keys
+        def open_student_session():
+            # Picking a student opens the session of the entry picked
+            picked = st.session_state.student_select
+            if picked and picked[2] in sessions:
+                st.session_state.session_select = picked[2]
+
+        selected_student = st.selectbox("Select Student", options=options, key="student_select",
+                                        on_change=open_student_session,
+                                        format_func=lambda option: "" if option is None else student_labels[option])
+        student_name, selected_class, selected_session = selected_student if selected_student else ("", "", "")
+
+        page_start = st.session_state.search_page * PAGE_SIZE
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            if st.button("◀ Previous", key="search_previous", disabled=page_start == 0):
+                st.session_state.search_page -= 1
+                st.rerun()
+        with col2:
+            st.caption(f"{page_start + 1 if match_count else 0}–{page_start + len(matches)} of {match_count} students")
+        with col3:
+            if st.button("Next ▶", key="search_next", disabled=page_start + len(matches) >= match_count):
+                st.session_state.search_page += 1
+                st.rerun()
     
-    # Term and Session selection
-    col1, col2 = st.columns(2)
-    with col1:
-        term = st.selectbox("Term", options=terms, key="term_select")
-    with col2:
-        session = st.selectbox("Academic Session", options=sessions, key="session_select")
+        # Term and Session selection
+        col1, col2 = st.columns(2)
+        with col1:
+            term = st.selectbox("Term", options=terms, key="term_select")
+        with col2:
+            session = st.selectbox("Academic Session", options=sessions, key="session_select")
     
-    # Check if selection has changed
-    current_selection = f"{student_name}_{term}_{session}"
-    if 'last_selection' not in st.session_state or st.session_state.last_selection != current_selection:
-        st.session_state.session_id += 1
-        st.session_state.last_selection = current_selection
-        st.session_state.form_data = {}
+        # Check if selection has changed
+        current_selection = f"{selected_student}_{term}_{session}"
+        if 'last_selection' not in st.session_state or st.session_state.last_selection != current_selection:
+            st.session_state.session_id += 1
+            st.session_state.last_selection = current_selection
+            st.session_state.form_data = {}
+            st.session_state.loaded_versions = {}
     
-    if student_name:
-        # Auto-fill student information if student is selected
-        # Filter by term and session as well
-        student_data_filtered = df_progress_all[
-            (df_progress_all["Student_Name"] == student_name) & 
-            (df_progress_all["Term"] == term) &
-            (df_progress_all["Session"] == session)
-        ]
+        if student_name:
+            # Auto-fill student information if student is selected
+            # Filter by term and session as well
+            student_data_filtered = progress_store.student_rows(student_name, selected_class, term, session)
         
-        if not student_data_filtered.empty:
-            student_data = student_data_filtered.iloc[0]
-            student_class = st.text_input("Class", value=student_data["Class"] if "Class" in student_data and pd.notna(student_data["Class"]) else "", key="class_input")
-            student_number = st.text_input("Number in Class", value=student_data.get("Number", ""), key="number_input")
+            if not student_data_filtered.empty:
+                student_data = student_data_filtered.iloc[0]
+                student_class = st.text_input("Class", value=student_data["Class"] if "Class" in student_data and pd.notna(student_data["Class"]) else "", key="class_input")
+                student_number = st.text_input("Number in Class", value=student_data["Number"] if "Number" in student_data and pd.notna(student_data["Number"]) else "", key="number_input")
             
-            # Get saved school info
-            school_name = st.text_input("School Name", value=student_data.get("School_Name", default_school_name), key="school_name_input")
-            school_address = st.text_input("School Address", value=student_data.get("School_Address", default_school_address), key="school_address_input")
+                # Get saved school info
+                school_name = st.text_input("School Name", value=student_data.get("School_Name", default_school_name), key="school_name_input")
+                school_address = st.text_input("School Address", value=student_data.get("School_Address", default_school_address), key="school_address_input")
             
-            # Get saved subjects for this student, term, and session
-            saved_subjects = student_data_filtered["Subject"].unique().tolist()
+                # Get saved subjects for this student, term, and session
+                saved_subjects = student_data_filtered["Subject"].unique().tolist()
             
-            # Get saved comments
-            if not student_data_filtered.empty:
-                class_teacher_comment_default = student_data_filtered.iloc[0].get("Teacher_Comment", "")
-                principal_comment_default = student_data_filtered.iloc[0].get("Principal_Comment", "")
+                # Get saved comments
+                if not student_data_filtered.empty:
+                    class_teacher_comment_default = student_data_filtered.iloc[0].get("Teacher_Comment", "")
+                    principal_comment_default = student_data_filtered.iloc[0].get("Principal_Comment", "")
+                else:
+                    class_teacher_comment_default = ""
+                    principal_comment_default = ""
             else:
-                class_teacher_comment_default = ""
-                principal_comment_default = ""
-        else:
-            # If no data for selected term/session, try to get from any record
-            student_data_any = df_progress_all[df_progress_all["Student_Name"] == student_name]
-            if not student_data_any.empty:
-                student_data = student_data_any.iloc[0]
-                student_class = st.text_input("Class", value=student_data["Class"] if "Class" in student_data and pd.notna(student_data["Class"]) else "", key="class_input_any")
-                student_number = st.text_input("Number in Class", value=student_data.get("Number", ""), key="number_input_any")
+                # If no data for selected term/session, try to get from any record
+                student_data_any = progress_store.student_any_rows(student_name)
+                # Prefer the class picked in the search, in case of namesakes in other classes
+                same_class = student_data_any[student_data_any["Class"].astype(object) == selected_class]
+                if not same_class.empty:
+                    student_data_any = same_class
+                if not student_data_any.empty:
+                    student_data = student_data_any.iloc[0]
+                    student_class = st.text_input("Class", value=student_data["Class"] if "Class" in student_data and pd.notna(student_data["Class"]) else "", key="class_input_any")
+                    student_number = st.text_input("Number in Class", value=student_data["Number"] if "Number" in student_data and pd.notna(student_data["Number"]) else "", key="number_input_any")
                 
-                # Get saved school info
-                school_name = st.text_input("School Name", value=student_data.get("School_Name", default_school_name), key="school_name_input_any")
-                school_address = st.text_input("School Address", value=student_data.get("School_Address", default_school_address), key="school_address_input_any")
+                    # Get saved school info
+                    school_name = st.text_input("School Name", value=student_data.get("School_Name", default_school_name), key="school_name_input_any")
+                    school_address = st.text_input("School Address", value=student_data.get("School_Address", default_school_address), key="school_address_input_any")
                 
-                # Get saved subjects from any term/session
-                saved_subjects = student_data_any["Subject"].unique().tolist()
+                    # Get saved subjects from any term/session
+                    saved_subjects = student_data_any["Subject"].unique().tolist()
                 
-                # Get saved comments
-                class_teacher_comment_default = student_data.get("Teacher_Comment", "")
-                principal_comment_default = student_data.get("Principal_Comment", "")
-            else:
-                student_class = st.text_input("Class", key="class_input_new")
-                student_number = st.text_input("Number in Class", key="number_input_new")
-                school_name = st.text_input("School Name", value=default_school_name, key="school_name_input_new")
-                school_address = st.text_input("School Address", value=default_school_address, key="school_address_input_new")
-                saved_subjects = []
-                class_teacher_comment_default = ""
-                principal_comment_default = ""
-    else:
-        # Allow entering new student name
-        new_student_name = st.text_input("Enter new student name", value="", key="new_student_input")
-        if new_student_name.strip():
-            student_name = new_student_name.strip()
-        student_class = st.text_input("Class (e.g., JSS2A)", key="class_input_new_student")
-        student_number = st.text_input("Number in Class", key="number_input_new_student")
+                    # Get saved comments
+                    class_teacher_comment_default = student_data.get("Teacher_Comment", "")
+                    principal_comment_default = student_data.get("Principal_Comment", "")
+                else:
+                    student_class = st.text_input("Class", key="class_input_new")
+                    student_number = st.text_input("Number in Class", key="number_input_new")
+                    school_name = st.text_input("School Name", value=default_school_name, key="school_name_input_new")
+                    school_address = st.text_input("School Address", value=default_school_address, key="school_address_input_new")
+                    saved_subjects = []
+                    class_teacher_comment_default = ""
+                    principal_comment_default = ""
+        else:
+            # Allow entering new student name
+            new_student_name = st.text_input("Enter new student name", value="", key="new_student_input")
+            if new_student_name.strip():
+                student_name = new_student_name.strip()
+            student_class = st.text_input("Class (e.g., JSS2A)", key="class_input_new_student")
+            student_number = st.text_input("Number in Class", key="number_input_new_student")
         
-        # School Info for new student
-        school_name = st.text_input("School Name", value=default_school_name, key="school_name_input_new_student")
-        school_address = st.text_input("School Address", value=default_school_address, key="school_address_input_new_student")
+            # School Info for new student
+            school_name = st.text_input("School Name", value=default_school_name, key="school_name_input_new_student")
+            school_address = st.text_input("School Address", value=default_school_address, key="school_address_input_new_student")
         
-        saved_subjects = []
-        class_teacher_comment_default = ""
-        principal_comment_default = ""
+            saved_subjects = []
+            class_teacher_comment_default = ""
+            principal_comment_default = ""
+
+        # Marks are kept per student, a name within a class. Saving is refused if someone
+        # else changes the picked student's marks after the form shows them.
+        owned_versions = st.session_state.loaded_versions
+        loaded_key = partition_key(student_name, selected_class, term, session) if selected_student else None
+        target_key = partition_key(student_name, student_class, term, session)
+        if loaded_key is not None and loaded_key not in owned_versions:
+            owned_versions[loaded_key] = progress_store.partition_version(*loaded_key)
+        # Marks for a new student, or a picked one whose class was changed, are not
+        # added to those of a student already saved under that name and class
+        new_partitions = [target_key] if student_name and target_key not in owned_versions else []
+        # A class change moves the picked student's marks out of their old class
+        moved_from = [loaded_key] if new_partitions and loaded_key is not None \
+            and owned_versions[loaded_key] is not None else []
+        namesake = bool(new_partitions) and progress_store.partition_version(*target_key) is not None
+        if namesake:
+            st.warning(f"⚠️ {term} {session} marks are already saved for a {student_name} in "
+                       f"{target_key[1] or 'no class'}. If it is the same student, pick that entry in the "
+                       "search to edit them; otherwise tell the two apart by name (e.g. add a middle initial).")
 
-    # Subjects - Fixed subjects
-    fixed_subjects = ["Mathematics", "English"]
+        # Subjects - Fixed subjects
+        fixed_subjects = ["Mathematics", "English"]
     
-    # Get custom subjects input
-    custom_subjects_input = st.text_input("Add other subjects (comma separated)", value="", key="custom_subjects_input")
+        # Get custom subjects input
+        custom_subjects_input = st.text_input("Add other subjects (comma separated)", value="", key="custom_subjects_input")
     
-    # Combine subjects, ensuring no duplicates
-    subjects = fixed_subjects.copy()
+        # Combine subjects, ensuring no duplicates
+        subjects = fixed_subjects.copy()
     
-    # Add custom subjects if provided
-    if custom_subjects_input:
-        custom_subjects = [s.strip() for s in custom_subjects_input.split(",") if s.strip()]
-        # Add only subjects that aren't already in the fixed subjects
-        for subject in custom_subjects:
-            if subject not in subjects:
-                subjects.append(subject)
+        # Add custom subjects if provided
+        if custom_subjects_input:
+            custom_subjects = [s.strip() for s in custom_subjects_input.split(",") if s.strip()]
+            # Add only subjects that aren't already in the fixed subjects
+            for subject in custom_subjects:
+                if subject not in subjects:
+                    subjects.append(subject)
     
-    # If we have saved subjects and no custom input, use saved subjects (excluding fixed ones)
-    elif saved_subjects and len(saved_subjects) > 0:
-        # Add saved subjects that aren't already in fixed subjects
-        for subject in saved_subjects:
-            if subject not in subjects:
-                subjects.append(subject)
-
-    # Store subjects in session state
-    st.session_state.subjects = subjects
-
-    # Filter previous data by term and session
-    df_student_prev = df_progress_all[
-        (df_progress_all["Student_Name"] == student_name) & 
-        (df_progress_all["Term"] == term) &
-        (df_progress_all["Session"] == session)
-    ] if not df_progress_all.empty and student_name else pd.DataFrame(columns=expected_columns)
-
-    records = []
-    total_obt_all = 0
-    total_max_all = 0
-    subjects_with_scores = 0
+        # If we have saved subjects and no custom input, use saved subjects (excluding fixed ones)
+        elif saved_subjects and len(saved_subjects) > 0:
+            # Add saved subjects that aren't already in fixed subjects
+            for subject in saved_subjects:
+                if subject not in subjects:
+                    subjects.append(subject)
+
+        # Store subjects in session state
+        st.session_state.subjects = subjects
+
+        # Filter previous data by term and session
+        form_key = target_key if target_key in owned_versions else loaded_key
+        df_student_prev = progress_store.student_rows(*form_key) \
+            if student_name and form_key else pd.DataFrame(columns=expected_columns)
+        # Index the student's saved rows by subject once instead of masking per subject
+        saved_rows_by_subject = {}
+        for saved in df_student_prev.to_dict("records"):
+            saved_rows_by_subject.setdefault(saved["Subject"], saved)
+
+        records = []
+        total_obt_all = 0
+        total_max_all = 0
+        subjects_with_scores = 0
     
-    # Use session ID for unique keys
-    session_id = st.session_state.session_id
+        # Use session ID for unique keys
+        session_id = st.session_state.session_id
     
-    for subject in subjects:
-        saved_row = df_student_prev[df_student_prev['Subject'] == subject]
-        # Set default values to empty string instead of 0
-        ca1_obt_default = saved_row['CA1_Obt'].values[0] if not saved_row.empty and saved_row['CA1_Obt'].values[0] not in ["", None] else ""
-        ca1_max_default = saved_row['CA1_Max'].values[0] if not saved_row.empty and saved_row['CA1_Max'].values[0] not in ["", None] else ""
-        ca2_obt_default = saved_row['CA2_Obt'].values[0] if not saved_row.empty and saved_row['CA2_Obt'].values[0] not in ["", None] else ""
-        ca2_max_default = saved_row['CA2_Max'].values[0] if not saved_row.empty and saved_row['CA2_Max'].values[0] not in ["", None] else ""
-        exam_obt_default = saved_row['Exam_Obt'].values[0] if not saved_row.empty and saved_row['Exam_Obt'].values[0] not in ["", None] else ""
-        exam_max_default = saved_row['Exam_Max'].values[0] if not saved_row.empty and saved_row['Exam_Max'].values[0] not in ["", None] else ""
-
-        st.subheader(f"{subject}")
-        col1, col2 = st.columns(2)
-        with col1:
-            # Use unique keys with session ID to avoid duplicates
-            ca1_obt = st.text_input(f"1st CA Obtained", 
-                                   value=str(st.session_state.form_data.get(f"{subject}_ca1_obt", ca1_obt_default)), 
-                                   key=f"{session_id}_{subject}_ca1_obt")
-            ca2_obt = st.text_input(f"2nd CA Obtained", 
-                                   value=str(st.session_state.form_data.get(f"{subject}_ca2_obt", ca2_obt_default)), 
-                                   key=f"{session_id}_{subject}_ca2_obt")
-            exam_obt = st.text_input(f"Exam Obtained", 
-                                    value=str(st.session_state.form_data.get(f"{subject}_exam_obt", exam_obt_default)), 
-                                    key=f"{session_id}_{subject}_exam_obt")
-        with col2:
-            ca1_max = st.text_input(f"1st CA Obtainable", 
-                                   value=str(st.session_state.form_data.get(f"{subject}_ca1_max", ca1_max_default)), 
-                                   key=f"{session_id}_{subject}_ca1_max")
-            ca2_max = st.text_input(f"2nd CA Obtainable", 
-                                   value=str(st.session_state.form_data.get(f"{subject}_ca2_max", ca2_max_default)), 
-                                   key=f"{session_id}_{subject}_ca2_max")
-            exam_max = st.text_input(f"Exam Obtainable", 
-                                    value=str(st.session_state.form_data.get(f"{subject}_exam_max", exam_max_default)), 
-                                    key=f"{session_id}_{subject}_exam_max")
-
-        # Store form data in session state
-        st.session_state.form_data[f"{subject}_ca1_obt"] = ca1_obt
-        st.session_state.form_data[f"{subject}_ca1_max"] = ca1_max
-        st.session_state.form_data[f"{subject}_ca2_obt"] = ca2_obt
-        st.session_state.form_data[f"{subject}_ca2_max"] = ca2_max
-        st.session_state.form_data[f"{subject}_exam_obt"] = exam_obt
-        st.session_state.form_data[f"{subject}_exam_max"] = exam_max
-
-        # Convert empty strings to 0 for calculation, but keep blanks for display
-        ca1_obt_num = float(ca1_obt) if ca1_obt.strip() else 0
-        ca1_max_num = float(ca1_max) if ca1_max.strip() else 0
-        ca2_obt_num = float(ca2_obt) if ca2_obt.strip() else 0
-        ca2_max_num = float(ca2_max) if ca2_max.strip() else 0
-        exam_obt_num = float(exam_obt) if exam_obt.strip() else 0
-        exam_max_num = float(exam_max) if exam_max.strip() else 0
-
-        # Check if any score is entered for this subject
-        has_scores = any([ca1_obt.strip(), ca1_max.strip(), ca2_obt.strip(), ca2_max.strip(), exam_obt.strip(), exam_max.strip()])
+        # Whole-sheet entry keeps edits in the browser until they are applied
+        batched_entry = st.toggle("Whole-sheet entry (apply all subjects at once)", key="batched_entry",
+                                  help="Edit every subject in one table; nothing reruns until Apply Marks")
+        with timer.section("Subject widgets"):
+            if batched_entry:
+                records, total_obt_all, total_max_all, subjects_with_scores = score_sheet_entry(
+                    subjects, saved_rows_by_subject, session_id, current_selection, grading_scale)
+            else:
+                for subject in subjects:
+                    saved_row = saved_rows_by_subject.get(subject, {})
+                    # Set default values to empty string instead of 0
+                    ca1_obt_default = saved_value(saved_row, 'CA1_Obt')
+                    ca1_max_default = saved_value(saved_row, 'CA1_Max')
+                    ca2_obt_default = saved_value(saved_row, 'CA2_Obt')
+                    ca2_max_default = saved_value(saved_row, 'CA2_Max')
+                    exam_obt_default = saved_value(saved_row, 'Exam_Obt')
+                    exam_max_default = saved_value(saved_row, 'Exam_Max')
+
+                    st.subheader(f"{subject}")
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        # Use unique keys with session ID to avoid duplicates
+                        ca1_obt = st.text_input(f"1st CA Obtained", 
+                                               value=str(st.session_state.form_data.get(f"{subject}_ca1_obt", ca1_obt_default)), 
+                                               key=f"{session_id}_{subject}_ca1_obt")
+                        ca2_obt = st.text_input(f"2nd CA Obtained", 
+                                               value=str(st.session_state.form_data.get(f"{subject}_ca2_obt", ca2_obt_default)), 
+                                               key=f"{session_id}_{subject}_ca2_obt")
+                        exam_obt = st.text_input(f"Exam Obtained", 
+                                                value=str(st.session_state.form_data.get(f"{subject}_exam_obt", exam_obt_default)), 
+                                                key=f"{session_id}_{subject}_exam_obt")
+                    with col2:
+                        ca1_max = st.text_input(f"1st CA Obtainable", 
+                                               value=str(st.session_state.form_data.get(f"{subject}_ca1_max", ca1_max_default)), 
+                                               key=f"{session_id}_{subject}_ca1_max")
+                        ca2_max = st.text_input(f"2nd CA Obtainable", 
+                                               value=str(st.session_state.form_data.get(f"{subject}_ca2_max", ca2_max_default)), 
+                                               key=f"{session_id}_{subject}_ca2_max")
+                        exam_max = st.text_input(f"Exam Obtainable", 
+                                                value=str(st.session_state.form_data.get(f"{subject}_exam_max", exam_max_default)), 
+                                                key=f"{session_id}_{subject}_exam_max")
+
+                    # Store form data in session state
+                    st.session_state.form_data[f"{subject}_ca1_obt"] = ca1_obt
+                    st.session_state.form_data[f"{subject}_ca1_max"] = ca1_max
+                    st.session_state.form_data[f"{subject}_ca2_obt"] = ca2_obt
+                    st.session_state.form_data[f"{subject}_ca2_max"] = ca2_max
+                    st.session_state.form_data[f"{subject}_exam_obt"] = exam_obt
+                    st.session_state.form_data[f"{subject}_exam_max"] = exam_max
+
+                    # Convert empty strings to 0 for calculation, but keep blanks for display
+                    ca1_obt_num = float(ca1_obt) if ca1_obt.strip() else 0
+                    ca1_max_num = float(ca1_max) if ca1_max.strip() else 0
+                    ca2_obt_num = float(ca2_obt) if ca2_obt.strip() else 0
+                    ca2_max_num = float(ca2_max) if ca2_max.strip() else 0
+                    exam_obt_num = float(exam_obt) if exam_obt.strip() else 0
+                    exam_max_num = float(exam_max) if exam_max.strip() else 0
+
+                    # Check if any score is entered for this subject
+                    has_scores = any([ca1_obt.strip(), ca1_max.strip(), ca2_obt.strip(), ca2_max.strip(), exam_obt.strip(), exam_max.strip()])
         
-        if has_scores:
-            total_obt = ca1_obt_num + ca2_obt_num + exam_obt_num
-            total_max = ca1_max_num + ca2_max_num + exam_max_num
-            total_obt_all += total_obt
-            total_max_all += total_max
-            subjects_with_scores += 1
-            grade, remark = calculate_grade_mark(total_obt, total_max)
-        else:
-            # Leave blank if no scores entered
-            total_obt = ""
-            total_max = ""
-            grade = ""
-            remark = ""
-
-        # Store the display values (keep blanks for empty fields)
-        records.append([subject, 
-                       ca1_obt if ca1_obt.strip() else "", 
-                       ca1_max if ca1_max.strip() else "",
-                       ca2_obt if ca2_obt.strip() else "", 
-                       ca2_max if ca2_max.strip() else "",
-                       exam_obt if exam_obt.strip() else "", 
-                       exam_max if exam_max.strip() else "",
-                       total_obt, 
-                       total_max,
-                       grade, 
-                       remark])
-
-    df_student = pd.DataFrame(records, columns=["Subject", "CA1_Obt", "CA1_Max", "CA2_Obt", "CA2_Max", "Exam_Obt", "Exam_Max", "Total_Obt", "Total_Max", "Grade", "Remark"])
+                    if has_scores:
+                        total_obt = ca1_obt_num + ca2_obt_num + exam_obt_num
+                        total_max = ca1_max_num + ca2_max_num + exam_max_num
+                        total_obt_all += total_obt
+                        total_max_all += total_max
+                        subjects_with_scores += 1
+                        grade, remark = calculate_grade_mark(total_obt, total_max, grading_scale)
+                    else:
+                        # Leave blank if no scores entered
+                        total_obt = ""
+                        total_max = ""
+                        grade = ""
+                        remark = ""
+
+                    # Store the display values (keep blanks for empty fields)
+                    records.append([subject, 
+                                   ca1_obt if ca1_obt.strip() else "", 
+                                   ca1_max if ca1_max.strip() else "",
+                                   ca2_obt if ca2_obt.strip() else "", 
+                                   ca2_max if ca2_max.strip() else "",
+                                   exam_obt if exam_obt.strip() else "", 
+                                   exam_max if exam_max.strip() else "",
+                                   total_obt, 
+                                   total_max,
+                                   grade, 
+                                   remark])
+
+        df_student = pd.DataFrame(records, columns=["Subject", "CA1_Obt", "CA1_Max", "CA2_Obt", "CA2_Max", "Exam_Obt", "Exam_Max", "Total_Obt", "Total_Max", "Grade", "Remark"])
     
-    # Calculate average only for subjects with scores
-    if subjects_with_scores > 0:
-        average_score = total_obt_all / subjects_with_scores
-    else:
-        average_score = 0
-
-    # Comments
-    class_teacher_comment = st.text_area("Class Teacher's Comment", value=class_teacher_comment_default, key="teacher_comment")
-    principal_comment = st.text_area("Principal's Comment", value=principal_comment_default, key="principal_comment")
-
-    # Preview
-    st.subheader("📄 Report Card Preview")
-    st.markdown(f"**{school_name}**")
-    st.markdown(f"*{school_address}*")
-    st.text(f"{term} {session} Academic Report Card")
-    st.text(f"Student Name: {student_name}")
-    st.text(f"Class: {student_class}")
-    st.text(f"No in Class: {student_number}")
-    st.dataframe(df_student)
-    st.text(f"Class Teacher's Comment: {class_teacher_comment}")
-    st.text(f"Principal's Comment: {principal_comment}")
-    st.text(f"Average Score: {average_score:.2f}")
-    st.text(f"Total Marks: {total_obt_all} / {total_max_all}")
-    percentage = (total_obt_all / total_max_all) * 100 if total_max_all > 0 else 0
-    st.text(f"Percentage: {percentage:.2f}%")
-    st.text(f"Subjects with scores: {subjects_with_scores}")
-
-    # Save Progress
-    if st.button("💾 Save Progress", key="save_button"):
-        # Save school info
-        school_info_df = pd.DataFrame({
-            "School_Name": [school_name],
-            "School_Address": [school_address]
-        })
-        school_info_df.to_csv(school_info_file, index=False)
-        
-        # Remove existing records for this student, term, and session
-        df_progress_all = df_progress_all[
-            ~((df_progress_all["Student_Name"] == student_name) & 
-              (df_progress_all["Term"] == term) &
-              (df_progress_all["Session"] == session))
-        ]
+        # Calculate average only for subjects with scores
+        if subjects_with_scores > 0:
+            average_score = total_obt_all / subjects_with_scores
+        else:
+            average_score = 0
+
+        # Comments
+        class_teacher_comment = st.text_area("Class Teacher's Comment", value=class_teacher_comment_default, key="teacher_comment")
+        principal_comment = st.text_area("Principal's Comment", value=principal_comment_default, key="principal_comment")
+
+        # Preview
+        st.subheader("📄 Report Card Preview")
+        st.markdown(f"**{school_name}**")
+        st.markdown(f"*{school_address}*")
+        st.text(f"{term} {session} Academic Report Card")
+        st.text(f"Student Name: {student_name}")
+        st.text(f"Class: {student_class}")
+        st.text(f"No in Class: {student_number}")
+        st.dataframe(df_student)
+        st.text(f"Class Teacher's Comment: {class_teacher_comment}")
+        st.text(f"Principal's Comment: {principal_comment}")
+        st.text(f"Average Score: {average_score:.2f}")
+        st.text(f"Total Marks: {total_obt_all} / {total_max_all}")
+        percentage = (total_obt_all / total_max_all) * 100 if total_max_all > 0 else 0
+        st.text(f"Percentage: {percentage:.2f}%")
+        st.text(f"Subjects with scores: {subjects_with_scores}")
+
+        # What the form holds now: a preview is only kept while it matches, so marks
+        # edited or saved since it was built never reach the preview or its PDF
+        form_version = partition_version(df_student.assign(
+            Student_Name=student_name, Class=student_class, Number=student_number, Term=term, Session=session,
+            Teacher_Comment=class_teacher_comment, Principal_Comment=principal_comment,
+            School_Name=school_name, School_Address=school_address))
+
+        def preview_version():
+            # Positions, class statistics and the annual summary change with the
+            # class's saved results for the session as well
+            return form_version, tuple(progress_store.version(each_term, session, student_class) for each_term in TERMS)
+
+        # Save Progress
+        if st.button("💾 Save Progress", key="save_button"):
+            # Save school info, only when it was edited
+            if (school_name, school_address) != (default_school_name, default_school_address):
+                storage_backend.save_school_info(school_name, school_address)
         
-        # Add new records - only include subjects with scores
-        new_records = []
-        for record in records:
-            subject_data = {
-                "Subject": record[0],
-                "CA1_Obt": record[1],
-                "CA1_Max": record[2],
-                "CA2_Obt": record[3],
-                "CA2_Max": record[4],
-                "Exam_Obt": record[5],
-                "Exam_Max": record[6],
-                "Total_Obt": record[7],
-                "Total_Max": record[8],
-                "Grade": record[9],
-                "Remark": record[10],
-                "Student_Name": student_name,
-                "Class": student_class,
-                "Term": term,
-                "Session": session,
-                "Teacher_Comment": class_teacher_comment,
-                "Principal_Comment": principal_comment,
-                "School_Name": school_name,
-                "School_Address": school_address
-            }
-            # Only save if the subject has at least one score
-            if any([record[1], record[2], record[3], record[4], record[5], record[6]]):
-                new_records.append(subject_data)
+            # Add new records - only include subjects with scores
+            new_records = []
+            for record in records:
+                subject_data = {
+                    "Subject": record[0],
+                    "CA1_Obt": record[1],
+                    "CA1_Max": record[2],
+                    "CA2_Obt": record[3],
+                    "CA2_Max": record[4],
+                    "Exam_Obt": record[5],
+                    "Exam_Max": record[6],
+                    "Total_Obt": record[7],
+                    "Total_Max": record[8],
+                    "Grade": record[9],
+                    "Remark": record[10],
+                    "Student_Name": student_name,
+                    "Class": student_class,
+                    "Number": student_number,
+                    "Term": term,
+                    "Session": session,
+                    "Teacher_Comment": class_teacher_comment,
+                    "Principal_Comment": principal_comment,
+                    "School_Name": school_name,
+                    "School_Address": school_address
+                }
+                # Only save if the subject has at least one score
+                if any([record[1], record[2], record[3], record[4], record[5], record[6]]):
+                    new_records.append(subject_data)
         
-        if new_records:
-            new_records_df = pd.DataFrame(new_records)
-            df_progress_all = pd.concat([df_progress_all, new_records_df], ignore_index=True)
-            df_progress_all.to_csv(progress_file, index=False)
-            st.success(f"Progress saved for {student_name} ({term}, {session})! {len(new_records)} subjects with scores saved.")
-        else:
-            st.warning("No subjects with scores to save.")
+            if new_records:
+                # Replaces this student's term/session records; other rows are left alone
+                new_records_df = pd.DataFrame(new_records)
+                expected_versions = {key: owned_versions[key] for key in (loaded_key, target_key)
+                                     if key in owned_versions}
+                try:
+                    progress_store.save_records(new_records_df, expected_versions=expected_versions,
+                                                new_partitions=new_partitions, cleared=moved_from)
+                except NamesakeError:
+                    namesake = True
+                    st.error(f"❌ Not saved: {term} {session} marks are already saved for a {student_name} "
+                             f"in {target_key[1] or 'no class'}.")
+                except StaleWriteError:
+                    # Keep the entered marks so the teacher can choose what to do
+                    st.session_state.save_conflict = target_key
+                else:
+                    for key in {loaded_key, target_key} - {None}:
+                        owned_versions[key] = progress_store.partition_version(*key)
+                    st.session_state.save_conflict = None
+                    saved_notice = f"Progress saved for {student_name} ({term}, {session})! {len(new_records)} subjects with scores saved."
+                    if moved_from:
+                        # Reopen the student under the class they were moved to
+                        st.session_state.reselect_student = (student_name, target_key[1], session)
+                        st.session_state.save_notice = saved_notice
+                        st.rerun()
+                    st.success(saved_notice)
+            else:
+                st.warning("No subjects with scores to save.")
         
-        # Clear form data after saving
-        st.session_state.form_data = {}
-
-    # PDF Preview & Download
-    if st.button("📥 Generate PDF & Download / Preview", key="pdf_button"):
-        # Filter out subjects with no scores for PDF
-        df_student_for_pdf = df_student.copy()
-        # Remove rows where all score columns are empty
-        score_columns = ["CA1_Obt", "CA1_Max", "CA2_Obt", "CA2_Max", "Exam_Obt", "Exam_Max"]
-        df_student_for_pdf = df_student_for_pdf[df_student_for_pdf[score_columns].apply(lambda x: any(pd.notna(val) and str(val).strip() != "" for val in x), axis=1)]
+            # Clear form data after saving
+            if st.session_state.save_conflict != target_key and not namesake:
+                st.session_state.form_data = {}
+        if st.session_state.save_notice:
+            st.success(st.session_state.save_notice)
+            st.session_state.save_notice = None
+
+        if st.session_state.save_conflict == target_key:
+            st.warning(f"⚠️ Someone else saved marks for {student_name} ({term}, {session}) after you opened them, "
+                       "so yours were not saved.")
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("🔄 Load their marks", key="conflict_reload_button"):
+                    st.session_state.session_id += 1
+                    st.session_state.form_data = {}
+                    for key in (loaded_key, target_key):
+                        owned_versions.pop(key, None)
+                    st.session_state.save_conflict = None
+                    st.rerun()
+            with col2:
+                if st.button("✏️ Keep my marks", key="conflict_keep_button",
+                             help="Then click Save Progress again to replace their marks with yours"):
+                    for key in {loaded_key, target_key} - {None}:
+                        owned_versions[key] = progress_store.partition_version(*key)
+                    st.session_state.save_conflict = None
+                    st.rerun()
+
+        # Report card preview & PDF download
+        if st.button("👁️ Preview Report Card", key="pdf_button"):
+            # Filter out subjects with no scores for PDF
+            df_student_for_pdf = df_student.copy()
+            # Remove rows where all score columns are empty
+            score_columns = ["CA1_Obt", "CA1_Max", "CA2_Obt", "CA2_Max", "Exam_Obt", "Exam_Max"]
+            df_student_for_pdf = df_student_for_pdf[df_student_for_pdf[score_columns].apply(lambda x: any(pd.notna(val) and str(val).strip() != "" for val in x), axis=1)]
         
-        pdf_buffer = create_pdf(
-            school_name=school_name,
-            school_address=school_address,
-            student_name=student_name,
-            student_class=student_class,
-            student_number=student_number,
-            term=term,
-            session=session,
-            df=df_student_for_pdf,
-            total_obt=total_obt_all,
-            total_max=total_max_all,
-            average=average_score,
-            class_teacher_comment=class_teacher_comment,
-            principal_comment=principal_comment
-        )
+            # Position among the saved results of the student's class, and each
+            # subject's class average, highest and lowest
+            position, class_size = rankings.student_position(student_name, student_class, term, session)
+            df_student_for_pdf = with_class_statistics(df_student_for_pdf,
+                                                       class_stats.class_statistics(term, session, student_class))
 
-        # PDF Preview in browser
-        pdf_bytes = pdf_buffer.getvalue()
-        b64 = base64.b64encode(pdf_bytes).decode()
-        pdf_display = f'<iframe src="data:application/pdf;base64,{b64}" width="100%" height="600px"></iframe>'
-        st.markdown(pdf_display, unsafe_allow_html=True)
+            # The preview is HTML built once here; the PDF is only rendered when downloaded
+            with timer.section("Build report card preview"):
+                st.session_state.preview_card = dict(
+                    school_name=school_name,
+                    school_address=school_address,
+                    student_name=student_name,
+                    student_class=student_class,
+                    student_number=student_number,
+                    term=term,
+                    session=session,
+                    df=df_student_for_pdf,
+                    total_obt=total_obt_all,
+                    total_max=total_max_all,
+                    average=average_score,
+                    class_teacher_comment=class_teacher_comment,
+                    principal_comment=principal_comment,
+                    position=position,
+                    class_size=class_size,
+                    annual=annual.student_summary(student_name, student_class, session) if term == FINAL_TERM else None,
+                    logo_path=logo_path
+                )
+                st.session_state.preview_html = card_html(st.session_state.preview_card)
+                st.session_state.preview_version = preview_version()
 
-        # Download button
-        st.download_button("📥 Download PDF", data=pdf_buffer,
-                           file_name=f"{student_name}_report_card_{term}_{session}.pdf", mime="application/pdf", key="download_button")
+        # Preview in the page; the download button renders the PDF on the shared
+        # queue (or takes it from the PDF cache) only when it is clicked
+        if st.session_state.preview_card and st.session_state.preview_version != preview_version():
+            st.session_state.preview_card = st.session_state.preview_html = None
+        if st.session_state.preview_card:
+            preview_card, render_owner = st.session_state.preview_card, st.session_state.render_owner
+            st.html(st.session_state.preview_html)
+            st.download_button("📥 Download PDF",
+                               data=lambda: render_queue.render(render_owner, preview_card, grading_scale),
+                               file_name=card_file_name(preview_card),
+                               mime="application/pdf", on_click="ignore", key="pdf_download_button")
 
-with tab2:
-    st.subheader("Saved Progress / Export")
+with tab2, timer.section("Saved Data / Export"):
+    if tab2.open:
+        st.subheader("Saved Progress / Export")
     
-    # Filter by term and session
-    col1, col2 = st.columns(2)
-    with col1:
-        filter_term = st.selectbox("Filter by Term", options=["All"] + terms, key="filter_term")
-    with col2:
-        filter_session = st.selectbox("Filter by Session", options=["All"] + sessions, key="filter_session")
+        # Filter by term and session
+        col1, col2 = st.columns(2)
+        with col1:
+            filter_term = st.selectbox("Filter by Term", options=["All"] + terms, key="filter_term")
+        with col2:
+            filter_session = st.selectbox("Filter by Session", options=["All"] + sessions, key="filter_session")
     
-    # Apply filters
-    filtered_df = df_progress_all.copy()
-    if filter_term != "All":
-        filtered_df = filtered_df[filtered_df["Term"] == filter_term]
-    if filter_session != "All":
-        filtered_df = filtered_df[df_progress_all["Session"] == filter_session]
+        # Apply filters
+        filtered_df = progress_store.term_rows(
+            term=None if filter_term == "All" else filter_term,
+            session=None if filter_session == "All" else filter_session
+        )
     
-    # Pivot the data to show each student only once with their scores
-    if not filtered_df.empty:
-        # Create a pivot table with student names as index and subjects as columns
-        pivot_df = filtered_df.pivot_table(
-            index=["Student_Name", "Class", "Term", "Session"],
-            columns="Subject",
-            values="Total_Obt",
-            aggfunc="first"
-        ).reset_index()
-        
-        # Fill NaN values with empty string instead of 0
-        pivot_df = pivot_df.fillna("")
-        
-        st.dataframe(pivot_df)
-        
-        csv_bytes = pivot_df.to_csv(index=False).encode()
-        st.download_button("Download filtered progress as CSV", data=csv_bytes,
-                           file_name="filtered_student_progress.csv", mime="text/csv", key="csv_download_button")
-    else:
-        st.info("No data available for the selected filters.")
+        # Pivot the data to show each student only once with their scores
+        if not filtered_df.empty:
+            # Student names as index and subjects as columns, kept on the store until a save
+            # touches the filter; only the page on screen is formatted and sent
+            pivot_df = score_tables(progress_store).pivot(
+                term=None if filter_term == "All" else filter_term,
+                session=None if filter_session == "All" else filter_session)
+            subject_columns = [column for column in pivot_df.columns
+                               if column not in ("Student_Name", "Class", "Term", "Session")]
+            paged_dataframe(pivot_df, "saved_table",
+                            format_page=lambda rows: rows.assign(**{column: score_text(rows[column])
+                                                                    for column in subject_columns}))
+
+            # Broadsheet: every subject's CA1/CA2/Exam/Total/Grade per student with totals and
+            # position, written one class at a time only when a download is clicked
+            st.markdown("**Broadsheet export**")
+            all_classes_label = "All classes"
+            # The cumulative broadsheet covers every term of the chosen session
+            export_annual = filter_session != "All" and st.checkbox(
+                "Annual (cumulative) broadsheet", key="export_annual",
+                help="Each student's term totals, cumulative average, position and promotion decision for the session")
+            export_classes = annual.classes(filter_session) if export_annual else \
+                sorted(filtered_df["Class"].dropna().astype(str).unique().tolist())
+            export_class = st.selectbox("Class", options=[all_classes_label] + export_classes, key="export_class")
+            export_args = dict(term=None if filter_term == "All" or export_annual else filter_term,
+                               session=None if filter_session == "All" else filter_session,
+                               class_name=None if export_class == all_classes_label else export_class,
+                               annual=annual if export_annual else None)
+            export_stem = "_".join(["broadsheet", export_class, "Annual" if export_annual else filter_term,
+                                    filter_session]).replace("/", "-").replace(" ", "_")
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button("Download broadsheet as CSV",
+                                   data=lambda: export_broadsheet(progress_store, rankings, **export_args),
+                                   file_name=f"{export_stem}.csv", mime="text/csv", key="csv_download_button")
+            with col2:
+                if not XLSX_AVAILABLE:
+                    st.caption("Install openpyxl for Excel broadsheets.")
+                else:
+                    st.download_button("Download broadsheet as Excel",
+                                       data=lambda: export_broadsheet(progress_store, rankings, file_format="xlsx",
+                                                                      **export_args),
+                                       file_name=f"{export_stem}.xlsx", key="xlsx_download_button",
+                                       mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        else:
+            st.info("No data available for the selected filters.")
 
-with tab3:
-    st.subheader("Overall Best Students")
+with tab3, timer.section("Overall Best Students"):
+    if tab3.open:
+        st.subheader("Overall Best Students")
     
-    # Filter by term and session
-    col1, col2 = st.columns(2)
-    with col1:
-        best_term = st.selectbox("Term", options=terms, key="best_term")
-    with col2:
-        best_session = st.selectbox("Academic Session", options=sessions, key="best_session")
+        # Filter by term and session
+        col1, col2 = st.columns(2)
+        annual_label = "Annual (cumulative)"
+        with col1:
+            best_term = st.selectbox("Term", options=terms + [annual_label], key="best_term")
+        with col2:
+            best_session = st.selectbox("Academic Session", options=sessions, key="best_session")
     
-    # Calculate overall performance
-    if not df_progress_all.empty:
-        # Filter by selected term and session
-        filtered_df = df_progress_all[
-            (df_progress_all["Term"] == best_term) & 
-            (df_progress_all["Session"] == best_session)
-        ]
-        
-        if not filtered_df.empty:
-            # Convert string values to numeric, treating empty strings as NaN
-            filtered_df_numeric = filtered_df.copy()
-            numeric_cols = ["Total_Obt", "Total_Max"]
-            for col in numeric_cols:
-                filtered_df_numeric[col] = pd.to_numeric(filtered_df_numeric[col], errors='coerce')
+        # Calculate overall performance
+        if best_term == annual_label:
+            # Ranked on the cumulative percentage over the session's terms
+            annual_classes = annual.classes(best_session)
+            if annual_classes:
+                best_class = st.selectbox("Class", options=["All classes"] + annual_classes, key="best_class")
+                annual_table = annual.annual_ranking(best_session, None if best_class == "All classes" else best_class)
+                display_columns = ["Position", "Student_Name", "Class"] + terms \
+                    + ["Total_Obt", "Total_Max", "Average", "Percentage", "Decision"]
+                shown = ranking_view("best")
+                if shown is None:
+                    paged_dataframe(annual_table, "best_table", columns=display_columns,
+                                    column_config={"Percentage": st.column_config.NumberColumn(format="%.2f%%")})
+                else:
+                    st.dataframe(top_n(annual_table, shown)[display_columns], hide_index=True,
+                                 column_config={"Percentage": st.column_config.NumberColumn(format="%.2f%%")})
+            else:
+                st.info(f"No data available for {best_session}")
+        elif not progress_store.empty:
+            best_classes = progress_store.classes(best_term, best_session)
+            if best_classes:
+                best_class = st.selectbox("Class", options=["All classes"] + best_classes, key="best_class")
             
-            # Remove rows with NaN values (subjects without scores)
-            filtered_df_numeric = filtered_df_numeric.dropna(subset=numeric_cols)
+                # Ranked with ties sharing a position (1st, 2nd, 2nd, 4th, ...)
+                student_totals = rankings.overall_ranking(best_term, best_session,
+                                                          None if best_class == "All classes" else best_class)
             
-            if not filtered_df_numeric.empty:
-                # Calculate total marks and percentage for each student
-                student_totals = filtered_df_numeric.groupby(["Student_Name", "Class"]).agg({
-                    "Total_Obt": "sum",
-                    "Total_Max": "sum"
-                }).reset_index()
-                
-                student_totals["Percentage"] = (student_totals["Total_Obt"] / student_totals["Total_Max"]) * 100
-                
-                # Sort by percentage in descending order
-                student_totals = student_totals.sort_values("Percentage", ascending=False)
-                
-                # Add position column with ordinal numbers (1st, 2nd, 3rd, etc.)
-                student_totals["Position"] = [get_ordinal_position(i+1) for i in range(len(student_totals))]
-                
-                # Format the display
-                display_df = student_totals[["Position", "Student_Name", "Class", "Total_Obt", "Total_Max", "Percentage"]].copy()
-                display_df["Percentage"] = display_df["Percentage"].round(2).astype(str) + "%"
-                
-                st.dataframe(display_df)
+                if not student_totals.empty:
+                    # Format the display
+                    display_columns = ["Position", "Student_Name", "Class", "Total_Obt", "Total_Max", "Percentage"]
+                    shown = ranking_view("best")
+                    if shown is None:
+                        paged_dataframe(student_totals, "best_table", columns=display_columns,
+                                        column_config={"Percentage": st.column_config.NumberColumn(format="%.2f%%")})
+                    else:
+                        st.dataframe(top_n(student_totals, shown)[display_columns], hide_index=True,
+                                     column_config={"Percentage": st.column_config.NumberColumn(format="%.2f%%")})
+                else:
+                    st.info(f"No students with complete score data for {best_term}, {best_session}")
             else:
-                st.info(f"No students with complete score data for {best_term}, {best_session}")
+                st.info(f"No data available for {best_term}, {best_session}")
         else:
-            st.info(f"No data available for {best_term}, {best_session}")
-    else:
-        st.info("No student data available yet.")
+            st.info("No student data available yet.")
 
-with tab4:
-    st.subheader("Best Performing Students by Subject")
+with tab4, timer.section("Subject Best Students"):
+    if tab4.open:
+        st.subheader("Best Performing Students by Subject")
     
-    # Filter by term and session
-    col1, col2 = st.columns(2)
-    with col1:
-        subject_term = st.selectbox("Term", options=terms, key="subject_term")
-    with col2:
-        subject_session = st.selectbox("Academic Session", options=sessions, key="subject_session")
+        # Filter by term and session
+        col1, col2 = st.columns(2)
+        with col1:
+            subject_term = st.selectbox("Term", options=terms, key="subject_term")
+        with col2:
+            subject_session = st.selectbox("Academic Session", options=sessions, key="subject_session")
     
-    # Get unique subjects
-    if not df_progress_all.empty:
-        # Filter by selected term and session
-        filtered_df = df_progress_all[
-            (df_progress_all["Term"] == subject_term) & 
-            (df_progress_all["Session"] == subject_session)
-        ]
-        
-        if not filtered_df.empty:
-            # Convert to numeric and remove empty scores
-            filtered_df_numeric = filtered_df.copy()
-            numeric_cols = ["Total_Obt", "Total_Max"]
-            for col in numeric_cols:
-                filtered_df_numeric[col] = pd.to_numeric(filtered_df_numeric[col], errors='coerce')
+        # Get unique subjects
+        if not progress_store.empty:
+            subject_classes = progress_store.classes(subject_term, subject_session)
+            if subject_classes:
+                subjects = rankings.subjects(subject_term, subject_session)
             
-            filtered_df_numeric = filtered_df_numeric.dropna(subset=numeric_cols)
-            
-            if not filtered_df_numeric.empty:
-                subjects = filtered_df_numeric["Subject"].unique()
-                selected_subject = st.selectbox("Select Subject", options=subjects, key="subject_select")
-                
-                # Get data for selected subject
-                subject_data = filtered_df_numeric[filtered_df_numeric["Subject"] == selected_subject].copy()
-                subject_data["Percentage"] = (subject_data["Total_Obt"] / subject_data["Total_Max"]) * 100
+                if subjects:
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        selected_subject = st.selectbox("Select Subject", options=subjects, key="subject_select")
+                    with col2:
+                        subject_class = st.selectbox("Class", options=["All classes"] + subject_classes, key="subject_class")
                 
-                # Sort by percentage in descending order
-                subject_data = subject_data.sort_values("Percentage", ascending=False)
+                    # Ranked with ties sharing a position
+                    subject_data = rankings.subject_ranking(subject_term, subject_session, selected_subject,
+                                                            None if subject_class == "All classes" else subject_class)
                 
-                # Add position column with ordinal numbers (1st, 2nd, 3rd, etc.)
-                subject_data["Position"] = [get_ordinal_position(i+1) for i in range(len(subject_data))]
-                
-                # Format the display
-                display_df = subject_data[["Position", "Student_Name", "Class", "Total_Obt", "Total_Max"]].copy()
-                
-                st.dataframe(display_df)
+                    # Format the display
+                    display_columns = ["Position", "Student_Name", "Class", "Total_Obt", "Total_Max"]
+                    shown = ranking_view("subject")
+                    if shown is None:
+                        paged_dataframe(subject_data, "subject_table", columns=display_columns)
+                    else:
+                        st.dataframe(top_n(subject_data, shown)[display_columns], hide_index=True)
+                else:
+                    st.info(f"No subjects with complete score data for {subject_term}, {subject_session}")
             else:
-                st.info(f"No subjects with complete score data for {subject_term}, {subject_session}")
+                st.info(f"No data available for {subject_term}, {subject_session}")
         else:
-            st.info(f"No data available for {subject_term}, {subject_session}")
-    else:
-        st.info("No student data available yet.")
+            st.info("No student data available yet.")
+
+with tab5, timer.section("Batch Report Cards"):
+    if tab5.open:
+        st.subheader("🖨️ Batch Report Cards")
+        st.info("Generate report cards for a whole class or the whole school at once")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            batch_term = st.selectbox("Term", options=terms, key="batch_term")
+        with col2:
+            batch_session = st.selectbox("Academic Session", options=sessions, key="batch_session")
+
+        batch_df = progress_store.term_rows(batch_term, batch_session)
+        if not batch_df.empty:
+            all_classes_label = "All classes (whole school)"
+            class_options = sorted(batch_df["Class"].dropna().astype(str).unique().tolist())
+            batch_class = st.selectbox("Class", options=[all_classes_label] + class_options, key="batch_class")
+
+            batch_output = st.radio("Output", options=["One merged PDF", "Zip of per-student PDFs"], key="batch_output")
+            st.caption(f"Report cards render in the background on {render_queue.workers} worker(s) shared by everyone "
+                       f"using the app; {render_queue.queued_cards()} cards are waiting. You can keep working meanwhile.")
+
+            if st.button("🖨️ Generate Report Cards", key="batch_button"):
+                cards = collect_cards(batch_df, batch_term, batch_session,
+                                      class_name=None if batch_class == all_classes_label else batch_class,
+                                      school_name=default_school_name, school_address=default_school_address,
+                                      annual=annual.summaries(batch_session) if batch_term == FINAL_TERM else None,
+                                      statistics=class_stats.term_statistics(batch_term, batch_session),
+                                      scale=grading_scale, logo_path=logo_path)
+                if cards:
+                    zipped = batch_output.startswith("Zip")
+                    scope = "all_classes" if batch_class == all_classes_label else batch_class
+                    file_stem = f"report_cards_{scope}_{batch_term}_{batch_session}".replace("/", "-")
+                    with timer.section("Submit render job"):
+                        render_queue.submit(st.session_state.render_owner, cards, grading_scale,
+                                            output="zip" if zipped else "merged",
+                                            file_name=f"{file_stem}.zip" if zipped else f"{file_stem}.pdf",
+                                            label=f"{'All classes' if scope == 'all_classes' else scope}, {batch_term} {batch_session}")
+                else:
+                    st.info("No students with scores for the selected class.")
+        else:
+            st.info(f"No data available for {batch_term}, {batch_session}")
+
+        # This session's batch jobs, newest first, including ones started before switching tabs
+        batch_jobs = sorted((job for job in render_queue.jobs_for(st.session_state.render_owner) if job.output != "single"),
+                            key=lambda job: job.submitted_at, reverse=True)
+        if batch_jobs:
+            st.subheader("Report card jobs")
+            render_jobs_panel(render_queue, [job.id for job in batch_jobs])
+
+with tab6, timer.section("Import Scores"):
+    if tab6.open:
+        st.header("📥 Import Scores from a Spreadsheet")
+        st.caption("Upload a class or subject sheet (CSV or Excel). Columns are matched to the score fields below; "
+                   "anything the sheet does not have can be set for the whole sheet.")
+        import_file = st.file_uploader("Score sheet", type=["csv", "xlsx"], key="import_file")
+        if import_file is not None:
+            try:
+                sheet = read_sheet(import_file)
+            except (ValueError, pd.errors.ParserError) as e:
+                st.error(f"❌ {e}")
+                sheet = None
+            if sheet is not None:
+                st.dataframe(sheet.head())
+                not_in_sheet = "(not in sheet)"
+                guessed = guess_mapping(sheet.columns)
+                sheet_options = [not_in_sheet] + list(sheet.columns)
+                mapping = {}
+                with st.expander("Column mapping", expanded=True):
+                    map_cols = st.columns(3)
+                    for i, column in enumerate(IMPORT_COLUMNS):
+                        with map_cols[i % 3]:
+                            choice = st.selectbox(column, options=sheet_options,
+                                                  index=sheet_options.index(guessed.get(column, not_in_sheet)),
+                                                  key=f"import_map_{column}")
+                        mapping[column] = None if choice == not_in_sheet else choice
+
+                st.subheader("Values for the whole sheet")
+                col1, col2 = st.columns(2)
+                with col1:
+                    import_term = st.selectbox("Term", options=terms, key="import_term")
+                    import_class = st.text_input("Class (if the sheet has no class column)", key="import_class")
+                with col2:
+                    import_session = st.selectbox("Academic Session", options=sessions, key="import_session")
+                    import_subject = st.text_input("Subject (if the sheet has no subject column)", key="import_subject")
+                max_cols = st.columns(3)
+                default_maxima = {}
+                for max_col, column in zip(max_cols, MAXIMUM_COLUMNS):
+                    with max_col:
+                        default_maxima[column] = st.text_input(f"{column} (used where blank)", key=f"import_{column}")
+                known_subjects = sorted(set(st.session_state.subjects) |
+                                        set(progress_store.df["Subject"].dropna().astype(str)))
+                allowed_subjects = st.text_input("Allowed subjects (comma separated, blank allows any)",
+                                                 value=", ".join(known_subjects), key="import_subjects")
+
+                if st.button("📥 Import Scores", key="import_button"):
+                    defaults = {"Term": import_term, "Session": import_session, "Class": import_class,
+                                "Subject": import_subject, "School_Name": default_school_name,
+                                "School_Address": default_school_address, **default_maxima}
+                    result = validate_scores(sheet, mapping, defaults,
+                                             known_subjects=[subject.strip() for subject in allowed_subjects.split(",") if subject.strip()],
+                                             scale=grading_scale)
+                    accepted = keep_saved_comments(result.accepted, progress_store.term_rows(
+                        None if mapping["Term"] else import_term,
+                        None if mapping["Session"] else import_session), mapping)
+                    if not accepted.empty:
+                        # One write for the whole sheet; other subjects already saved are kept
+                        progress_store.save_records(accepted, replace_partitions=False)
+                        st.success(f"✅ {len(accepted)} rows imported "
+                                   f"for {len(accepted.drop_duplicates(['Student_Name', 'Class']))} students.")
+                    if len(result.rejected):
+                        st.warning(f"⚠️ {len(result.rejected)} rows rejected.")
+                        st.dataframe(result.rejected)
+                        st.download_button("Download rejected rows", data=result.rejected.to_csv(index=False).encode(),
+                                           file_name="rejected_rows.csv", mime="text/csv", key="import_rejected_download")
+                    elif accepted.empty:
+                        st.info("The sheet has no rows to import.")
+
+with tab7, timer.section("Class Statistics"):
+    if tab7.open:
+        st.subheader("📊 Class Statistics")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            stats_term = st.selectbox("Term", options=terms, key="stats_term")
+        with col2:
+            stats_session = st.selectbox("Academic Session", options=sessions, key="stats_session")
+
+        stats_classes = progress_store.classes(stats_term, stats_session)
+        if stats_classes:
+            stats_class = st.selectbox("Class", options=stats_classes, key="stats_class")
+            # Each subject's class average, highest and lowest total, spread and pass rate
+            class_table = class_stats.class_statistics(stats_term, stats_session, stats_class)
+            st.dataframe(class_table[["Subject", "Students", "Mean", "Highest", "Lowest", "Std",
+                                      "Mean_Percentage", "Pass_Rate"]].round(2), hide_index=True)
+
+            # For the principal: every class combined, hardest subject first
+            st.markdown("**Subject difficulty (all classes)**")
+            difficulty = class_stats.subject_difficulty(stats_term, stats_session)
+            st.dataframe(difficulty.round(2), hide_index=True)
+        else:
+            st.info(f"No data available for {stats_term}, {stats_session}")
+
+# ---------- Rerun timings ----------
+timer.finish()
+if timer.enabled:
+    st.session_state.timing_reruns += 1
+    timer.log(session=st.session_state.timing_session, rerun=st.session_state.timing_reruns,
+              storage=storage_backend.kind, records=len(progress_store.df))
+    with timing_panel:
+        st.caption(f"Rerun {st.session_state.timing_reruns}: {timer.total_ms:.1f} ms in total")
+        st.dataframe(pd.DataFrame(timer.breakdown()), hide_index=True)
+        cache_stats = get_pdf_cache().stats()
+        st.caption(f"PDF cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                   f"{cache_stats['memory_entries']} cards ({cache_stats['memory_bytes'] / 1024:,.0f} KiB) in memory")
+        if timer.memory_peak_kb is not None:
+            st.caption(f"Peak traced memory: {timer.memory_peak_kb:,.0f} KiB")
+            st.code(timer.memory_text, language=None)
+        if timer.profile_text:
+            st.code(timer.profile_text, language=None)
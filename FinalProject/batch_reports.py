@@ -0,0 +1,149 @@
+import os
+import zipfile
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pypdf import PdfWriter
+from storage import STUDENT_TERM_KEY
+from report_card import LOGO_FILE, card_from_rows, create_pdf
+from rankings import class_positions
+from annual import FINAL_TERM, annual_results, annual_summaries, term_aggregates
+from class_statistics import subject_statistics, with_class_statistics
+from grading import load_scale
+from pdf_cache import card_key, card_partition
+
+
+def collect_cards(df, term, session, class_name=None, school_name=None, school_address=None, annual=None,
+                  statistics=None, scale=None, logo_path=LOGO_FILE):
+    # One card per student in the (term, session), optionally limited to a class;
+    # ordered by class then name so a merged print run comes out sorted.
+    # Final-term cards carry the cumulative results: `annual` maps (student,
+    # class) to annual.annual_summaries entries, and is worked out from the session's
+    # rows in `df` when not given. Likewise `statistics` (subject_statistics
+    # rows for the term) supplies each subject's class average/highest/lowest.
+    # `scale` and `logo_path` are the school's, for sharded installs.
+    pass_mark = (scale or load_scale()).pass_percent()
+    if term == FINAL_TERM and annual is None:
+        annual = annual_summaries(annual_results(term_aggregates(df[df["Session"] == session]), pass_mark))
+    df = df[(df["Term"] == term) & (df["Session"] == session)]
+    if class_name is not None:
+        df = df[df["Class"] == class_name]
+    if df.empty:
+        return []
+    # Positions and class statistics are worked out once for the whole term, not per card
+    positions = class_positions(df)
+    if statistics is None:
+        statistics = subject_statistics(df, pass_mark)
+    statistics = statistics[(statistics["Term"] == term) & (statistics["Session"] == session)]
+    class_statistics = {name: stats for name, stats in statistics.groupby("Class", sort=False, observed=True)}
+    cards = []
+    for _, rows in df.groupby(STUDENT_TERM_KEY, sort=False, observed=True):
+        card = card_from_rows(rows, school_name, school_address)
+        card["logo_path"] = logo_path
+        if not card["df"].empty:
+            card["df"] = with_class_statistics(card["df"], class_statistics.get(card["student_class"], statistics.iloc[:0]))
+            card["position"], card["class_size"] = positions.get(
+                (card["student_name"], card["student_class"]), (None, None))
+            if annual:
+                card["annual"] = annual.get((card["student_name"], card["student_class"]))
+            cards.append(card)
+    cards.sort(key=lambda card: (str(card["student_class"]), str(card["student_name"])))
+    return cards
+
+
+def card_file_name(card):
+    # Namesakes in different classes get files of their own. Sessions look like
+    # 2024/2025, which would turn into folders inside a zip.
+    student = "_".join(part for part in (card["student_name"], card["student_class"]) if part)
+    name = f"{student}_report_card_{card['term']}_{card['session']}.pdf"
+    return name.replace("/", "-").replace("\\", "-")
+
+
+def render_card(index, card):
+    # Runs in a worker process; failures come back as data so one bad card
+    # never aborts the rest of the batch
+    try:
+        return index, create_pdf(**card).getvalue(), None
+    except Exception as e:
+        return index, None, f"{type(e).__name__}: {e}"
+
+
+class BatchResult:
+    def __init__(self, data, rendered, failures):
+        self.data = data
+        self.rendered = rendered
+        self.failures = failures  # [(student_name, student_class, error)]
+
+
+def render_cards(cards, scale, workers=None, progress=None, cache=None):
+    # Returns the PDF bytes per card (None where rendering failed) and the
+    # failures. With a pdf_cache.PdfCache, cached cards are not rendered again;
+    # `scale` is the grading scale the cards were collected with, part of their keys.
+    total = len(cards)
+    pdfs = [None] * total
+    failures = []
+    if total == 0:
+        return pdfs, failures
+    keys = [None] * total
+    if cache is not None:
+        for index, card in enumerate(cards):
+            keys[index] = card_key(card, scale)
+            pdfs[index] = cache.get(keys[index])
+    todo = [index for index in range(total) if pdfs[index] is None]
+    done = total - len(todo)
+    if progress and done:
+        progress(done, total)
+    if not todo:
+        return pdfs, failures
+    workers = max(1, min(workers or os.cpu_count() or 1, len(todo)))
+    # spawn keeps workers clear of the Streamlit server's threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = {executor.submit(render_card, index, cards[index]): index for index in todo}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                _, pdf, error = future.result()
+            except Exception as e:
+                pdf, error = None, f"{type(e).__name__}: {e}"
+            if error:
+                failures.append((cards[index]["student_name"], cards[index]["student_class"], error))
+            elif cache is not None:
+                cache.put(keys[index], pdf, card_partition(cards[index]))
+            pdfs[index] = pdf
+            done += 1
+            if progress:
+                progress(done, total)
+    return pdfs, failures
+
+
+def merge_pdfs(pdfs):
+    writer = PdfWriter()
+    for pdf in pdfs:
+        writer.append(BytesIO(pdf))
+    # Every card embeds the same logo and fonts; keep one copy of each
+    writer.compress_identical_objects()
+    buffer = BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def zip_pdfs(cards, pdfs):
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for card, pdf in zip(cards, pdfs):
+            archive.writestr(card_file_name(card), pdf)
+    return buffer.getvalue()
+
+
+def render_batch(cards, scale, output="merged", workers=None, progress=None, cache=None):
+    # output: "merged" for one printable PDF, "zip" for one file per student
+    pdfs, failures = render_cards(cards, scale, workers, progress, cache)
+    rendered = [(card, pdf) for card, pdf in zip(cards, pdfs) if pdf is not None]
+    if not rendered:
+        return BatchResult(None, 0, failures)
+    if output == "zip":
+        data = zip_pdfs([card for card, _ in rendered], [pdf for _, pdf in rendered])
+    else:
+        data = merge_pdfs([pdf for _, pdf in rendered])
+    return BatchResult(data, len(rendered), failures)
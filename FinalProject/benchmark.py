@@ -0,0 +1,312 @@
+# Micro-benchmarks for the paths the app spends its time in, on seeded
+# synthetic schools of several sizes:
+#   python benchmark.py                                  # print results
+#   python benchmark.py --save-baseline                  # record benchmark_baseline.json
+#   python benchmark.py --compare                        # fail on regressions against it
+#   python benchmark.py --concurrent 20 --storage journal  # 20 processes saving at once
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import multiprocessing
+import numpy as np
+import pandas as pd
+from storage import (EXPECTED_COLUMNS, CsvBackend, JournaledCsvBackend, ParquetBackend, SqliteBackend,
+                     StaleWriteError)
+from progress_store import ProgressStore
+from grading import load_scale
+from rankings import RankingViews
+from result_tables import ScoreTables, score_pivot
+from report_card import card_from_rows, create_pdf
+
+BASELINE_FILE = "benchmark_baseline.json"
+DEFAULT_SIZES = [100, 1000, 5000]
+SUBJECT_NAMES = ["Mathematics", "English", "Basic Science", "Business Studies", "Civic Education",
+                 "Agricultural Science", "Computer Studies", "French", "Yoruba", "Fine Art",
+                 "Physical Education", "Home Economics", "Music", "Social Studies", "Literature"]
+TERMS = ["First Term", "Second Term", "Third Term"]
+CLASSES = ["JSS1A", "JSS1B", "JSS2A", "JSS2B", "JSS3A", "JSS3B", "SS1A", "SS1B", "SS2A", "SS2B", "SS3A", "SS3B"]
+
+
+def synthetic_progress(students, subjects=10, terms=3, sessions=1, seed=0):
+    # students × subjects × terms × sessions records in the progress_multi.csv layout,
+    # identical for the same arguments
+    rng = np.random.default_rng(seed)
+    subject_names = (SUBJECT_NAMES * (subjects // len(SUBJECT_NAMES) + 1))[:subjects]
+    subject_names = [name if i < len(SUBJECT_NAMES) else f"{name} {i // len(SUBJECT_NAMES) + 1}"
+                     for i, name in enumerate(subject_names)]
+    names = np.array([f"Student {i:05d}" for i in range(students)], dtype=object)
+    classes = np.array(CLASSES, dtype=object)[rng.integers(0, len(CLASSES), students)]
+    numbers = np.array([str(i % 40 + 1) for i in range(students)], dtype=object)
+    partitions = [(term, f"{2024 + s}/{2025 + s}") for s in range(sessions) for term in TERMS[:terms]]
+
+    count = students * subjects * len(partitions)
+    student_index = np.tile(np.repeat(np.arange(students), subjects), len(partitions))
+    partition_index = np.repeat(np.arange(len(partitions)), students * subjects)
+    ca1 = rng.integers(0, 21, count).astype(float)
+    ca2 = rng.integers(0, 21, count).astype(float)
+    exam = rng.integers(0, 61, count).astype(float)
+    df = pd.DataFrame({
+        "Student_Name": names[student_index],
+        "Class": classes[student_index],
+        "Number": numbers[student_index],
+        "Term": np.array([term for term, _ in partitions], dtype=object)[partition_index],
+        "Session": np.array([session for _, session in partitions], dtype=object)[partition_index],
+        "Subject": np.tile(np.array(subject_names, dtype=object), students * len(partitions)),
+        "CA1_Obt": ca1, "CA1_Max": 20.0, "CA2_Obt": ca2, "CA2_Max": 20.0,
+        "Exam_Obt": exam, "Exam_Max": 60.0,
+        "Total_Obt": ca1 + ca2 + exam, "Total_Max": 100.0,
+    })
+    df["Grade"], df["Remark"] = load_scale().grade_arrays(df["Total_Obt"], df["Total_Max"])
+    df["Teacher_Comment"] = "Keep it up"
+    df["Principal_Comment"] = "Good result"
+    df["School_Name"] = "Benchmark School"
+    df["School_Address"] = "1 Benchmark Road"
+    return df[EXPECTED_COLUMNS]
+
+
+def open_backend(kind, directory):
+    paths = {name: os.path.join(directory, name) for name in
+             ["progress_multi.csv", "school_info.csv", "progress_multi.journal.csv", "progress_multi.parquet", "progress.db"]}
+    if kind == "sqlite":
+        return SqliteBackend(paths["progress.db"])
+    if kind == "parquet":
+        return ParquetBackend(paths["progress_multi.parquet"], paths["school_info.csv"],
+                              paths["progress_multi.journal.csv"], paths["progress_multi.csv"])
+    if kind == "journal":
+        return JournaledCsvBackend(paths["progress_multi.csv"], paths["school_info.csv"],
+                                   paths["progress_multi.journal.csv"])
+    return CsvBackend(paths["progress_multi.csv"], paths["school_info.csv"])
+
+
+def make_backend(kind, directory, df):
+    backend = open_backend(kind, directory)
+    backend.write_all(df)
+    return backend
+
+
+def measure(fn, min_runs=5, max_runs=200, min_seconds=0.5, items=1):
+    # Latency percentiles in milliseconds and throughput in items per second;
+    # one untimed warm-up call first
+    fn(0)
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < max_runs and (len(samples) < min_runs or time.perf_counter() - started < min_seconds):
+        t0 = time.perf_counter()
+        fn(len(samples) + 1)
+        samples.append(time.perf_counter() - t0)
+    samples = np.array(samples) * 1000
+    return {
+        "runs": len(samples),
+        "min_ms": round(float(samples.min()), 4),
+        "p50_ms": round(float(np.percentile(samples, 50)), 4),
+        "p95_ms": round(float(np.percentile(samples, 95)), 4),
+        "p99_ms": round(float(np.percentile(samples, 99)), 4),
+        "mean_ms": round(float(samples.mean()), 4),
+        "throughput_per_s": round(items * 1000 / float(samples.mean()), 2),
+    }
+
+
+def run_size(students, subjects, terms, sessions, storage_kind, seed):
+    df = synthetic_progress(students, subjects, terms, sessions, seed)
+    rng = np.random.default_rng(seed + 1)
+    students = df[["Student_Name", "Class"]].drop_duplicates().to_numpy()
+    term, session = df["Term"].iloc[0], df["Session"].iloc[0]
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        backend = make_backend(storage_kind, directory, df)
+        results["load_progress"] = measure(lambda _: backend.load(), max_runs=50, items=len(df))
+        store = ProgressStore(backend, backend.load(), backend.signature())
+
+        def pick(i):
+            return students[rng.integers(0, len(students))]
+
+        results["student_term_filter"] = measure(lambda i: store.student_rows(*pick(i), term, session))
+
+        def save(i):
+            rows = store.student_rows(*pick(i), term, session).copy()
+            rows["Teacher_Comment"] = f"Saved {i}"
+            store.save_records(rows)
+        results["save_progress"] = measure(save, max_runs=50)
+
+        # The Saved Data tab's pivot: built from the term's rows, then kept per filter
+        results["saved_data_pivot"] = measure(lambda _: score_pivot(store.term_rows(term, session)), max_runs=50)
+        tables = ScoreTables(store)
+        results["saved_data_pivot_warm"] = measure(lambda _: tables.pivot(term, session))
+
+        # Cold: a fresh view computes every class table; warm: served from the views
+        results["overall_ranking_cold"] = measure(
+            lambda _: RankingViews(store).overall_ranking(term, session), max_runs=50)
+        views = RankingViews(store)
+        subject = df["Subject"].iloc[0]
+        results["overall_ranking_warm"] = measure(lambda _: views.overall_ranking(term, session))
+        results["subject_ranking_cold"] = measure(
+            lambda _: RankingViews(store).subject_ranking(term, session, subject), max_runs=50)
+
+        scale = load_scale()
+        totals = df["Total_Obt"].to_numpy()
+        results["calculate_grade_mark"] = measure(
+            lambda i: scale.grade(totals[i % len(totals)], 100.0), min_runs=200, max_runs=2000)
+        results["grade_all_rows"] = measure(lambda _: scale.grade_arrays(df["Total_Obt"], df["Total_Max"]),
+                                            max_runs=50, items=len(df))
+
+        card = card_from_rows(store.student_rows(*students[0], term, session))
+        results["create_pdf"] = measure(lambda _: create_pdf(**card).getvalue(), max_runs=100)
+    return {"records": len(df), "benchmarks": results}
+
+
+SHARED_STUDENT = ("Shared Student", CLASSES[0])
+
+
+def _editor(kind, directory, editor, saves, subjects, start, results):
+    # One teacher's process: saves its own students as fast as it can, then
+    # tries to overwrite the one student every editor loaded at the start
+    backend = open_backend(kind, directory)
+    store = ProgressStore(backend, backend.load(), backend.signature())
+    shared_key = (*SHARED_STUDENT, TERMS[0], "2024/2025")
+    shared_version = store.partition_version(*shared_key)
+    start.wait()
+    started = time.perf_counter()
+    for i in range(saves):
+        rows = synthetic_progress(1, subjects, 1, 1, seed=editor * saves + i)
+        store.save_records(rows.assign(Student_Name=f"Editor {editor:03d} Student {i:04d}"))
+    elapsed = time.perf_counter() - started
+    rows = synthetic_progress(1, subjects, 1, 1, seed=editor).assign(
+        Student_Name=SHARED_STUDENT[0], Class=SHARED_STUDENT[1], Teacher_Comment=f"Editor {editor}")
+    try:
+        store.save_records(rows, expected_versions={shared_key: shared_version})
+        won = True
+    except StaleWriteError:
+        won = False
+    results.put((editor, elapsed, won))
+
+
+def concurrent_saves(storage_kind, editors, saves, students, subjects, seed):
+    # Every save must land, and exactly one editor may win the shared student;
+    # the others must be refused rather than silently overwrite it
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        make_backend(storage_kind, directory, synthetic_progress(students, subjects, 1, 1, seed))
+        start = context.Barrier(editors + 1)
+        results = context.Queue()
+        processes = [context.Process(target=_editor, args=(storage_kind, directory, editor, saves, subjects,
+                                                            start, results)) for editor in range(editors)]
+        for process in processes:
+            process.start()
+        start.wait()
+        started = time.perf_counter()
+        outcomes = [results.get() for _ in processes]
+        wall = time.perf_counter() - started
+        for process in processes:
+            process.join()
+        saved = open_backend(storage_kind, directory).load()
+    names = saved["Student_Name"].astype(str)
+    expected_names = {f"Editor {editor:03d} Student {i:04d}" for editor in range(editors) for i in range(saves)}
+    found = set(names[names.str.startswith("Editor ")])
+    return {
+        "editors": editors,
+        "saves": editors * saves,
+        "wall_s": round(wall, 3),
+        "saves_per_s": round(editors * saves / wall, 1),
+        "slowest_editor_s": round(max(elapsed for _, elapsed, _ in outcomes), 3),
+        "lost_saves": len(expected_names - found),
+        "shared_student_winners": sum(won for _, _, won in outcomes),
+    }
+
+
+def compare(results, baseline, tolerance, metric="min_ms"):
+    # (size, benchmark, baseline, current) for every `metric` more than `tolerance`
+    # slower than the baseline. The fastest run is the default because it moves
+    # least when other work shares the machine.
+    regressions = []
+    for size, current in results["sizes"].items():
+        recorded = baseline.get("sizes", {}).get(size)
+        if recorded is None:
+            continue
+        for name, stats in current["benchmarks"].items():
+            before = recorded["benchmarks"].get(name)
+            if before and metric in before and stats[metric] > before[metric] * (1 + tolerance):
+                regressions.append((size, name, before[metric], stats[metric]))
+    return regressions
+
+
+def print_results(results):
+    for size, current in results["sizes"].items():
+        print(f"\n{size} students ({current['records']} records)")
+        print("{:<24}{:>10}{:>10}{:>10}{:>14}".format("benchmark", "p50 ms", "p95 ms", "p99 ms", "per second"))
+        for name, stats in current["benchmarks"].items():
+            print("{:<24}{:>10.3f}{:>10.3f}{:>10.3f}{:>14,.1f}".format(
+                name, stats["p50_ms"], stats["p95_ms"], stats["p99_ms"], stats["throughput_per_s"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Academic Management System core paths")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="Comma-separated student counts")
+    parser.add_argument("--subjects", type=int, default=10)
+    parser.add_argument("--terms", type=int, default=3, choices=[1, 2, 3])
+    parser.add_argument("--sessions", type=int, default=1)
+    parser.add_argument("--storage", default="sqlite", choices=["csv", "journal", "parquet", "sqlite"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="Write these results as the baseline")
+    parser.add_argument("--compare", action="store_true", help="Exit non-zero on regressions against the baseline")
+    parser.add_argument("--metric", default="min_ms", choices=["min_ms", "p50_ms", "p95_ms", "mean_ms"],
+                        help="Latency compared against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown (0.25 = 25%%)")
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--concurrent", type=int, metavar="EDITORS",
+                        help="Instead of the suite, save from this many processes at once and check nothing is lost")
+    parser.add_argument("--saves", type=int, default=20, help="Saves per editor with --concurrent")
+    args = parser.parse_args()
+
+    if args.concurrent:
+        students = int(args.sizes.split(",")[0])
+        stress = concurrent_saves(args.storage, args.concurrent, args.saves, students, args.subjects, args.seed)
+        for name, value in stress.items():
+            print(f"{name:<24}{value}")
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"storage": args.storage, **stress}, f, indent=2)
+        sys.exit(1 if stress["lost_saves"] or stress["shared_student_winners"] != 1 else 0)
+
+    results = {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "storage": args.storage,
+        "subjects": args.subjects,
+        "terms": args.terms,
+        "sessions": args.sessions,
+        "seed": args.seed,
+        "sizes": {},
+    }
+    for students in [int(size) for size in args.sizes.split(",")]:
+        print(f"Running {students} students...", file=sys.stderr)
+        results["sizes"][str(students)] = run_size(students, args.subjects, args.terms, args.sessions,
+                                                    args.storage, args.seed)
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            sys.exit(f"No baseline at {args.baseline}; run with --save-baseline first")
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("storage") != args.storage:
+            print(f"Note: baseline was recorded with {baseline.get('storage')} storage", file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance, args.metric)
+        for size, name, before, after in regressions:
+            print(f"REGRESSION {size} students {name}: {args.metric} {before:.3f} -> {after:.3f}")
+        if regressions:
+            sys.exit(1)
+        print("\nNo regressions against the baseline")
@@ -0,0 +1,136 @@
+import csv
+import io
+import tempfile
+import importlib.util
+import pandas as pd
+from progress_store import TERM_KEY
+from rankings import TOTAL_COLUMNS
+from annual import ANNUAL_COLUMNS
+
+# Per-subject columns on the broadsheet as (progress column, heading suffix)
+SUBJECT_PARTS = [("CA1_Obt", "CA1"), ("CA2_Obt", "CA2"), ("Exam_Obt", "Exam"),
+                 ("Total_Obt", "Total"), ("Grade", "Grade")]
+SUMMARY_COLUMNS = ["Total_Obt", "Total_Max", "Average", "Percentage", "Position"]
+# Finished files above this size are kept on disk rather than in memory
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+XLSX_AVAILABLE = importlib.util.find_spec("openpyxl") is not None
+
+
+def broadsheet_columns(subjects):
+    return (["Student_Name", "Class", "Term", "Session"]
+            + [f"{subject} {label}" for subject in subjects for _, label in SUBJECT_PARTS]
+            + SUMMARY_COLUMNS)
+
+
+def broadsheet_subjects(rows):
+    return sorted(rows["Subject"].dropna().unique().tolist(), key=str)
+
+
+def class_broadsheet(rows, totals, columns):
+    # One row per student of one class: every subject's scores side by side,
+    # then the totals and position from the class's ranking table
+    rows = rows.astype({"Student_Name": object, "Subject": object})
+    rows = rows[rows["Student_Name"].notna() & rows["Subject"].notna()]
+    if rows.empty:
+        return pd.DataFrame(columns=columns)
+    wide = rows.drop_duplicates(["Student_Name", "Subject"], keep="last").pivot(
+        index="Student_Name", columns="Subject", values=[column for column, _ in SUBJECT_PARTS])
+    # Pivoting scores together with grades leaves every column as object, which is slow to write
+    wide = wide.infer_objects()
+    labels = dict(SUBJECT_PARTS)
+    wide.columns = [f"{subject} {labels[column]}" for column, subject in wide.columns]
+    scored = pd.to_numeric(rows["Total_Obt"], errors="coerce").notna()
+    subject_count = rows[scored].groupby("Student_Name").size()
+
+    first = rows.drop_duplicates("Student_Name").set_index("Student_Name")[["Class", "Term", "Session"]]
+    sheet = first.join(wide)
+    if len(totals):
+        summary = totals.astype({"Student_Name": object}).set_index("Student_Name")
+        sheet = sheet.join(summary[TOTAL_COLUMNS + ["Percentage", "Position", "Rank"]])
+        sheet["Average"] = (sheet["Total_Obt"] / subject_count.reindex(sheet.index)).round(2)
+        sheet["Percentage"] = sheet["Percentage"].round(2)
+        # Ranked students in position order, then anyone without scores
+        sheet = sheet.sort_values(["Rank"], kind="stable", na_position="last")
+    return sheet.reset_index().reindex(columns=columns)
+
+
+def broadsheet_frames(store, rankings, term=None, session=None, class_name=None):
+    # (columns, generator of per-class frames). Only one class is held at a
+    # time; a term/session of None exports every one in the store, each ranked
+    # on its own.
+    rows = store.term_rows(term, session)
+    if class_name is not None:
+        rows = rows[rows["Class"] == class_name]
+    columns = broadsheet_columns(broadsheet_subjects(rows))
+    partitions = rows[TERM_KEY].dropna().drop_duplicates().itertuples(index=False, name=None)
+    partitions = sorted(partitions, key=lambda key: (str(key[1]), str(key[0])))
+
+    def frames():
+        for partition_term, partition_session in partitions:
+            classes = [class_name] if class_name is not None else store.classes(partition_term, partition_session)
+            for each_class in classes:
+                class_rows = store.class_rows(partition_term, partition_session, each_class)
+                if len(class_rows):
+                    yield class_broadsheet(class_rows,
+                                           rankings.overall_ranking(partition_term, partition_session, each_class),
+                                           columns)
+
+    return columns, frames()
+
+
+def annual_broadsheet_frames(annual, session, class_name=None):
+    # Cumulative broadsheet for a session: each class's students with their
+    # term totals, cumulative results and promotion decision, ranked within the
+    # class. Built from the annual view's per-term aggregates, not subject rows.
+    columns = ["Session"] + ANNUAL_COLUMNS
+    classes = [class_name] if class_name is not None else annual.classes(session)
+
+    def frames():
+        for each_class in classes:
+            table = annual.annual_ranking(session, each_class)
+            if len(table):
+                table = table.assign(Session=session, Average=table["Average"].round(2),
+                                     Percentage=table["Percentage"].astype(float).round(2))
+                yield table.reindex(columns=columns)
+
+    return columns, frames()
+
+
+def write_broadsheet_csv(columns, frames, out):
+    # out: a binary file; each class is encoded and written before the next is built
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="", write_through=True)
+    csv.writer(text).writerow(columns)
+    for frame in frames:
+        frame.to_csv(text, header=False, index=False)
+    text.detach()
+
+
+def write_broadsheet_xlsx(columns, frames, out):
+    # openpyxl's write-only mode streams rows to the file instead of building
+    # the whole workbook in memory
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ValueError("Excel broadsheets need openpyxl (pip install openpyxl); download the CSV instead.")
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Broadsheet")
+    sheet.append(columns)
+    for frame in frames:
+        for row in frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None):
+            sheet.append(list(row))
+    workbook.save(out)
+
+
+def export_broadsheet(store, rankings, term=None, session=None, class_name=None, file_format="csv", annual=None):
+    # Bytes of the finished file; while it is being written the data lives in a
+    # temporary file that spills to disk once it passes SPOOL_MAX_BYTES. With
+    # an annual.AnnualViews, the session's cumulative broadsheet is written.
+    if annual is not None:
+        columns, frames = annual_broadsheet_frames(annual, session, class_name)
+    else:
+        columns, frames = broadsheet_frames(store, rankings, term, session, class_name)
+    writer = write_broadsheet_xlsx if file_format == "xlsx" else write_broadsheet_csv
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as out:
+        writer(columns, frames, out)
+        out.seek(0)
+        return out.read()
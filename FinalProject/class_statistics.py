@@ -0,0 +1,115 @@
+import threading
+import pandas as pd
+from grading import load_scale
+from rankings import TOTAL_COLUMNS, scored_rows
+from report_card import CARD_STAT_COLUMNS, format_score
+
+STATISTICS_KEY = ["Term", "Session", "Class", "Subject"]
+# Mean/Highest/Lowest/Std are of the subject totals (Total_Obt); Pass_Rate is
+# the percentage of students at or above the grading scale's pass mark
+STATISTICS_COLUMNS = ["Students", "Mean", "Highest", "Lowest", "Std", "Mean_Percentage", "Pass_Rate"]
+DIFFICULTY_COLUMNS = ["Subject", "Classes", "Students", "Mean_Percentage", "Pass_Rate", "Highest", "Lowest"]
+
+
+def subject_statistics(rows, pass_mark=None):
+    # Per-(term, session, class, subject) aggregates of any set of subject rows
+    # in a single grouped pass
+    pass_mark = load_scale().pass_percent() if pass_mark is None else pass_mark
+    rows = scored_rows(rows[STATISTICS_KEY + TOTAL_COLUMNS])
+    if rows.empty:
+        return pd.DataFrame(columns=STATISTICS_KEY + STATISTICS_COLUMNS)
+    percent = (rows["Total_Obt"] / rows["Total_Max"] * 100).where(rows["Total_Max"] > 0)
+    rows = rows.assign(_Percentage=percent, _Passed=(percent.round(6) >= pass_mark) * 100.0)
+    stats = rows.groupby(STATISTICS_KEY, sort=False, observed=True).agg(
+        Students=("Total_Obt", "size"), Mean=("Total_Obt", "mean"), Highest=("Total_Obt", "max"),
+        Lowest=("Total_Obt", "min"), Std=("Total_Obt", "std"), Mean_Percentage=("_Percentage", "mean"),
+        Pass_Rate=("_Passed", "mean"))
+    # A subject taken by one student has no spread
+    stats["Std"] = stats["Std"].fillna(0.0)
+    return stats.reset_index()
+
+
+def with_class_statistics(df, stats):
+    # Card subject rows (card_from_rows' df) with each subject's class average,
+    # highest and lowest total from one class's subject_statistics rows
+    df = df.copy()
+    subjects = df["Subject"].astype(object)
+    lookup = stats.astype({"Subject": object}).set_index("Subject") if len(stats) else None
+    for column, source in zip(CARD_STAT_COLUMNS, ["Mean", "Highest", "Lowest"]):
+        values = subjects.map(lookup[source]).astype(float).round(1) if lookup is not None else pd.Series(index=df.index)
+        df[column] = values.astype(object).map(format_score)
+    return df
+
+
+def subject_difficulty(stats):
+    # School-wide summary per subject from per-class statistics, hardest first:
+    # class figures are combined weighted by their number of students
+    if stats.empty:
+        return pd.DataFrame(columns=DIFFICULTY_COLUMNS)
+    weighted = stats.astype({"Subject": object}).assign(
+        _Percent_Sum=stats["Mean_Percentage"] * stats["Students"], _Pass_Sum=stats["Pass_Rate"] * stats["Students"])
+    summary = weighted.groupby("Subject", sort=False).agg(
+        Classes=("Class", "size"), Students=("Students", "sum"), _Percent_Sum=("_Percent_Sum", "sum"),
+        _Pass_Sum=("_Pass_Sum", "sum"), Highest=("Highest", "max"), Lowest=("Lowest", "min"))
+    summary["Mean_Percentage"] = summary["_Percent_Sum"] / summary["Students"]
+    summary["Pass_Rate"] = summary["_Pass_Sum"] / summary["Students"]
+    summary = summary.reset_index().sort_values(["Mean_Percentage", "Subject"], kind="stable")
+    return summary.reindex(columns=DIFFICULTY_COLUMNS).reset_index(drop=True)
+
+
+class StatisticsViews:
+    # Subject statistics per (term, session, class), kept until a save bumps
+    # that class's version on the store. A term seen for the first time is
+    # computed for all its classes in one grouped pass over the term's rows;
+    # after that only the classes that changed are recomputed.
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._tables = {}  # (term, session, class) -> ((pass mark, version), statistics)
+
+    def _cached(self, term, session, class_name, stamp):
+        cached = self._tables.get((term, session, class_name))
+        return cached[1] if cached is not None and cached[0] == stamp else None
+
+    def term_statistics(self, term, session):
+        pass_mark = self.store.scale().pass_percent()
+        classes = self.store.classes(term, session)
+        stamps = {class_name: (pass_mark, self.store.version(term, session, class_name)) for class_name in classes}
+        with self._lock:
+            tables = {class_name: self._cached(term, session, class_name, stamp) for class_name, stamp in stamps.items()}
+        stale = [class_name for class_name, table in tables.items() if table is None]
+        if stale:
+            if len(stale) == len(classes):
+                computed = subject_statistics(self.store.term_rows(term, session), pass_mark)
+                by_class = dict(tuple(computed.groupby("Class", sort=False, observed=True)))
+                fresh = {class_name: by_class.get(class_name, computed.iloc[:0]).reset_index(drop=True)
+                         for class_name in stale}
+            else:
+                fresh = {class_name: subject_statistics(self.store.class_rows(term, session, class_name), pass_mark)
+                         for class_name in stale}
+            with self._lock:
+                for class_name, table in fresh.items():
+                    self._tables[(term, session, class_name)] = (stamps[class_name], table)
+            tables.update(fresh)
+        frames = [tables[class_name] for class_name in classes if len(tables[class_name])]
+        if not frames:
+            return pd.DataFrame(columns=STATISTICS_KEY + STATISTICS_COLUMNS)
+        return pd.concat(frames, ignore_index=True)
+
+    def class_statistics(self, term, session, class_name):
+        stamp = (self.store.scale().pass_percent(), self.store.version(term, session, class_name))
+        with self._lock:
+            table = self._cached(term, session, class_name, stamp)
+        if table is None:
+            table = subject_statistics(self.store.class_rows(term, session, class_name), stamp[0])
+            with self._lock:
+                self._tables[(term, session, class_name)] = (stamp, table)
+        return table
+
+    def subject_difficulty(self, term, session):
+        return subject_difficulty(self.term_statistics(term, session))
+
+
+def statistics_views(store):
+    return store.derived("statistics", StatisticsViews)
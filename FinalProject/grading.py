@@ -0,0 +1,139 @@
+import os
+import json
+import math
+import threading
+from bisect import bisect_right
+import numpy as np
+import pandas as pd
+from storage import file_signature
+
+GRADING_FILE = "grading_scale.json"
+
+# Nigerian A–F bands from the README as (lowest percentage, grade, remark)
+DEFAULT_BANDS = [
+    (70, "A", "Excellent"),
+    (60, "B", "Very Good"),
+    (50, "C", "Good"),
+    (45, "D", "Fair"),
+    (40, "E", "Pass"),
+    (0, "F", "Poor"),
+]
+
+
+class GradingScale:
+    # Percentage bands kept as sorted lower bounds, so whole columns of totals
+    # are graded with a single np.searchsorted instead of per-row if/elif chains.
+
+    def __init__(self, bands=DEFAULT_BANDS):
+        bands = [(_number(low), _label(grade), _label(remark)) for low, grade, remark in bands]
+        if not bands:
+            raise ValueError("A grading scale needs at least one band")
+        if any(math.isnan(low) for low, _, _ in bands):
+            raise ValueError("Every band needs a lowest percentage")
+        if any(not grade for _, grade, _ in bands):
+            raise ValueError("Every band needs a grade")
+        bands = sorted(bands)
+        if bands[0][0] != 0:
+            raise ValueError("The lowest band must start at 0%")
+        if len({low for low, _, _ in bands}) != len(bands):
+            raise ValueError("Each band needs a different lowest percentage")
+        self.bands = bands
+        self._lows = [low for low, _, _ in bands]
+        self._bounds = np.array(self._lows)
+        self._grades = np.array([grade for _, grade, _ in bands] + ["-", ""], dtype=object)
+        self._remarks = np.array([remark for _, _, remark in bands] + ["-", ""], dtype=object)
+
+    def key(self):
+        # Hashable identity of the scale, for caches of graded output
+        return tuple(self.bands)
+
+    def pass_percent(self):
+        # Lowest percentage that is not a fail: the start of the band above the
+        # bottom one (E, 40%, with the default bands)
+        return self.bands[1][0] if len(self.bands) > 1 else 0.0
+
+    def grade_arrays(self, obtained, maximum):
+        # Vectorized grading; a zero obtainable gives "-" like calculate_grade_mark,
+        # and blank or non-numeric totals give ""
+        obtained = pd.to_numeric(pd.Series(obtained), errors="coerce").to_numpy(float)
+        maximum = pd.to_numeric(pd.Series(maximum), errors="coerce").to_numpy(float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            percent = obtained / maximum * 100
+        band = np.clip(np.searchsorted(self._bounds, percent, side="right") - 1, 0, None)
+        band[maximum == 0] = len(self.bands)
+        band[np.isnan(obtained) | np.isnan(maximum)] = len(self.bands) + 1
+        return self._grades[band], self._remarks[band]
+
+    def grade(self, obtained, max_val):
+        # One total, e.g. as marks are typed: the same bands as grade_arrays
+        # through a plain bisect, without building arrays for a single value
+        obtained, max_val = _number(obtained), _number(max_val)
+        if math.isnan(obtained) or math.isnan(max_val):
+            return "", ""
+        if max_val == 0:
+            return "-", "-"
+        _, grade, remark = self.bands[max(bisect_right(self._lows, obtained / max_val * 100) - 1, 0)]
+        return grade, remark
+
+    def regrade(self, df):
+        # Copy of `df` with Grade/Remark recomputed from its totals in one pass
+        df = df.copy()
+        grades, remarks = self.grade_arrays(df["Total_Obt"], df["Total_Max"])
+        df["Grade"] = grades
+        df["Remark"] = remarks
+        return df
+
+    def to_records(self):
+        return [{"Min_Percent": low, "Grade": grade, "Remark": remark}
+                for low, grade, remark in sorted(self.bands, reverse=True)]
+
+    @classmethod
+    def from_records(cls, records):
+        return cls([(record["Min_Percent"], record["Grade"], record["Remark"]) for record in records])
+
+    def save(self, path=GRADING_FILE):
+        with open(path, "w") as f:
+            json.dump({"bands": self.to_records()}, f, indent=2)
+
+
+def _number(value):
+    # float() for one value, NaN where pd.to_numeric(errors="coerce") gives NaN
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _label(value):
+    # A grade or remark as typed; an empty editor cell (None or NaN) is "",
+    # not the text "nan"
+    return "" if value is None or pd.isna(value) else str(value).strip()
+
+
+_scale_cache = {}
+_scale_lock = threading.Lock()
+
+
+def load_scale(path=GRADING_FILE):
+    # Per-school scale from grading_scale.json, falling back to the README bands
+    key = os.path.abspath(path)
+    signature = file_signature(path)
+    with _scale_lock:
+        cached = _scale_cache.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        scale = GradingScale()
+        if signature is not None:
+            with open(path) as f:
+                scale = GradingScale.from_records(json.load(f)["bands"])
+        _scale_cache[key] = (signature, scale)
+        return scale
+
+
+def changed_grades(df, scale):
+    # Rows of `df` whose stored Grade/Remark differ under `scale`, already regraded
+    regraded = scale.regrade(df)
+    stored_grade = df["Grade"].astype(object).where(df["Grade"].notna(), "").astype(str)
+    stored_remark = df["Remark"].astype(object).where(df["Remark"].notna(), "").astype(str)
+    changed = (stored_grade != regraded["Grade"].astype(str)) | (stored_remark != regraded["Remark"].astype(str))
+    return regraded[changed.to_numpy()]
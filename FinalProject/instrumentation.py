@@ -0,0 +1,144 @@
+import io
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# AMS_PROFILE=1 turns timing on for every session; otherwise it is switched
+# on per session from the sidebar
+PROFILE_ENV = "AMS_PROFILE"
+TIMING_LOG_FILE = os.environ.get("AMS_TIMING_LOG", "timings.jsonl")
+
+_log_lock = threading.Lock()
+# st.rerun() and st.stop() end a script run without reaching timer.finish(), so
+# every timer that switched something on is tracked until it switches it off
+_owners_lock = threading.Lock()
+_unfinished = {}  # thread id -> timer started on that thread and not finished
+_memory_owner = None  # timer that started tracemalloc, which is process-wide
+
+
+def profiling_default():
+    return os.environ.get(PROFILE_ENV, "").lower() in ("1", "true", "yes", "on")
+
+
+def release_stale_timers():
+    # Switches off the profiler and memory tracing of timers whose script run
+    # ended early: an earlier run on this thread (st.rerun() reruns on the same
+    # thread), or a run on a thread that has since finished (st.stop())
+    current = threading.get_ident()
+    alive = {thread.ident for thread in threading.enumerate()}
+    with _owners_lock:
+        for ident, timer in list(_unfinished.items()):
+            if ident == current or ident not in alive:
+                timer._release()
+
+
+class RerunTimer:
+    # Wall-clock timings for the named sections of one script run. Disabled
+    # timers cost one attribute check per section, so the sections stay in the
+    # code permanently.
+
+    def __init__(self, enabled=False, profile=False, trace_memory=False):
+        self.enabled = enabled
+        self.sections = []  # [[path, depth, milliseconds]] in the order sections start
+        self._stack = []
+        self._profiler = cProfile.Profile() if enabled and profile else None
+        self._trace_memory = enabled and trace_memory
+        self._thread = None
+        self._started = None
+        self.total_ms = None
+        self.memory_peak_kb = None
+        self.profile_text = None
+        self.memory_text = None
+
+    def start(self):
+        global _memory_owner
+        # Runs for disabled timers too, so the next rerun of any session turns
+        # off what an interrupted one left on
+        release_stale_timers()
+        if not self.enabled:
+            return self
+        self._thread = threading.get_ident()
+        with _owners_lock:
+            _unfinished[self._thread] = self
+            # tracemalloc is process-wide; only start it when nobody else has
+            if self._trace_memory and _memory_owner is None and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _memory_owner = self
+        if self._profiler is not None:
+            self._profiler.enable()
+        self._started = time.perf_counter()
+        return self
+
+    def _release(self):
+        # Called with _owners_lock held. A profiler only runs on the thread that
+        # enabled it, so one left on a thread that has ended needs nothing.
+        global _memory_owner
+        if self._profiler is not None and self._thread == threading.get_ident():
+            self._profiler.disable()
+        if _memory_owner is self:
+            tracemalloc.stop()
+            _memory_owner = None
+        if _unfinished.get(self._thread) is self:
+            del _unfinished[self._thread]
+
+    @contextmanager
+    def section(self, name):
+        if not self.enabled:
+            yield
+            return
+        self._stack.append(name)
+        entry = [" › ".join(self._stack), len(self._stack) - 1, None]
+        self.sections.append(entry)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry[2] = (time.perf_counter() - started) * 1000
+            self._stack.pop()
+
+    def finish(self, top=25):
+        if not self.enabled or self._started is None:
+            return
+        self.total_ms = (time.perf_counter() - self._started) * 1000
+        if self._profiler is not None:
+            self._profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(self._profiler, stream=out).sort_stats("cumulative").print_stats(top)
+            self.profile_text = out.getvalue()
+        snapshot = None
+        with _owners_lock:
+            if _memory_owner is self:
+                snapshot = tracemalloc.take_snapshot()
+                self.memory_peak_kb = tracemalloc.get_traced_memory()[1] / 1024
+            self._release()
+        if snapshot is not None:
+            self.memory_text = "\n".join(str(stat) for stat in snapshot.statistics("lineno")[:top])
+
+    def record(self, **extra):
+        return {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "total_ms": round(self.total_ms, 3) if self.total_ms is not None else None,
+            "sections": {name: round(ms, 3) for name, _, ms in self.sections if ms is not None},
+            "memory_peak_kb": round(self.memory_peak_kb, 1) if self.memory_peak_kb is not None else None,
+            **extra,
+        }
+
+    def log(self, path=TIMING_LOG_FILE, **extra):
+        # One JSON object per line, appended, so runs from every session and
+        # server process can be aggregated afterwards
+        if not self.enabled or self.total_ms is None:
+            return
+        line = json.dumps(self.record(**extra), ensure_ascii=False) + "\n"
+        with _log_lock:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def breakdown(self):
+        # Rows for display, each nested section indented under the one it ran in
+        return [{"Section": "    " * depth + name.split(" › ")[-1], "ms": round(ms, 1)}
+                for name, depth, ms in self.sections if ms is not None]
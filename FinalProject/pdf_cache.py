@@ -0,0 +1,173 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from storage import file_signature, partition_key
+from report_card import CARD_COLUMNS, CARD_STAT_COLUMNS, LOGO_FILE
+import report_card
+
+PDF_CACHE_DIR = os.environ.get("AMS_PDF_CACHE_DIR", ".pdf_cache")
+# Hot PDFs are kept in memory up to this many bytes; everything is also kept
+# on disk, up to its own budget, for other processes and restarts
+PDF_CACHE_BYTES = int(os.environ.get("AMS_PDF_CACHE_BYTES", 64 * 1024 * 1024))
+PDF_CACHE_DISK_BYTES = int(os.environ.get("AMS_PDF_CACHE_DISK_BYTES", 512 * 1024 * 1024))
+# Trim the spill directory after this many new files
+DISK_TRIM_EVERY = 200
+
+
+@lru_cache(maxsize=8)
+def _file_digest(path, signature):
+    if signature is None:
+        return ""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def card_key(card, scale, logo_path=LOGO_FILE):
+    # Hash of everything that ends up on the card: its fields and subject rows,
+    # the logo bytes, the grading scale and the layout code itself. Any change
+    # gives a new key, so a cached PDF is never out of date. Cards of a school
+    # shard carry their own logo_path; `scale` is the one the cards were
+    # collected with, which is the school's own on a sharded install.
+    logo_path = card.get("logo_path", logo_path)
+    fields = {name: str(value) for name, value in card.items() if name != "df"}
+    digest = hashlib.sha256()
+    digest.update(json.dumps(fields, sort_keys=True).encode("utf-8"))
+    digest.update(card["df"].reindex(columns=CARD_COLUMNS + CARD_STAT_COLUMNS).to_csv(index=False).encode("utf-8"))
+    digest.update(_file_digest(logo_path, file_signature(logo_path)).encode())
+    digest.update(repr(scale.key()).encode("utf-8"))
+    digest.update(_file_digest(report_card.__file__, file_signature(report_card.__file__)).encode())
+    return digest.hexdigest()
+
+
+def card_partition(card):
+    return partition_key(card["student_name"], card["student_class"], card["term"], card["session"])
+
+
+class PdfCache:
+    # Rendered report cards by card_key: an in-memory LRU within a byte budget
+    # over a spill directory of <key>.pdf files. Entries are also tagged with
+    # the (student, class, term, session) they were rendered for, so a save can drop
+    # them straight away instead of waiting for them to age out.
+
+    def __init__(self, max_bytes=PDF_CACHE_BYTES, directory=PDF_CACHE_DIR, max_disk_bytes=PDF_CACHE_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._partitions = {}  # (student, class, term, session) -> keys rendered for it
+        self._written = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def get(self, key):
+        with self._lock:
+            pdf = self._memory.get(key)
+            if pdf is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return pdf
+        try:
+            with open(self._path(key), "rb") as f:
+                pdf = f.read()
+            os.utime(self._path(key))  # the disk tier is trimmed oldest-first
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self._remember(key, pdf)
+        return pdf
+
+    def put(self, key, pdf, partition=None):
+        with self._lock:
+            self._remember(key, pdf)
+            if partition is not None:
+                self._partitions.setdefault(tuple(partition), set()).add(key)
+            self._written += 1
+            trim = self._written % DISK_TRIM_EVERY == 0
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{self._path(key)}.tmp{os.getpid()}.{threading.get_ident()}"
+            with open(tmp_path, "wb") as f:
+                f.write(pdf)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            pass  # a read-only or full disk only costs the disk tier
+        if trim:
+            self.trim_disk()
+
+    def _remember(self, key, pdf):
+        # Called with the lock held
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        if len(pdf) > self.max_bytes:
+            return
+        self._memory[key] = pdf
+        self._memory_bytes += len(pdf)
+        while self._memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def invalidate_partitions(self, partitions):
+        with self._lock:
+            keys = set()
+            for partition in partitions:
+                keys |= self._partitions.pop(tuple(partition), set())
+            for key in keys:
+                pdf = self._memory.pop(key, None)
+                if pdf is not None:
+                    self._memory_bytes -= len(pdf)
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def trim_disk(self):
+        # Oldest-used files go first once the directory passes its budget
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".pdf")]
+        except OSError:
+            return
+        files = []
+        for entry in entries:
+            try:
+                stat = entry.stat()
+            except OSError:  # removed by another process meanwhile
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = 0
+        for _, size, path in sorted(files, reverse=True):
+            total += size
+            if total > self.max_disk_bytes:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "memory_entries": len(self._memory), "memory_bytes": self._memory_bytes}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_pdf_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PdfCache()
+        return _cache
@@ -0,0 +1,279 @@
+import threading
+import numpy as np
+import pandas as pd
+from storage import (EXPECTED_COLUMNS, STUDENT_TERM_KEY, NamesakeError, StaleWriteError, get_backend, key_frame,
+                     merge_records, partition_key, partition_version, school_path)
+from grading import GRADING_FILE, load_scale
+
+TERM_KEY = ["Term", "Session"]
+CLASS_KEY = ["Term", "Session", "Class"]
+
+# Saved partitions are layered over the loaded frame; once this many pile up
+# the frame is rebuilt so lookups stay cheap.
+MAX_OVERLAY_PARTITIONS = 256
+
+# Called with the (student, class, term, session) keys of every partition a save or
+# refresh changes, e.g. to drop cached report cards for those students
+_change_listeners = []
+
+
+def add_change_listener(listener):
+    if listener not in _change_listeners:
+        _change_listeners.append(listener)
+
+
+def _group_positions(df, keys):
+    if df.empty:
+        return {}
+    return {key: np.asarray(pos) for key, pos in df.groupby(keys, sort=False, observed=True).indices.items()}
+
+
+def _partition_positions(df):
+    # Row positions per partition_key; rows without a class are found under ""
+    if df.empty:
+        return {}
+    positions = {}
+    for key, pos in df.groupby(STUDENT_TERM_KEY, sort=False, observed=True, dropna=False).indices.items():
+        key = partition_key(*key)
+        positions[key] = np.sort(np.concatenate([positions[key], pos])) if key in positions else np.asarray(pos)
+    return positions
+
+
+class ProgressStore:
+    # In-memory view of the progress data, partitioned once per load so every
+    # lookup in the app is a dictionary hit instead of a full-frame boolean mask.
+    # Saves go through the backend and are applied to the view in place.
+
+    def __init__(self, backend, df, signature=None):
+        self.backend = backend
+        self.signature = signature
+        self._lock = threading.RLock()
+        # (term, session, class) -> change counter, for views kept per class
+        self._versions = {}
+        self._derived = {}
+        self._rebase(df)
+
+    def _rebase(self, df):
+        self._base = df.reset_index(drop=True)
+        self._hidden = np.zeros(len(self._base), dtype=bool)
+        self._overlay = {}
+        self._student_term_pos = _partition_positions(self._base)
+        self._term_pos = _group_positions(self._base, TERM_KEY)
+        self._class_pos = _group_positions(self._base, CLASS_KEY)
+        self._student_pos = _group_positions(self._base, "Student_Name")
+        self._student_names = None
+        self._term_cache = {}
+        self._class_cache = {}
+        self._full = None if self._overlay else self._base
+
+    @property
+    def df(self):
+        with self._lock:
+            if self._full is None:
+                self._full = pd.concat([self._base[~self._hidden], *self._overlay.values()], ignore_index=True)
+            return self._full
+
+    @property
+    def empty(self):
+        return self.df.empty
+
+    @property
+    def school(self):
+        # The school whose shard the records come from; None without shards
+        return self.backend.school
+
+    def file_path(self, name):
+        # The school's own copy of a per-school file such as the logo
+        return school_path(self.school, name)
+
+    def scale(self):
+        return load_scale(self.file_path(GRADING_FILE))
+
+    def _take(self, positions):
+        if positions is None or len(positions) == 0:
+            return self._base.iloc[0:0]
+        if self._overlay:
+            positions = positions[~self._hidden[positions]]
+        return self._base.iloc[positions]
+
+    def _with_overlay(self, frame, matches):
+        extra = [rows for key, rows in self._overlay.items() if matches(key)]
+        if not extra:
+            return frame
+        return pd.concat([frame, *extra], ignore_index=True)
+
+    def student_names(self):
+        with self._lock:
+            if self._student_names is None:
+                names = [name for name in self._student_pos if pd.notna(name)]
+                known = set(names)
+                for (student_name, _, _, _), rows in self._overlay.items():
+                    if len(rows) and student_name not in known:
+                        names.append(student_name)
+                        known.add(student_name)
+                self._student_names = names
+            return self._student_names
+
+    def student_rows(self, student_name, class_name, term, session):
+        key = partition_key(student_name, class_name, term, session)
+        with self._lock:
+            if key in self._overlay:
+                return self._overlay[key]
+            return self._take(self._student_term_pos.get(key))
+
+    def student_any_rows(self, student_name):
+        with self._lock:
+            return self._with_overlay(self._take(self._student_pos.get(student_name)),
+                                      lambda key: key[0] == student_name)
+
+    def term_rows(self, term=None, session=None):
+        # term/session of None means "All"
+        if term is None and session is None:
+            return self.df
+        with self._lock:
+            cached = self._term_cache.get((term, session))
+            if cached is not None:
+                return cached
+            parts = [pos for (t, s), pos in self._term_pos.items()
+                     if (term is None or t == term) and (session is None or s == session)]
+            frame = self._take(np.sort(np.concatenate(parts)) if parts else None)
+            frame = self._with_overlay(frame, lambda key: (term is None or key[2] == term)
+                                       and (session is None or key[3] == session))
+            self._term_cache[(term, session)] = frame
+            return frame
+
+    def class_rows(self, term, session, class_name):
+        with self._lock:
+            cached = self._class_cache.get((term, session, class_name))
+            if cached is not None:
+                return cached
+            frame = self._with_overlay(self._take(self._class_pos.get((term, session, class_name))),
+                                       lambda key: key[1:] == (class_name, term, session))
+            self._class_cache[(term, session, class_name)] = frame
+            return frame
+
+    def classes(self, term, session):
+        return sorted(self.term_rows(term, session)["Class"].dropna().unique().tolist(), key=str)
+
+    def version(self, term, session, class_name):
+        return self._versions.get((term, session, class_name), 0)
+
+    def derived(self, name, factory):
+        # Views computed from this store (rankings, statistics, ...) live as long
+        # as it does; a full reload starts them afresh. Views with a
+        # partitions_changed(frames) method are patched by every save instead.
+        with self._lock:
+            view = self._derived.get(name)
+            if view is None:
+                view = self._derived[name] = factory(self)
+            return view
+
+    def apply_partitions(self, frames):
+        # frames: {(student, class, term, session): rows now stored for that partition}
+        with self._lock:
+            for key, rows in frames.items():
+                key = partition_key(*key)
+                _, _, term, session = key
+                touched = set(self.student_rows(*key)["Class"].tolist()) | set(rows["Class"].tolist())
+                for class_name in touched:
+                    self._versions[(term, session, class_name)] = self.version(term, session, class_name) + 1
+                    self._class_cache.pop((term, session, class_name), None)
+                positions = self._student_term_pos.get(key)
+                if positions is not None:
+                    self._hidden[positions] = True
+                self._overlay[key] = rows.reset_index(drop=True)
+                for cached in [k for k in self._term_cache
+                               if (k[0] is None or k[0] == term) and (k[1] is None or k[1] == session)]:
+                    del self._term_cache[cached]
+            self._student_names = None
+            self._full = None
+            if len(self._overlay) > MAX_OVERLAY_PARTITIONS:
+                self._rebase(self.df)
+            for view in self._derived.values():
+                if hasattr(view, "partitions_changed"):
+                    view.partitions_changed(frames)
+        for listener in _change_listeners:
+            listener(list(frames))
+
+    def partition_version(self, student_name, class_name, term, session):
+        # Pass back to save_records as expected_versions to refuse overwriting
+        # a partition someone else saved in the meantime
+        return partition_version(self.student_rows(student_name, class_name, term, session))
+
+    def save_records(self, records, replace_partitions=True, expected_versions=None, new_partitions=(), cleared=()):
+        # expected_versions: {(student, class, term, session): partition_version}
+        # as the editor loaded them; raises StaleWriteError if any has changed
+        # since. new_partitions: keys the editor is entering a new student
+        # under; raises NamesakeError rather than add to one already saved.
+        # cleared: keys emptied in the same write, e.g. the class a student was
+        # moved out of.
+        records = records.reindex(columns=list(dict.fromkeys(EXPECTED_COLUMNS + list(records.columns))))
+        with self._lock:
+            namesakes = [key for key in new_partitions if self.partition_version(*key) is not None]
+            if namesakes:
+                raise NamesakeError(namesakes)
+            expected_versions = {**{key: None for key in new_partitions}, **(expected_versions or {})}
+            stale = [key for key, version in expected_versions.items()
+                     if self.partition_version(*key) != version]
+            if stale:
+                raise StaleWriteError(stale)
+            current = self.df if self.backend.needs_current else None
+            new_signature = self.backend.save_records(records, replace_partitions,
+                                                      current=current, expected_signature=self.signature,
+                                                      expected_versions=expected_versions, cleared=cleared)
+            merged = {partition_key(*key): self.student_rows(*key).iloc[0:0] for key in cleared}
+            keys = key_frame(records)
+            for key, rows in records.groupby([keys[col] for col in STUDENT_TERM_KEY], sort=False):
+                merged[key] = merge_records(self.student_rows(*key), rows, replace_partitions)
+            self.apply_partitions(merged)
+            # None means someone else wrote in between; the next refresh catches up
+            if new_signature is not None:
+                self.signature = new_signature
+
+    def refresh(self):
+        # Returns the store to use for this rerun: self if nothing changed,
+        # self patched with the changed partitions, or a freshly loaded store.
+        signature = self.backend.signature()
+        if signature == self.signature:
+            return self
+        changed = self.backend.changed_partitions(self.signature)
+        if changed is None:
+            return ProgressStore(self.backend, self.backend.load(), signature)
+        with self._lock:
+            self.apply_partitions(self.backend.load_partitions(changed))
+            self.signature = signature
+        return self
+
+
+_store_cache = {}
+_school_info_cache = {}
+_cache_lock = threading.Lock()
+
+
+def load_progress_store(backend=None):
+    # Shared across reruns and sessions of the same server process; rebuilt
+    # only when the backend reports a change made outside this store.
+    backend = backend or get_backend()
+    key = backend.cache_key()
+    with _cache_lock:
+        store = _store_cache.get(key)
+        if store is None:
+            signature = backend.signature()
+            store = ProgressStore(backend, backend.load(), signature)
+        else:
+            store = store.refresh()
+        _store_cache[key] = store
+        return store
+
+
+def load_school_info(backend=None):
+    backend = backend or get_backend()
+    key = backend.cache_key()
+    signature = backend.school_info_signature()
+    with _cache_lock:
+        cached = _school_info_cache.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        info = backend.load_school_info()
+        _school_info_cache[key] = (signature, info)
+        return info
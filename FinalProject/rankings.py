@@ -0,0 +1,185 @@
+import threading
+import pandas as pd
+
+TOTAL_COLUMNS = ["Total_Obt", "Total_Max"]
+
+
+def get_ordinal_position(n):
+    if 10 <= n % 100 <= 20:
+        suffix = 'th'
+    else:
+        suffix = {1: 'st', 2: 'nd', 3: 'rd'}.get(n % 10, 'th')
+    return f"{n}{suffix}"
+
+
+def competition_rank(percentages, groups=None):
+    # Standard competition ranking ("1224"): tied scores share a position and
+    # the next score skips the positions they used. With `groups`, ranks within
+    # each group in one pass.
+    rounded = percentages.round(6)
+    if groups is not None:
+        rounded = rounded.groupby(groups, observed=True)
+    return rounded.rank(method="min", ascending=False, na_option="bottom").astype(int)
+
+
+def scored_rows(df):
+    # Subject rows with numeric totals; blanks are subjects without scores
+    df = df.copy()
+    for col in TOTAL_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df.dropna(subset=TOTAL_COLUMNS)
+
+
+def student_totals(df, keys=("Student_Name", "Class")):
+    # Totals, scored subject count and percentage per student (per `keys` group)
+    keys = list(keys)
+    rows = scored_rows(df[keys + TOTAL_COLUMNS])
+    grouped = rows.groupby(keys, sort=False, observed=True)
+    totals = grouped[TOTAL_COLUMNS].sum()
+    totals["Subjects"] = grouped.size()
+    totals = totals.reset_index()
+    totals["Percentage"] = (totals["Total_Obt"] / totals["Total_Max"]) * 100
+    return totals
+
+
+def ranked(df, rank_column="Rank"):
+    df = df.copy()
+    df[rank_column] = competition_rank(df["Percentage"]) if len(df) else pd.Series(dtype=int)
+    df = df.sort_values([rank_column, "Student_Name"], kind="stable").reset_index(drop=True)
+    df["Position"] = [get_ordinal_position(rank) for rank in df[rank_column]]
+    return df
+
+
+def class_positions(df):
+    # {(student, class): (position, class size)} for one term's rows in a single
+    # grouped pass, so a batch print run never ranks per card
+    totals = student_totals(df)
+    if totals.empty:
+        return {}
+    totals["Rank"] = competition_rank(totals["Percentage"], totals["Class"])
+    totals["Size"] = totals.groupby("Class", observed=True)["Student_Name"].transform("size")
+    return {(name, class_name): (get_ordinal_position(int(rank)), int(size))
+            for name, class_name, rank, size in totals[["Student_Name", "Class", "Rank", "Size"]].itertuples(index=False)}
+
+
+def class_table(rows):
+    # One class's ranking table: student totals ranked within the class, and
+    # each scored subject row with its percentage
+    subjects = scored_rows(rows[["Student_Name", "Class", "Subject"] + TOTAL_COLUMNS])
+    subjects["Percentage"] = (subjects["Total_Obt"] / subjects["Total_Max"]) * 100
+    return {"totals": ranked(student_totals(rows)), "subjects": subjects.reset_index(drop=True)}
+
+
+def class_tables(rows):
+    # {class: class_table} for the rows of many classes, ranked in one grouped
+    # pass instead of one pipeline per class; classes without scores are left out
+    totals = student_totals(rows)
+    if totals.empty:
+        return {}
+    totals["Rank"] = competition_rank(totals["Percentage"], totals["Class"])
+    totals = totals.sort_values(["Class", "Rank", "Student_Name"], kind="stable")
+    totals["Position"] = [get_ordinal_position(rank) for rank in totals["Rank"]]
+    subjects = scored_rows(rows[["Student_Name", "Class", "Subject"] + TOTAL_COLUMNS])
+    subjects["Percentage"] = (subjects["Total_Obt"] / subjects["Total_Max"]) * 100
+    subjects = dict(list(subjects.groupby("Class", sort=False, observed=True)))
+    return {class_name: {"totals": part.reset_index(drop=True),
+                         "subjects": subjects[class_name].reset_index(drop=True)}
+            for class_name, part in totals.groupby("Class", sort=False, observed=True)}
+
+
+class RankingViews:
+    # Materialized ranking tables per (Term, Session, Class), kept on the progress
+    # store. A save bumps the store's version for the classes it touched, so only
+    # those tables are recomputed; school-wide views are re-ranked from the
+    # per-class student totals rather than from raw subject rows. A term's
+    # tables are first built together from its rows; after that a save only
+    # rebuilds the one class it touched.
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._class_tables = {}
+        self._combined = {}
+
+    def _class_table(self, term, session, class_name):
+        key = (term, session, class_name)
+        version = self.store.version(term, session, class_name)
+        with self._lock:
+            cached = self._class_tables.get(key)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+        table = class_table(self.store.class_rows(term, session, class_name))
+        with self._lock:
+            self._class_tables[key] = (version, table)
+        return table
+
+    def _term_tables(self, term, session):
+        classes, versions = self.term_key(term, session)
+        key = (term, session)
+        with self._lock:
+            cached = self._combined.get(key)
+            if cached is not None and cached[0] == (classes, versions):
+                return cached[1]
+        with self._lock:
+            stale = {class_name: version for class_name, version in zip(classes, versions)
+                     if self._class_tables.get((term, session, class_name), (None,))[0] != version}
+        if len(stale) > 1:
+            rows = self.store.term_rows(term, session)
+            if len(stale) < len(classes):
+                rows = rows[rows["Class"].isin(list(stale)).to_numpy()]
+            built = class_tables(rows)
+            with self._lock:
+                # Versions were read before the rows, so a save made meanwhile
+                # only makes its class look stale again
+                for class_name, table in built.items():
+                    self._class_tables[(term, session, class_name)] = (stale[class_name], table)
+        tables = [self._class_table(term, session, class_name) for class_name in classes]
+        combined = {
+            "totals": pd.concat([table["totals"] for table in tables], ignore_index=True) if tables else pd.DataFrame(),
+            "subjects": pd.concat([table["subjects"] for table in tables], ignore_index=True) if tables else pd.DataFrame(),
+        }
+        with self._lock:
+            self._combined[key] = ((classes, versions), combined)
+        return combined
+
+    def term_totals(self, term, session):
+        # Every class's student totals for the term, each ranked within its class
+        return self._term_tables(term, session)["totals"]
+
+    def term_key(self, term, session):
+        # Changes whenever a class of the term is saved to; for views built on term_totals
+        classes = self.store.classes(term, session)
+        return tuple(classes), tuple(self.store.version(term, session, class_name) for class_name in classes)
+
+    def overall_ranking(self, term, session, class_name=None):
+        if class_name is not None:
+            return self._class_table(term, session, class_name)["totals"]
+        totals = self._term_tables(term, session)["totals"]
+        return ranked(totals) if len(totals) else totals
+
+    def subjects(self, term, session):
+        subjects = self._term_tables(term, session)["subjects"]
+        return subjects["Subject"].unique().tolist() if len(subjects) else []
+
+    def subject_ranking(self, term, session, subject, class_name=None):
+        tables = self._class_table(term, session, class_name) if class_name is not None \
+            else self._term_tables(term, session)
+        subjects = tables["subjects"]
+        if subjects.empty:
+            return subjects
+        return ranked(subjects[subjects["Subject"] == subject])
+
+    def student_position(self, student_name, class_name, term, session):
+        # (ordinal position, class size) on the saved records, or (None, None)
+        rows = self.store.student_rows(student_name, class_name, term, session)
+        if rows.empty or pd.isna(rows["Class"].iloc[0]):
+            return None, None
+        totals = self._class_table(term, session, rows["Class"].iloc[0])["totals"]
+        match = totals[totals["Student_Name"] == student_name]
+        if match.empty:
+            return None, None
+        return match["Position"].iloc[0], len(totals)
+
+
+def ranking_views(store):
+    return store.derived("rankings", RankingViews)
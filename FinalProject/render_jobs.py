@@ -0,0 +1,261 @@
+import os
+import time
+import uuid
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from batch_reports import card_file_name, merge_pdfs, render_card, zip_pdfs
+from pdf_cache import card_key, card_partition, get_pdf_cache
+
+# One pool per server process, shared by every session; AMS_RENDER_WORKERS caps it
+RENDER_WORKERS = int(os.environ.get("AMS_RENDER_WORKERS", os.cpu_count() or 1))
+# Finished jobs keep their file for download until they expire or are pushed out
+JOB_TTL_SECONDS = 60 * 60
+MAX_FINISHED_JOBS_PER_OWNER = 5
+
+MIME_TYPES = {"single": "application/pdf", "merged": "application/pdf", "zip": "application/zip"}
+
+
+class RenderJob:
+    # Handle for one submitted render: a single card or a batch. Counters are
+    # updated by the queue as cards finish; `data` is set once the job is done.
+    def __init__(self, owner, cards, scale, output, file_name, label):
+        self.id = uuid.uuid4().hex[:12]
+        self.owner = owner
+        self.cards = cards
+        self.scale = scale  # grading scale the cards were collected with, for their cache keys
+        self.output = output  # "single", "merged" or "zip"
+        self.file_name = file_name
+        self.label = label
+        self.total = len(cards)
+        self.done = 0
+        self.pdfs = [None] * len(cards)
+        self.failures = []  # [(student_name, student_class, error)]
+        self.data = None
+        self.rendered = 0
+        self.status = "queued"  # queued, running, assembling, done, cancelled
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self._todo = deque()  # card indexes still to hand to a worker
+        self._keys = [None] * len(cards)  # pdf_cache keys
+        self._settled = threading.Event()  # set once done or cancelled
+
+    @property
+    def finished(self):
+        return self.status in ("done", "cancelled")
+
+    @property
+    def mime(self):
+        return MIME_TYPES[self.output]
+
+    def progress(self):
+        return self.done / self.total if self.total else 1.0
+
+    def wait(self, timeout=None):
+        return self._settled.wait(timeout)
+
+
+class RenderQueue:
+    # Cards go to a bounded process pool one at a time, taking turns between
+    # the sessions that have work queued, so a class-wide print run shares the
+    # workers with a teacher's single preview instead of holding them all.
+    # Cards already in the PDF cache are never sent to a worker.
+
+    def __init__(self, workers=RENDER_WORKERS, cache=None):
+        self.workers = max(1, workers)
+        self.cache = cache or get_pdf_cache()
+        # Re-entrant: a card that finishes before its callback is attached
+        # calls back straight away, with the lock already held
+        self._lock = threading.RLock()
+        self._jobs = {}
+        self._waiting = deque()  # owners with cards still to dispatch, in turn order
+        self._owner_queues = {}  # owner -> deque of their jobs with cards to dispatch
+        self._in_flight = 0
+        self._executor = None
+
+    def _pool(self):
+        if self._executor is None:
+            # spawn keeps workers clear of the Streamlit server's threads
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def submit(self, owner, cards, scale, output="merged", file_name=None, label=None):
+        job = RenderJob(owner, list(cards), scale, output,
+                        file_name or (card_file_name(cards[0]) if len(cards) == 1 else "report_cards.pdf"),
+                        label or file_name)
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+        if job.total <= 1:
+            # A single card is looked up right here, so a cached preview is ready at once
+            self._prepare(job)
+        else:
+            threading.Thread(target=self._prepare, args=(job,), name="render-prepare", daemon=True).start()
+        return job
+
+    def render(self, owner, card, scale, timeout=None):
+        # Blocking single card, e.g. for a download callback: a cache hit returns
+        # straight away, otherwise the card takes its turn on the shared pool
+        job = self.submit(owner, [card], scale, output="single")
+        if not job.wait(timeout):
+            self.cancel(job.id)
+        self.dismiss(job.id)
+        if job.data is None:
+            raise RuntimeError(job.failures[0][2] if job.failures else "Report card was not rendered in time")
+        return job.data
+
+    def _prepare(self, job):
+        # Hashing a whole school's cards takes a moment; batches do it off the script thread
+        cached = {}
+        for index, card in enumerate(job.cards):
+            job._keys[index] = card_key(card, job.scale)
+            pdf = self.cache.get(job._keys[index])
+            if pdf is not None:
+                cached[index] = pdf
+        with self._lock:
+            if job.finished:
+                return
+            for index, pdf in cached.items():
+                job.pdfs[index] = pdf
+            job.done = len(cached)
+            job._todo = deque(index for index in range(job.total) if index not in cached)
+            if job._todo:
+                if job.owner not in self._owner_queues:
+                    self._owner_queues[job.owner] = deque()
+                    self._waiting.append(job.owner)
+                self._owner_queues[job.owner].append(job)
+                self._dispatch()
+                return
+            job.status = "assembling"
+        self._assemble(job)
+
+    def job(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs_for(self, owner):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.owner == owner]
+
+    def queued_cards(self):
+        # Cards waiting for a worker across every session
+        with self._lock:
+            return sum(len(job._todo) for queue in self._owner_queues.values() for job in queue)
+
+    def cancel(self, job_id):
+        # Cards already with a worker finish, but nothing more is dispatched
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return
+            queue = self._owner_queues.get(job.owner)
+            if queue is not None and job in queue:
+                queue.remove(job)
+                if not queue:
+                    del self._owner_queues[job.owner]
+                    self._waiting.remove(job.owner)
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            job._settled.set()
+
+    def dismiss(self, job_id):
+        self.cancel(job_id)
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def _dispatch(self):
+        # Called with the lock held: fill free workers, one card per owner in turn
+        while self._in_flight < self.workers and self._waiting:
+            owner = self._waiting.popleft()
+            queue = self._owner_queues[owner]
+            job = queue[0]
+            index = job._todo.popleft()
+            job.status = "running"
+            if not job._todo:
+                queue.popleft()
+            if queue:
+                self._waiting.append(owner)
+            else:
+                del self._owner_queues[owner]
+            try:
+                future = self._pool().submit(render_card, index, job.cards[index])
+            except BrokenProcessPool:
+                self._executor = None
+                future = self._pool().submit(render_card, index, job.cards[index])
+            self._in_flight += 1
+            future.add_done_callback(lambda future, job=job, index=index: self._card_done(job, index, future))
+
+    def _card_done(self, job, index, future):
+        try:
+            _, pdf, error = future.result()
+        except Exception as e:
+            pdf, error = None, f"{type(e).__name__}: {e}"
+        if pdf is not None:
+            self.cache.put(job._keys[index], pdf, card_partition(job.cards[index]))
+        with self._lock:
+            if isinstance(future.exception(), BrokenProcessPool):
+                # A crashed worker takes the pool with it; start a fresh one
+                self._executor = None
+            self._in_flight -= 1
+            job.pdfs[index] = pdf
+            if error:
+                card = job.cards[index]
+                job.failures.append((card["student_name"], card["student_class"], error))
+            job.done += 1
+            complete = job.done == job.total and job.status == "running"
+            if complete:
+                job.status = "assembling"
+            self._dispatch()
+        if complete:
+            # Merging a large batch is slow; keep it off the pool's callback thread
+            threading.Thread(target=self._assemble, args=(job,), name="render-assemble", daemon=True).start()
+
+    def _assemble(self, job):
+        rendered = [(card, pdf) for card, pdf in zip(job.cards, job.pdfs) if pdf is not None]
+        data = None
+        if rendered:
+            if job.output == "zip":
+                data = zip_pdfs([card for card, _ in rendered], [pdf for _, pdf in rendered])
+            elif job.output == "merged":
+                data = merge_pdfs([pdf for _, pdf in rendered])
+            else:
+                data = rendered[0][1]
+        with self._lock:
+            job.data = data
+            job.rendered = len(rendered)
+            self._finish(job)
+
+    def _finish(self, job):
+        job.status = "done"
+        job.finished_at = time.time()
+        job._settled.set()
+        # Cards and per-card PDFs are only needed while rendering
+        job.cards = []
+        job.pdfs = []
+
+    def _expire(self):
+        # Called with the lock held: drop old finished jobs so their files don't pile up
+        now = time.time()
+        finished = sorted((job for job in self._jobs.values() if job.finished),
+                          key=lambda job: job.finished_at, reverse=True)
+        kept_per_owner = {}
+        for job in finished:
+            kept = kept_per_owner.get(job.owner, 0)
+            if now - job.finished_at > JOB_TTL_SECONDS or kept >= MAX_FINISHED_JOBS_PER_OWNER:
+                del self._jobs[job.id]
+            else:
+                kept_per_owner[job.owner] = kept + 1
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_render_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = RenderQueue()
+        return _queue
@@ -0,0 +1,283 @@
+import os
+import copy
+import html
+from io import BytesIO
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
+from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import cm
+from storage import file_signature
+
+CARD_COLUMNS = ["Subject", "CA1_Obt", "CA1_Max", "CA2_Obt", "CA2_Max", "Exam_Obt", "Exam_Max",
+                "Total_Obt", "Total_Max", "Grade", "Remark"]
+SCORE_INPUT_COLUMNS = ["CA1_Obt", "CA1_Max", "CA2_Obt", "CA2_Max", "Exam_Obt", "Exam_Max"]
+# Optional per-subject class figures (class_statistics.with_class_statistics);
+# cards whose df has them print three more columns
+CARD_STAT_COLUMNS = ["Class_Average", "Class_Highest", "Class_Lowest"]
+
+LOGO_FILE = "school_logo.png"
+COL_WIDTHS = [3*cm] + [1.5*cm]*8 + [1.5*cm, 2.5*cm]
+# Narrower columns and cell padding make room for the class figures within the page
+STAT_COL_WIDTHS = [2.2*cm] + [1.33*cm]*8 + [1*cm, 1.5*cm] + [0.85*cm]*3
+STAT_TABLE_STYLE = [("LEFTPADDING", (0,0), (-1,-1), 2), ("RIGHTPADDING", (0,0), (-1,-1), 2)]
+# (obtained, obtainable) column pairs whose obtained mark turns red below 50%
+MARK_COLUMN_PAIRS = [(1, 2), (3, 4), (5, 6), (7, 8)]
+BASE_TABLE_STYLE = [
+    ("SPAN", (1,0),(2,0)),
+    ("SPAN", (3,0),(4,0)),
+    ("SPAN", (5,0),(6,0)),
+    ("SPAN", (7,0),(8,0)),
+    ("BACKGROUND", (0,0), (-1,1), colors.grey),
+    ("TEXTCOLOR", (0,0), (-1,1), colors.whitesmoke),
+    ("ALIGN", (0,0), (-1,-1), "CENTER"),
+    ("GRID", (0,0), (-1,-1), 0.5, colors.black),
+    ("FONTNAME", (0,0), (-1,1), "Helvetica-Bold"),
+    ("FONTSIZE", (0,0), (-1,-1), 7),
+    ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
+]
+
+
+def failing_mark_cells(values):
+    # (column, row) table cells whose obtained mark is under half of the obtainable,
+    # found in one vectorized comparison over the card's CARD_COLUMNS values;
+    # blanks and text never match
+    marks = values[:, [col for pair in MARK_COLUMN_PAIRS for col in pair]]
+    marks = pd.to_numeric(pd.Series(marks.ravel()), errors="coerce").to_numpy(float).reshape(marks.shape)
+    rows, pairs = np.nonzero(marks[:, 0::2] < 0.5 * marks[:, 1::2])
+    return [(MARK_COLUMN_PAIRS[pair][0], row + 2) for row, pair in zip(rows, pairs)]
+
+
+class ReportCardRenderer:
+    # Everything that is the same on every card of a school/term (styles, logo,
+    # header and table templates) is prepared once; render() only lays out the
+    # student-specific content. Flowables are copied per render because
+    # ReportLab keeps layout state on them.
+
+    def __init__(self, school_name, school_address, term, session, logo_path=LOGO_FILE):
+        styles = getSampleStyleSheet()
+        self.normal_style = ParagraphStyle(name="card_normal", parent=styles["Normal"], fontSize=7)
+        center_style = ParagraphStyle(name="center", alignment=1, fontSize=7)
+        center_title = ParagraphStyle(name="center_title", alignment=1, fontSize=12)
+        center_address = ParagraphStyle(name="center_address", alignment=1, fontSize=10)
+
+        # School Logo (if provided), read from disk once
+        self.logo_bytes = None
+        if logo_path and os.path.exists(logo_path):
+            with open(logo_path, "rb") as f:
+                self.logo_bytes = f.read()
+
+        # School Name & Address, then Term and Session as report title
+        self.header = [
+            Paragraph(f"<b>{school_name}</b>", center_title),
+            Paragraph(f"{school_address}", center_address),
+            Spacer(1, 6),
+            Paragraph(f"<b>{term} {session} Academic Report Card</b>", center_title),
+            Spacer(1, 12),
+        ]
+
+        # Table Headers
+        mark_headers = [Paragraph("Mark<br/>Obtained", center_style), Paragraph("Mark<br/>Obtainable", center_style)]
+        self.table_header = [
+            ["Subject", "1st CA", "", "2nd CA", "", "Exam", "", "Total", "", "Grade", "Remark"],
+            [""] + mark_headers * 4 + ["", ""],
+        ]
+        stat_headers = [Paragraph(f"Class<br/>{label}", center_style) for label in ("Avg.", "High", "Low")]
+        self.stat_table_header = [self.table_header[0] + stat_headers, self.table_header[1] + ["", "", ""]]
+
+    def _logo(self):
+        if self.logo_bytes is None:
+            return []
+        try:
+            logo = Image(BytesIO(self.logo_bytes), width=2*cm, height=2*cm)
+            logo.hAlign = 'CENTER'
+            return [logo, Spacer(1, 6)]
+        except Exception:
+            # If logo loading fails, continue without logo
+            return []
+
+    def render(self, student_name, student_class, student_number, df, total_obt, total_max, average,
+               class_teacher_comment, principal_comment, position=None, class_size=None, annual=None):
+        buffer = BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=A4,
+                                rightMargin=1.5*cm, leftMargin=1.5*cm,
+                                topMargin=1.5*cm, bottomMargin=1.5*cm)
+        normal_style = self.normal_style
+        elements = self._logo() + [copy.copy(flowable) for flowable in self.header]
+
+        # Student Info
+        elements.append(Paragraph(f"Student Name: {student_name}", normal_style))
+        elements.append(Paragraph(f"Class: {student_class}", normal_style))
+        elements.append(Paragraph(f"No in Class: {student_number}", normal_style))
+        if position:
+            elements.append(Paragraph(f"Position in Class: {position} out of {class_size}", normal_style))
+        elements.append(Spacer(1, 12))
+
+        # Table Data Rows, with the class figures when the card has them
+        with_stats = all(column in df.columns for column in CARD_STAT_COLUMNS)
+        header = self.stat_table_header if with_stats else self.table_header
+        values = df[CARD_COLUMNS + CARD_STAT_COLUMNS if with_stats else CARD_COLUMNS].to_numpy(dtype=object)
+        table_data = [[copy.copy(cell) for cell in row] for row in header]
+        table_data += values.tolist()
+        table = Table(table_data, colWidths=STAT_COL_WIDTHS if with_stats else COL_WIDTHS, repeatRows=2)
+
+        # Red color for marks <50%
+        style = TableStyle(BASE_TABLE_STYLE + (STAT_TABLE_STYLE if with_stats else [])
+                           + [("TEXTCOLOR", cell, cell, colors.red) for cell in failing_mark_cells(values)])
+        table.setStyle(style)
+        elements.append(table)
+
+        # Summary
+        elements.append(Spacer(1, 12))
+        elements.append(Paragraph(f"Total Marks: {total_obt} / {total_max}", normal_style))
+        elements.append(Paragraph(f"Average Score: {average:.2f}", normal_style))
+        percentage = (total_obt / total_max) * 100 if total_max > 0 else 0
+        elements.append(Paragraph(f"Percentage: {percentage:.2f}%", normal_style))
+
+        # Cumulative results for the session (third term cards)
+        if annual:
+            elements.append(Spacer(1, 12))
+            elements.append(Paragraph("<b>Cumulative Results</b>", normal_style))
+            for line in annual_lines(annual):
+                elements.append(Paragraph(line, normal_style))
+
+        # Comments
+        elements.append(Spacer(1, 12))
+        if class_teacher_comment:
+            elements.append(Paragraph(f"Class Teacher's Comment: {class_teacher_comment}", normal_style))
+        elements.append(Spacer(1, 12))
+        elements.append(Paragraph(f"Principal's Comment: {'_'*40}", normal_style))
+        if principal_comment:
+            elements.append(Paragraph(principal_comment, normal_style))
+
+        doc.build(elements)
+        buffer.seek(0)
+        return buffer
+
+
+@lru_cache(maxsize=32)
+def _cached_renderer(school_name, school_address, term, session, logo_path, logo_signature):
+    return ReportCardRenderer(school_name, school_address, term, session, logo_path)
+
+
+def get_renderer(school_name, school_address, term, session, logo_path=LOGO_FILE):
+    # Shared by the interactive PDF button and batch workers; a new logo upload
+    # changes the file signature and so gets a fresh renderer
+    return _cached_renderer(school_name, school_address, term, session, logo_path, file_signature(logo_path))
+
+
+def create_pdf(school_name, school_address, student_name, student_class, student_number, term, session,
+               df, total_obt, total_max, average, class_teacher_comment, principal_comment,
+               position=None, class_size=None, annual=None, logo_path=LOGO_FILE):
+    return get_renderer(school_name, school_address, term, session, logo_path).render(
+        student_name, student_class, student_number, df, total_obt, total_max, average,
+        class_teacher_comment, principal_comment, position, class_size, annual)
+
+
+def annual_lines(annual):
+    # Text lines for an annual.annual_summaries entry, shared by the PDF, HTML
+    # and text cards
+    lines = [f"{term}: {format_score(total) if total is not None else '-'}" for term, total in annual["terms"].items()]
+    lines.append(f"Cumulative Total: {format_score(annual['total_obt'])} / {format_score(annual['total_max'])}")
+    lines.append(f"Cumulative Average: {annual['average']:.2f}")
+    lines.append(f"Cumulative Percentage: {annual['percentage']:.2f}%")
+    lines.append(f"Position in Class for the Session: {annual['position']} out of {annual['class_size']}")
+    if annual["decision"]:
+        lines.append(f"Promotion: {annual['decision']}")
+    return lines
+
+
+PREVIEW_STYLE = """<style>
+.card-preview {font-size: 0.8rem; background: #fff; color: #000; padding: 1rem; border: 1px solid #ccc}
+.card-preview .heading {text-align: center}
+.card-preview table {border-collapse: collapse; width: 100%}
+.card-preview th, .card-preview td {border: 1px solid #000; padding: 2px 4px; text-align: center}
+.card-preview th {background: #808080; color: #f5f5f5}
+.card-preview .failing {color: red}
+</style>"""
+
+
+def card_html(card):
+    # Light on-screen preview of a create_pdf card: the same content as the PDF
+    # (minus the logo) as a few KB of HTML, so previews never ship the PDF itself
+    esc = lambda value: html.escape(str(format_score(value)))
+    with_stats = all(column in card["df"].columns for column in CARD_STAT_COLUMNS)
+    values = card["df"][CARD_COLUMNS + CARD_STAT_COLUMNS if with_stats else CARD_COLUMNS].to_numpy(dtype=object)
+    failing = set(failing_mark_cells(values))
+    stat_headers = "".join(f'<th rowspan="2">Class {label}</th>' for label in ("Average", "Highest", "Lowest")) \
+        if with_stats else ""
+    rows = "".join(
+        "<tr>" + "".join(f'<td class="failing">{esc(value)}</td>' if (col, row + 2) in failing else f"<td>{esc(value)}</td>"
+                         for col, value in enumerate(line)) + "</tr>"
+        for row, line in enumerate(values.tolist()))
+    total_obt, total_max = card["total_obt"], card["total_max"]
+    percentage = (total_obt / total_max) * 100 if total_max > 0 else 0
+    student = [f"Student Name: {esc(card['student_name'])}", f"Class: {esc(card['student_class'])}",
+               f"No in Class: {esc(card['student_number'])}"]
+    if card.get("position"):
+        student.append(f"Position in Class: {esc(card['position'])} out of {esc(card['class_size'])}")
+    summary = [f"Total Marks: {esc(total_obt)} / {esc(total_max)}", f"Average Score: {card['average']:.2f}",
+               f"Percentage: {percentage:.2f}%"]
+    cumulative = "<br/>".join(html.escape(line) for line in annual_lines(card["annual"])) if card.get("annual") else ""
+    comments = [f"Class Teacher's Comment: {esc(card['class_teacher_comment'])}"] if card["class_teacher_comment"] else []
+    comments.append(f"Principal's Comment: {esc(card['principal_comment'])}")
+    return (
+        f'{PREVIEW_STYLE}<div class="card-preview"><div class="heading">'
+        f'<b>{esc(card["school_name"])}</b><br/>{esc(card["school_address"])}<br/>'
+        f'<b>{esc(card["term"])} {esc(card["session"])} Academic Report Card</b></div>'
+        f'<p>{"<br/>".join(student)}</p><table>'
+        '<tr><th rowspan="2">Subject</th><th colspan="2">1st CA</th><th colspan="2">2nd CA</th>'
+        '<th colspan="2">Exam</th><th colspan="2">Total</th><th rowspan="2">Grade</th><th rowspan="2">Remark</th>'
+        f'{stat_headers}</tr><tr>{"<th>Mark Obtained</th><th>Mark Obtainable</th>" * 4}</tr>{rows}</table>'
+        f'<p>{"<br/>".join(summary)}</p>'
+        + (f'<p><b>Cumulative Results</b><br/>{cumulative}</p>' if cumulative else "")
+        + f'<p>{"<br/>".join(comments)}</p></div>'
+    )
+
+
+def format_score(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def first_text(rows, column, default=""):
+    # Comments, class and school details repeat on every subject row
+    if column not in rows.columns:
+        return default
+    values = rows[column].dropna()
+    values = values[values.astype(str).str.strip() != ""]
+    return values.iloc[0] if not values.empty else default
+
+
+def card_from_rows(rows, school_name=None, school_address=None):
+    # Builds the create_pdf arguments for one student's saved (term, session) rows,
+    # with the same totals the Record Student Marks tab shows
+    rows = rows.reset_index(drop=True)
+    df = rows.reindex(columns=CARD_COLUMNS)
+    for col in CARD_COLUMNS[1:]:
+        df[col] = df[col].astype(object).map(format_score)
+    has_scores = df[SCORE_INPUT_COLUMNS].astype(str).apply(lambda col: col.str.strip() != "").any(axis=1)
+    df = df[has_scores].reset_index(drop=True)
+    total_obt = pd.to_numeric(rows.loc[has_scores, "Total_Obt"], errors="coerce").fillna(0).sum()
+    total_max = pd.to_numeric(rows.loc[has_scores, "Total_Max"], errors="coerce").fillna(0).sum()
+    return {
+        "school_name": first_text(rows, "School_Name", school_name),
+        "school_address": first_text(rows, "School_Address", school_address),
+        "student_name": first_text(rows, "Student_Name"),
+        "student_class": first_text(rows, "Class"),
+        "student_number": first_text(rows, "Number"),
+        "term": first_text(rows, "Term"),
+        "session": first_text(rows, "Session"),
+        "df": df,
+        "total_obt": format_score(float(total_obt)),
+        "total_max": format_score(float(total_max)),
+        "average": total_obt / len(df) if len(df) else 0,
+        "class_teacher_comment": first_text(rows, "Teacher_Comment"),
+        "principal_comment": first_text(rows, "Principal_Comment"),
+    }
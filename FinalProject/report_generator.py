@@ -1,66 +1,225 @@
 # Simple Nigerian Report Card Generator
+#
+# Headless report cards from the saved progress records, for scheduled runs:
+#   python report_generator.py generate --session 2024/2025 --term "First Term" --format pdf -o cards.pdf
+#   python report_generator.py generate --csv scores.csv --class JSS1A --format json
+# The original typed-in mode is still available with `python report_generator.py interactive`.
+import os
+import sys
+import json
+import argparse
+from grading import GRADING_FILE, load_scale
+from storage import CsvBackend, get_backend, school_ids, school_path
+from progress_store import TERM_KEY
+from batch_reports import collect_cards, render_batch
+from report_card import CARD_STAT_COLUMNS, LOGO_FILE, annual_lines
+from annual import AGGREGATE_COLUMNS, FINAL_TERM, annual_results, annual_summaries, term_aggregates
+from pdf_cache import get_pdf_cache
 
 def get_grade_remark(total):
-    if total >= 70:
-        return "A", "Excellent"
-    elif total >= 60:
-        return "B", "Very Good"
-    elif total >= 50:
-        return "C", "Good"
-    elif total >= 40:
-        return "D", "Fair"
-    else:
-        return "F", "Poor"
+    # Same configurable bands as the Streamlit app; totals here are out of 100
+    return load_scale().grade(total, 100)
 
-# Subjects
+# Subjects for the interactive mode
 subjects = ["English", "Mathematics", "Basic Science", "Business Studies"]
 
-students = {}
-
-num_students = int(input("Enter number of students: "))
-
-for _ in range(num_students):
-    name = input("\nEnter student name: ")
-    scores = []
-    total_score = 0
-    
-    print(f"\n--- Enter scores for {name} ---")
-    for subject in subjects:
-        ca1 = int(input(f"{subject} CA1 (out of 20): "))
-        ca2 = int(input(f"{subject} CA2 (out of 20): "))
-        exam = int(input(f"{subject} Exam (out of 60): "))
-        
-        total = ca1 + ca2 + exam
-        grade, remark = get_grade_remark(total)
-        
-        scores.append([subject, ca1, ca2, exam, total, grade, remark])
-        total_score += total
-    
-    average = total_score / len(subjects)
-    percentage = (total_score / (len(subjects) * 100)) * 100
-    
-    students[name] = {
-        "scores": scores,
-        "total": total_score,
-        "average": average,
-        "percentage": percentage
-    }
-
-# Print report card
-for name, record in students.items():
-    print("\n" + "="*50)
-    print(f"REPORT CARD FOR: {name}")
-    print("="*50)
-    print("{:<15}{:<5}{:<5}{:<6}{:<7}{:<6}{:<10}".format(
-        "Subject", "CA1", "CA2", "Exam", "Total", "Grade", "Remark"
-    ))
-    print("-"*50)
-    for s in record["scores"]:
-        print("{:<15}{:<5}{:<5}{:<6}{:<7}{:<6}{:<10}".format(*s))
-    
-    print("-"*50)
-    print(f"Total Marks: {record['total']}")
-    print(f"Average: {record['average']:.2f}")
-    print(f"Percentage: {record['percentage']:.2f}%")
-    comment = (input("Teacher's Comment:") if record['average'] >= 50 else "Needs improvement")
-    print(comment)
+
+def school_scale(backend):
+    return load_scale(school_path(backend.school, GRADING_FILE))
+
+
+def load_cards(backend, term=None, session=None, class_name=None):
+    # Cards for every (term, session) in the filtered records, each ranked on its own.
+    df = backend.load(term, session, class_name)
+    school_name, school_address = backend.load_school_info()
+    # A school shard has its own grading scale and logo
+    scale = school_scale(backend)
+    logo_path = school_path(backend.school, LOGO_FILE)
+    annual = {}
+    if term == FINAL_TERM:
+        # Final-term cards carry cumulative results, which only need the totals
+        # of the session's earlier terms rather than every column
+        totals = backend.load(None, session, class_name, columns=AGGREGATE_COLUMNS)
+        for each_session, rows in totals.groupby("Session", sort=False, observed=True):
+            annual[each_session] = annual_summaries(annual_results(term_aggregates(rows), scale.pass_percent()))
+    cards = []
+    partitions = df[TERM_KEY].dropna().drop_duplicates().itertuples(index=False, name=None)
+    for card_term, card_session in sorted(partitions, key=lambda key: (str(key[1]), str(key[0]))):
+        cards.extend(collect_cards(df, card_term, card_session, class_name, school_name, school_address,
+                                   annual=annual.get(card_session), scale=scale, logo_path=logo_path))
+    return cards
+
+
+def card_text(card):
+    lines = ["=" * 50,
+             f"REPORT CARD FOR: {card['student_name']}",
+             f"{card['student_class']}  {card['term']}  {card['session']}",
+             "=" * 50,
+             "{:<15}{:<5}{:<5}{:<6}{:<7}{:<6}{:<10}".format("Subject", "CA1", "CA2", "Exam", "Total", "Grade", "Remark"),
+             "-" * 50]
+    with_stats = all(column in card["df"].columns for column in CARD_STAT_COLUMNS)
+    if with_stats:
+        lines[4] += "{:<6}{:<6}{:<6}".format("Avg", "High", "Low")
+    for row in card["df"].itertuples(index=False):
+        line = "{:<15}{:<5}{:<5}{:<6}{:<7}{:<6}{:<10}".format(
+            *(str(value) for value in (row.Subject, row.CA1_Obt, row.CA2_Obt, row.Exam_Obt,
+                                       row.Total_Obt, row.Grade, row.Remark)))
+        if with_stats:
+            line += "{:<6}{:<6}{:<6}".format(*(str(value) for value in (row.Class_Average, row.Class_Highest,
+                                                                       row.Class_Lowest)))
+        lines.append(line)
+    lines.append("-" * 50)
+    lines.append(f"Total Marks: {card['total_obt']} / {card['total_max']}")
+    lines.append(f"Average: {card['average']:.2f}")
+    if card.get("position"):
+        lines.append(f"Position in Class: {card['position']} out of {card['class_size']}")
+    if card.get("annual"):
+        lines.append("-" * 50)
+        lines.extend(annual_lines(card["annual"]))
+    if card["class_teacher_comment"]:
+        lines.append(f"Class Teacher's Comment: {card['class_teacher_comment']}")
+    if card["principal_comment"]:
+        lines.append(f"Principal's Comment: {card['principal_comment']}")
+    return "\n".join(lines)
+
+
+def card_json(card):
+    record = {key: value for key, value in card.items() if key not in ("df", "logo_path")}
+    record["subjects"] = card["df"].to_dict("records")
+    return record
+
+
+def write_output(data, output):
+    # "-" is stdout; text goes as-is, bytes (PDF or zip) in binary
+    if output == "-":
+        if isinstance(data, bytes):
+            sys.stdout.buffer.write(data)
+        else:
+            sys.stdout.write(data)
+        return
+    mode = "wb" if isinstance(data, bytes) else "w"
+    with open(output, mode) as f:
+        f.write(data)
+
+
+def generate(args):
+    if args.school is not None and args.school not in school_ids():
+        print(f"No school shard named {args.school!r}; see `storage.py create-school`.", file=sys.stderr)
+        return 1
+    if args.csv:
+        backend = CsvBackend(args.csv)
+        backend.school = args.school
+    else:
+        backend = get_backend(school=args.school)
+    cards = load_cards(backend, args.term, args.session, args.class_name)
+    if not cards:
+        print("No saved scores match the given filters.", file=sys.stderr)
+        return 1
+
+    if args.format == "text":
+        write_output("\n\n".join(card_text(card) for card in cards) + "\n", args.output or "-")
+        return 0
+    if args.format == "json":
+        write_output(json.dumps([card_json(card) for card in cards], indent=2, default=str) + "\n",
+                     args.output or "-")
+        return 0
+
+    output = args.output or "report_cards.pdf"
+    zipped = output.endswith(".zip")
+
+    # A live counter on a terminal; cron mail only gets the summary lines
+    live = not args.quiet and sys.stderr.isatty()
+
+    def progress(done, total):
+        if live:
+            print(f"\rRendered {done} of {total} report cards", end="", file=sys.stderr, flush=True)
+
+    cache = None if args.no_cache else get_pdf_cache()
+    result = render_batch(cards, school_scale(backend), output="zip" if zipped else "merged",
+                          workers=args.workers, progress=progress, cache=cache)
+    if live:
+        print(file=sys.stderr)
+    for student_name, student_class, error in result.failures:
+        print(f"Failed: {student_name} ({student_class}): {error}", file=sys.stderr)
+    if result.data is None:
+        return 1
+    write_output(result.data, output)
+    if not args.quiet:
+        print(f"{result.rendered} of {len(cards)} report cards written to {output}", file=sys.stderr)
+    return 1 if result.failures else 0
+
+
+def interactive():
+    students = {}
+
+    num_students = int(input("Enter number of students: "))
+
+    for _ in range(num_students):
+        name = input("\nEnter student name: ")
+        scores = []
+        total_score = 0
+
+        print(f"\n--- Enter scores for {name} ---")
+        for subject in subjects:
+            ca1 = int(input(f"{subject} CA1 (out of 20): "))
+            ca2 = int(input(f"{subject} CA2 (out of 20): "))
+            exam = int(input(f"{subject} Exam (out of 60): "))
+
+            total = ca1 + ca2 + exam
+            grade, remark = get_grade_remark(total)
+
+            scores.append([subject, ca1, ca2, exam, total, grade, remark])
+            total_score += total
+
+        average = total_score / len(subjects)
+        percentage = (total_score / (len(subjects) * 100)) * 100
+
+        students[name] = {
+            "scores": scores,
+            "total": total_score,
+            "average": average,
+            "percentage": percentage
+        }
+
+    # Print report card
+    for name, record in students.items():
+        print("\n" + "="*50)
+        print(f"REPORT CARD FOR: {name}")
+        print("="*50)
+        print("{:<15}{:<5}{:<5}{:<6}{:<7}{:<6}{:<10}".format(
+            "Subject", "CA1", "CA2", "Exam", "Total", "Grade", "Remark"
+        ))
+        print("-"*50)
+        for s in record["scores"]:
+            print("{:<15}{:<5}{:<5}{:<6}{:<7}{:<6}{:<10}".format(*s))
+
+        print("-"*50)
+        print(f"Total Marks: {record['total']}")
+        print(f"Average: {record['average']:.2f}")
+        print(f"Percentage: {record['percentage']:.2f}%")
+        comment = (input("Teacher's Comment:") if record['average'] >= 50 else "Needs improvement")
+        print(comment)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate report cards without the Streamlit app")
+    commands = parser.add_subparsers(dest="command", required=True)
+    gen = commands.add_parser("generate", help="Report cards from saved progress records")
+    gen.add_argument("--csv", help="Read scores from this CSV (progress_multi.csv layout) instead of the store")
+    gen.add_argument("--session", help="e.g. 2024/2025; every session when omitted")
+    gen.add_argument("--term", help="e.g. \"First Term\"; every term when omitted")
+    gen.add_argument("--class", dest="class_name", help="Only this class")
+    gen.add_argument("--school", help="School shard to read (its records, school info, logo and grading scale)")
+    gen.add_argument("--format", choices=["text", "pdf", "json"], default="pdf")
+    gen.add_argument("-o", "--output", help="Output file, or - for stdout. PDF runs write one merged PDF, "
+                                            "or one file per student when this ends in .zip "
+                                            "(default report_cards.pdf; text and json default to stdout)")
+    gen.add_argument("--workers", type=int, default=os.cpu_count(), help="Parallel PDF render processes")
+    gen.add_argument("--no-cache", action="store_true", help="Render every card even if a cached PDF matches")
+    gen.add_argument("-q", "--quiet", action="store_true", help="No progress output")
+    commands.add_parser("interactive", help="Type in scores for a few students and print their cards")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        sys.exit(generate(args))
+    interactive()
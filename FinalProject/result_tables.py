@@ -0,0 +1,102 @@
+import threading
+import numpy as np
+import pandas as pd
+
+TABLE_PAGE_SIZES = [25, 50, 100, 250]
+TOP_N_DEFAULT = 10
+# Columns shown as text but ordered by another column of the table
+SORT_PROXIES = {"Position": "Rank"}
+
+
+def score_pivot(rows):
+    # One row per student per term with each subject's Total_Obt as a column;
+    # subjects without a score stay NaN so the columns sort as numbers
+    if rows.empty:
+        return pd.DataFrame(columns=["Student_Name", "Class", "Term", "Session"])
+    return rows.pivot_table(
+        index=["Student_Name", "Class", "Term", "Session"],
+        columns="Subject",
+        values="Total_Obt",
+        aggfunc="first",
+        observed=True
+    ).reset_index()
+
+
+def score_text(values):
+    # Scores as display text with blanks for subjects not taken, so a pivot
+    # page doesn't mix numbers and empty strings in one column
+    numbers = pd.to_numeric(values, errors="coerce")
+    return numbers.map(lambda value: "" if pd.isna(value) else f"{value:g}")
+
+
+def table_page(df, query="", search_columns=("Student_Name", "Class"), sort_by=None, descending=False,
+               page=0, page_size=TABLE_PAGE_SIZES[0]):
+    # (rows on this page, rows matching the query). Filtering and ordering work
+    # on positions, so only the page's rows are ever copied out of `df`.
+    positions = np.arange(len(df))
+    words = query.split()
+    if words and len(df):
+        matched = np.ones(len(df), dtype=bool)
+        text = [df[column].astype(str).str.casefold() for column in search_columns if column in df.columns]
+        for word in words:
+            word = word.casefold()
+            matched &= np.logical_or.reduce([column.str.contains(word, regex=False).to_numpy() for column in text])
+        positions = positions[matched]
+    if sort_by is not None and len(positions):
+        column = df[SORT_PROXIES.get(sort_by, sort_by)].iloc[positions].reset_index(drop=True)
+        keys = column
+        if not pd.api.types.is_numeric_dtype(column):
+            filled = column.notna() & (column != "")
+            # Scores saved as text still sort as numbers; the first value tells
+            # them from names without parsing every row
+            first = pd.to_numeric(column[filled].iloc[:1], errors="coerce")
+            keys = pd.to_numeric(column, errors="coerce") if first.notna().any() \
+                else column.astype(str).str.casefold().where(filled)
+        # Blanks go last either way
+        order = keys.sort_values(ascending=not descending, na_position="last", kind="stable").index
+        positions = positions[order.to_numpy()]
+    start = page * page_size
+    return df.iloc[positions[start:start + page_size]], len(positions)
+
+
+def top_n(ranking, n=TOP_N_DEFAULT):
+    # The first n positions of a ranked table; students tied on the last
+    # position are all kept
+    if ranking.empty:
+        return ranking
+    return ranking[ranking["Rank"] <= n]
+
+
+class ScoreTables:
+    # The Saved Data pivot for each (term, session) filter, None meaning all.
+    # A save drops only the pivots covering the partitions it touched.
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._pivots = {}
+        self._generation = 0  # bumped by every save, so a pivot built across one isn't kept
+
+    def pivot(self, term=None, session=None):
+        with self._lock:
+            cached = self._pivots.get((term, session))
+            generation = self._generation
+        if cached is not None:
+            return cached
+        table = score_pivot(self.store.term_rows(term=term, session=session))
+        with self._lock:
+            if generation == self._generation:
+                self._pivots[(term, session)] = table
+        return table
+
+    def partitions_changed(self, frames):
+        with self._lock:
+            self._generation += 1
+            for _, _, term, session in frames:
+                for key in [key for key in self._pivots
+                            if key[0] in (None, term) and key[1] in (None, session)]:
+                    del self._pivots[key]
+
+
+def score_tables(store):
+    return store.derived("score_tables", ScoreTables)
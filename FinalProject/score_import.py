@@ -0,0 +1,176 @@
+import re
+import numpy as np
+import pandas as pd
+from storage import EXPECTED_COLUMNS, RECORD_KEY, STUDENT_TERM_KEY
+from grading import load_scale
+
+# Sheet columns a teacher can map; Term and Session usually come from the page
+IMPORT_COLUMNS = ["Student_Name", "Class", "Number", "Term", "Session", "Subject",
+                  "CA1_Obt", "CA1_Max", "CA2_Obt", "CA2_Max", "Exam_Obt", "Exam_Max",
+                  "Teacher_Comment", "Principal_Comment"]
+ENTERED_SCORE_COLUMNS = ["CA1_Obt", "CA1_Max", "CA2_Obt", "CA2_Max", "Exam_Obt", "Exam_Max"]
+OBTAINED_COLUMNS = ["CA1_Obt", "CA2_Obt", "Exam_Obt"]
+MAXIMUM_COLUMNS = ["CA1_Max", "CA2_Max", "Exam_Max"]
+COMMENT_COLUMNS = ["Teacher_Comment", "Principal_Comment"]
+# Details saved once per student and term rather than per subject
+ENROLLMENT_COLUMNS = ["Number"] + COMMENT_COLUMNS
+
+# Common spreadsheet headings, compared after dropping case, spaces and punctuation
+COLUMN_ALIASES = {
+    "Student_Name": ["studentname", "name", "student", "fullname", "pupil"],
+    "Class": ["class", "classname", "arm", "form"],
+    "Number": ["number", "numberinclass", "noinclass", "classnumber"],
+    "Term": ["term"],
+    "Session": ["session", "academicsession", "year"],
+    "Subject": ["subject", "course"],
+    "CA1_Obt": ["ca1obt", "ca1", "firstca", "test1", "ca1score"],
+    "CA1_Max": ["ca1max", "ca1obtainable", "ca1total"],
+    "CA2_Obt": ["ca2obt", "ca2", "secondca", "test2", "ca2score"],
+    "CA2_Max": ["ca2max", "ca2obtainable", "ca2total"],
+    "Exam_Obt": ["examobt", "exam", "examination", "examscore"],
+    "Exam_Max": ["exammax", "examobtainable", "examtotal"],
+    "Teacher_Comment": ["teachercomment", "classteacherscomment", "classteachercomment"],
+    "Principal_Comment": ["principalcomment", "principalscomment"],
+}
+
+
+def _normalize_heading(heading):
+    return re.sub(r"[^a-z0-9]", "", str(heading).lower())
+
+
+def guess_mapping(sheet_columns):
+    # {import column: sheet column} for the headings we recognise
+    by_heading = {}
+    for column in sheet_columns:
+        by_heading.setdefault(_normalize_heading(column), column)
+    mapping = {}
+    for target, aliases in COLUMN_ALIASES.items():
+        for alias in [_normalize_heading(target)] + aliases:
+            if alias in by_heading and by_heading[alias] not in mapping.values():
+                mapping[target] = by_heading[alias]
+                break
+    return mapping
+
+
+def read_sheet(uploaded_file):
+    # Every cell is read as text so validation sees exactly what the teacher typed
+    name = getattr(uploaded_file, "name", str(uploaded_file)).lower()
+    if name.endswith((".xlsx", ".xlsm", ".xls")):
+        try:
+            return pd.read_excel(uploaded_file, dtype=str)
+        except ImportError:
+            raise ValueError("Reading Excel files needs openpyxl (pip install openpyxl); "
+                             "save the sheet as CSV or install it.")
+    return pd.read_csv(uploaded_file, dtype=str)
+
+
+def _text(values):
+    return values.astype(object).where(values.notna(), "").astype(str).str.strip()
+
+
+def check_scores(rows):
+    # Score checks shared by sheet imports and the entry form: rows holds the
+    # entered score columns as text. Returns (numeric scores, blank cells,
+    # one boolean column per problem).
+    blank = rows[ENTERED_SCORE_COLUMNS] == ""
+    scores = rows[ENTERED_SCORE_COLUMNS].apply(pd.to_numeric, errors="coerce")
+    errors = pd.DataFrame(index=rows.index)
+    for column in ENTERED_SCORE_COLUMNS:
+        errors[f"{column} is not a number"] = ~blank[column] & scores[column].isna()
+    errors["Negative score"] = (scores < 0).any(axis=1)
+    for obtained, maximum in zip(OBTAINED_COLUMNS, MAXIMUM_COLUMNS):
+        errors[f"{obtained} above {maximum}"] = (scores[obtained] > scores[maximum]).fillna(False)
+    return scores, blank, errors
+
+
+def error_messages(errors):
+    # "; "-joined problem names per row, "" where there are none
+    failed = errors.to_numpy()
+    messages = np.array(errors.columns, dtype=object)
+    return pd.Series(["; ".join(messages[row]) for row in failed], index=errors.index, dtype=object)
+
+
+def grade_entry_sheet(sheet, scale=None):
+    # One student's subject sheet from the entry form, graded in one pass: the
+    # score columns as text, plus Total_Obt/Total_Max/Grade/Remark and an
+    # "Error" column. Subjects without any entry stay blank, as in the form.
+    scale = scale or load_scale()
+    rows = sheet.reset_index(drop=True).copy()
+    rows[ENTERED_SCORE_COLUMNS] = rows[ENTERED_SCORE_COLUMNS].apply(_text)
+    scores, blank, errors = check_scores(rows)
+    has_scores = ~blank.all(axis=1)
+    rows["Total_Obt"] = scores[OBTAINED_COLUMNS].fillna(0).sum(axis=1).astype(object).where(has_scores, "")
+    rows["Total_Max"] = scores[MAXIMUM_COLUMNS].fillna(0).sum(axis=1).astype(object).where(has_scores, "")
+    grades, remarks = scale.grade_arrays(scores[OBTAINED_COLUMNS].fillna(0).sum(axis=1),
+                                         scores[MAXIMUM_COLUMNS].fillna(0).sum(axis=1))
+    rows["Grade"] = pd.Series(grades, index=rows.index).where(has_scores, "")
+    rows["Remark"] = pd.Series(remarks, index=rows.index).where(has_scores, "")
+    rows["Error"] = error_messages(errors)
+    return rows
+
+
+class ImportResult:
+    def __init__(self, accepted, rejected):
+        self.accepted = accepted  # progress records ready to save
+        self.rejected = rejected  # sheet rows with an "Error" column
+
+
+def validate_scores(sheet, mapping, defaults=None, known_subjects=None, scale=None):
+    # One pass over the whole sheet: every check is a column operation, and a row
+    # collects all of its problems before being accepted or rejected.
+    # mapping: {import column: sheet column}; defaults fill unmapped columns
+    # (Term, Session, a whole-class Class, a per-subject Subject, fixed maxima).
+    defaults = defaults or {}
+    scale = scale or load_scale()
+    sheet = sheet.reset_index(drop=True)
+    rows = pd.DataFrame(index=sheet.index)
+    for column in IMPORT_COLUMNS:
+        if mapping.get(column) is not None:
+            rows[column] = _text(sheet[mapping[column]])
+        else:
+            rows[column] = str(defaults.get(column, "") or "").strip()
+    # Mapped maxima left blank in the sheet fall back to the page default too
+    for column in MAXIMUM_COLUMNS:
+        if defaults.get(column) not in (None, ""):
+            rows.loc[rows[column] == "", column] = str(defaults[column])
+
+    errors = pd.DataFrame(index=rows.index)
+    for column in ["Student_Name", "Class", "Term", "Session", "Subject"]:
+        errors[f"Missing {column}"] = rows[column] == ""
+
+    scores, blank, score_errors = check_scores(rows)
+    errors = errors.join(score_errors)
+    errors["No scores"] = blank[OBTAINED_COLUMNS].all(axis=1)
+    if known_subjects:
+        errors["Unknown subject"] = (rows["Subject"] != "") & ~rows["Subject"].isin(list(known_subjects))
+    # The last row for a student and subject wins, as it would on re-entry in the form
+    errors["Duplicate row (a later row replaces it)"] = rows.duplicated(RECORD_KEY, keep="last")
+
+    bad = errors.to_numpy().any(axis=1)
+    rejected = sheet[bad].copy()
+    rejected.insert(0, "Row", rejected.index + 2)  # +1 for the header, +1 for 1-based rows
+    rejected["Error"] = error_messages(errors[bad])
+
+    accepted = rows[~bad].copy()
+    accepted_scores = scores[~bad]
+    accepted[ENTERED_SCORE_COLUMNS] = accepted_scores
+    # Blank parts count as 0 towards the totals, as in the entry form
+    accepted["Total_Obt"] = accepted_scores[OBTAINED_COLUMNS].fillna(0).sum(axis=1)
+    accepted["Total_Max"] = accepted_scores[MAXIMUM_COLUMNS].fillna(0).sum(axis=1)
+    accepted["Grade"], accepted["Remark"] = scale.grade_arrays(accepted["Total_Obt"], accepted["Total_Max"])
+    accepted["School_Name"] = defaults.get("School_Name", "")
+    accepted["School_Address"] = defaults.get("School_Address", "")
+    return ImportResult(accepted.reindex(columns=EXPECTED_COLUMNS).reset_index(drop=True),
+                        rejected.reset_index(drop=True))
+
+
+def keep_saved_comments(records, saved, mapping):
+    # A subject sheet rarely carries comments or class numbers; keep the ones
+    # already saved for the student's term instead of blanking them on upsert
+    unmapped = [column for column in ENROLLMENT_COLUMNS if mapping.get(column) is None]
+    if not unmapped or records.empty or saved.empty:
+        return records
+    saved_comments = saved.astype({column: object for column in STUDENT_TERM_KEY})
+    saved_comments = saved_comments.drop_duplicates(STUDENT_TERM_KEY)[STUDENT_TERM_KEY + unmapped]
+    merged = records.drop(columns=unmapped).merge(saved_comments, on=STUDENT_TERM_KEY, how="left")
+    return merged.reindex(columns=records.columns)
@@ -0,0 +1,1006 @@
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+PROGRESS_FILE = "progress_multi.csv"
+SCHOOL_INFO_FILE = "school_info.csv"
+SQLITE_FILE = "progress.db"
+JOURNAL_FILE = "progress_multi.journal.csv"
+PARQUET_FILE = "progress_multi.parquet"
+# Schools run from one deployment each keep their files in a shard of their own,
+# schools/<school id>/; without a school the working directory is used as before
+SCHOOLS_DIR = os.environ.get("AMS_SCHOOLS_DIR", "schools")
+# School ids end up in directory names and URLs
+SCHOOL_ID_PATTERN = re.compile(r"[a-z0-9][a-z0-9_-]{0,63}")
+# Compact the journal back into the snapshot once it grows past this size
+JOURNAL_MAX_BYTES = int(os.environ.get("AMS_JOURNAL_MAX_BYTES", 4 * 1024 * 1024))
+EXPECTED_COLUMNS = ["Student_Name", "Class", "Number", "Term", "Session", "Subject",
+                    "CA1_Obt", "CA1_Max", "CA2_Obt", "CA2_Max",
+                    "Exam_Obt", "Exam_Max", "Total_Obt", "Total_Max", "Grade", "Remark",
+                    "Teacher_Comment", "Principal_Comment", "School_Name", "School_Address"]
+SCORE_COLUMNS = ["CA1_Obt", "CA1_Max", "CA2_Obt", "CA2_Max",
+                 "Exam_Obt", "Exam_Max", "Total_Obt", "Total_Max"]
+
+# Low-cardinality text is stored as categoricals; comments stay plain strings
+CATEGORY_COLUMNS = ["Student_Name", "Class", "Number", "Term", "Session", "Subject", "Grade", "Remark",
+                    "School_Name", "School_Address"]
+COMMENT_COLUMNS = ["Teacher_Comment", "Principal_Comment"]
+# Read as text so "007" stays "007" rather than becoming 7.0 next to blanks
+CSV_DTYPES = {"Number": str}
+# Bumped whenever the typed snapshot layout changes; see _SNAPSHOT_MIGRATIONS
+SCHEMA_VERSION = 1
+SCHEMA_VERSION_KEY = b"ams_schema_version"
+
+DEFAULT_SCHOOL_NAME = "Your School Name"
+DEFAULT_SCHOOL_ADDRESS = "School Address Here"
+
+# A student is a name within a class, so namesakes in different classes stay
+# apart. A save replaces whole (student, class, term, session) partitions; an
+# upsert only the (student, class, term, session, subject) records it carries.
+STUDENT_KEY = ["Student_Name", "Class"]
+STUDENT_TERM_KEY = STUDENT_KEY + ["Term", "Session"]
+RECORD_KEY = STUDENT_TERM_KEY + ["Subject"]
+
+
+class StaleWriteError(Exception):
+    # Raised instead of saving over partitions someone else changed since the
+    # editor loaded them; `partitions` lists the (student, class, term, session) keys
+    def __init__(self, partitions):
+        self.partitions = list(partitions)
+        super().__init__(f"Changed by someone else since they were loaded: {self.partitions}")
+
+
+class NamesakeError(Exception):
+    # Raised instead of entering a new student over the marks of one already
+    # saved under the same name and class; `partitions` lists those keys
+    def __init__(self, partitions):
+        self.partitions = list(partitions)
+        super().__init__(f"Already saved for a student of the same name and class: {self.partitions}")
+
+
+def partition_key(student_name, class_name, term, session):
+    # The (student, class, term, session) key of a partition; a blank or
+    # missing class is the same class
+    class_name = "" if class_name is None or pd.isna(class_name) else str(class_name).strip()
+    return (student_name, class_name, term, session)
+
+
+def key_frame(df, keys=STUDENT_TERM_KEY):
+    # The key columns as plain values, with missing ones (a blank class) as ""
+    values = df[keys].astype(object)
+    return values.where(values.notna(), "")
+
+
+def school_directory(school=None):
+    if school is None:
+        return ""
+    if not SCHOOL_ID_PATTERN.fullmatch(school):
+        raise ValueError(f"School ids are lowercase letters, digits, '-' and '_': {school!r}")
+    return os.path.join(SCHOOLS_DIR, school)
+
+
+def school_path(school, name):
+    # Where `name` (progress records, school info, logo, grading scale, ...)
+    # lives for `school`; a plain relative name for the unsharded layout
+    directory = school_directory(school)
+    return os.path.join(directory, name) if directory else name
+
+
+def school_ids():
+    # Schools with a shard on disk
+    try:
+        entries = list(os.scandir(SCHOOLS_DIR))
+    except OSError:
+        return []
+    return sorted(entry.name for entry in entries if entry.is_dir() and SCHOOL_ID_PATTERN.fullmatch(entry.name))
+
+
+def create_school(school):
+    os.makedirs(school_directory(school), exist_ok=True)
+
+
+def file_signature(path):
+    # (mtime, size) is enough to notice a rewrite between reruns without reading the file
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _key_index(df, keys):
+    return pd.MultiIndex.from_frame(key_frame(df, keys))
+
+
+def merge_records(existing, records, replace_partitions=True, cleared=()):
+    # Rows of `records` win over matching rows of `existing`; partitions in
+    # `cleared` lose all their rows
+    if existing.empty:
+        return records.reset_index(drop=True)
+    keys = STUDENT_TERM_KEY if replace_partitions else RECORD_KEY
+    replaced = _key_index(existing, keys).isin(_key_index(records, keys))
+    if cleared:
+        replaced |= _key_index(existing, STUDENT_TERM_KEY).isin([partition_key(*key) for key in cleared])
+    return pd.concat([existing[~replaced], records], ignore_index=True)
+
+
+def filter_records(df, term=None, session=None, class_name=None, columns=None):
+    if term is not None:
+        df = df[df["Term"] == term]
+    if session is not None:
+        df = df[df["Session"] == session]
+    if class_name is not None:
+        df = df[df["Class"] == class_name]
+    if columns is not None:
+        df = df[list(columns)]
+    return df
+
+
+def read_columns(columns):
+    # Columns to read for a projected load: keys are always needed to replay
+    # the journal and apply filters
+    if columns is None:
+        return None
+    return list(dict.fromkeys(RECORD_KEY + ["Class"] + list(columns)))
+
+
+def typed_frame(df):
+    # Float scores with real nulls and categorical text, whatever the source wrote
+    typed = {}
+    for col in df.columns:
+        if col in SCORE_COLUMNS and df[col].dtype != "float64":
+            typed[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+        elif col in CATEGORY_COLUMNS and not isinstance(df[col].dtype, pd.CategoricalDtype) \
+                or col in COMMENT_COLUMNS and df[col].dtype != "str":
+            # Blanks are cleaned once per distinct value rather than once per row
+            text = df[col].astype("category")
+            text = text.cat.remove_categories([v for v in text.cat.categories if not str(v).strip()])
+            typed[col] = text if col in CATEGORY_COLUMNS else text.astype(object).astype("str")
+    return df.assign(**typed) if typed else df
+
+
+def concat_records(frames):
+    # pd.concat turns categoricals back into objects unless every frame has the
+    # same categories, so typed frames are put on shared categories first
+    frames = [frame for frame in frames if len(frame.columns)]
+    typed = [col for col in CATEGORY_COLUMNS
+             if any(isinstance(frame[col].dtype, pd.CategoricalDtype) for frame in frames if col in frame)]
+    if typed:
+        frames = [typed_frame(frame) for frame in frames]
+        aligned = {}
+        for col in typed:
+            # An all-blank column has no categories of the other frames' dtype, so
+            # categories are combined as plain values
+            present = [frame[col].cat.categories for frame in frames if col in frame]
+            categories = present[0].append(present[1:]).unique()
+            aligned[col] = [frame[col].cat.set_categories(categories) if col in frame else None
+                            for frame in frames]
+        frames = [frame.assign(**{col: aligned[col][i] for col in typed if col in frame})
+                  for i, frame in enumerate(frames)]
+    return pd.concat(frames, ignore_index=True)
+
+
+def partition_version(rows):
+    # Fingerprint of one (student, class, term, session) partition's saved content,
+    # the same whichever backend or dtypes the rows came from; None when empty
+    if rows is None or rows.empty:
+        return None
+    rows = rows.reset_index(drop=True)
+    canonical = pd.DataFrame(index=rows.index)
+    for col in EXPECTED_COLUMNS:
+        if col not in rows.columns:
+            canonical[col] = ""
+        elif col in SCORE_COLUMNS:
+            scores = pd.to_numeric(rows[col].astype(object).replace("", None), errors="coerce")
+            canonical[col] = scores.map(lambda value: "" if pd.isna(value) else repr(float(value)))
+        else:
+            canonical[col] = rows[col].astype(object).where(rows[col].notna(), "").astype(str).str.strip()
+    canonical = canonical.sort_values("Subject", kind="stable")
+    return hashlib.sha1(canonical.to_csv(index=False).encode("utf-8")).hexdigest()
+
+
+def stale_partitions(df, expected_versions):
+    # Keys of `expected_versions` whose rows in df no longer match the version
+    # the editor started from
+    if not expected_versions:
+        return []
+    stale = []
+    keys = _key_index(df, STUDENT_TERM_KEY)
+    for key, version in expected_versions.items():
+        if partition_version(df[keys.isin([partition_key(*key)])]) != version:
+            stale.append(tuple(key))
+    return stale
+
+
+@contextmanager
+def file_lock(path, timeout=60):
+    # Exclusive lock shared by every process writing the same files, held on a
+    # sidecar `.lock` file for the whole read-check-write
+    deadline = time.monotonic() + timeout
+    with open(f"{path}.lock", "a+b") as f:
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Timed out waiting for the lock on {path}")
+                time.sleep(0.005)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def atomic_to_csv(df, path):
+    # Readers never see a half-written file: write alongside, then rename over
+    tmp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+# ---------- CSV Backend ----------
+class CsvBackend:
+    # The original flat-file layout; every save rewrites progress_multi.csv,
+    # which is fine for small installs. Writers in every process take the same
+    # file lock and replace files by rename, so readers never see half a file.
+    kind = "csv"
+    needs_current = True
+    school = None  # set by get_backend for a school's shard
+
+    def __init__(self, progress_path=PROGRESS_FILE, school_info_path=SCHOOL_INFO_FILE):
+        self.progress_path = progress_path
+        self.school_info_path = school_info_path
+        self.lock_path = progress_path
+
+    def cache_key(self):
+        return (self.kind, os.path.abspath(self.progress_path))
+
+    def signature(self):
+        return file_signature(self.progress_path)
+
+    def changed_partitions(self, since):
+        # Not tracked for flat files; callers fall back to a full reload
+        return None
+
+    def _read_snapshot(self, columns=None):
+        wanted = read_columns(columns)
+        if not os.path.exists(self.progress_path):
+            return pd.DataFrame(columns=wanted or EXPECTED_COLUMNS)
+        df = pd.read_csv(self.progress_path, usecols=None if wanted is None else lambda col: col in wanted,
+                         dtype=CSV_DTYPES)
+        for col in wanted or EXPECTED_COLUMNS:
+            if col not in df.columns:
+                df[col] = ""
+        return df
+
+    def load(self, term=None, session=None, class_name=None, columns=None):
+        return filter_records(self._read_snapshot(columns), term, session, class_name, columns)
+
+    def save_records(self, records, replace_partitions=True, current=None, expected_signature=None,
+                     expected_versions=None, cleared=()):
+        # `current` lets the caller pass its in-memory copy instead of re-parsing
+        # the file. If another process wrote since, its records are re-read and
+        # kept; only partitions in `expected_versions` that it changed conflict.
+        # Partitions in `cleared` are emptied in the same write.
+        with file_lock(self.lock_path):
+            in_sync = expected_signature is None or self.signature() == expected_signature
+            if current is None or not in_sync:
+                current = self.load()
+            stale = stale_partitions(current, expected_versions)
+            if stale:
+                raise StaleWriteError(stale)
+            atomic_to_csv(merge_records(current, records, replace_partitions, cleared), self.progress_path)
+            return self.signature() if in_sync else None
+
+    def write_all(self, df):
+        with file_lock(self.lock_path):
+            atomic_to_csv(df, self.progress_path)
+
+    def load_school_info(self):
+        name, address = DEFAULT_SCHOOL_NAME, DEFAULT_SCHOOL_ADDRESS
+        if os.path.exists(self.school_info_path):
+            df_school_info = pd.read_csv(self.school_info_path)
+            if not df_school_info.empty:
+                name = df_school_info.iloc[0].get("School_Name", DEFAULT_SCHOOL_NAME)
+                address = df_school_info.iloc[0].get("School_Address", DEFAULT_SCHOOL_ADDRESS)
+        return name, address
+
+    def school_info_signature(self):
+        return file_signature(self.school_info_path)
+
+    def save_school_info(self, school_name, school_address):
+        with file_lock(self.school_info_path):
+            atomic_to_csv(pd.DataFrame({
+                "School_Name": [school_name],
+                "School_Address": [school_address]
+            }), self.school_info_path)
+
+
+# ---------- Journaled CSV Backend ----------
+JOURNAL_COLUMNS = ["_Op"] + EXPECTED_COLUMNS
+
+
+def replay_journal(snapshot, journal):
+    # "clear" rows empty a (student, class, term, session) partition, "upsert"
+    # rows set one subject record; later entries win.
+    if journal.empty:
+        return snapshot
+    journal = journal.reset_index(drop=True)
+    is_clear = (journal["_Op"] == "clear").to_numpy()
+    position = np.arange(len(journal))
+    keys = key_frame(journal)
+    last_clear = pd.Series(np.where(is_clear, position, -1)).groupby(
+        [keys[col] for col in STUDENT_TERM_KEY], sort=False).transform("max").to_numpy()
+    upserts = journal[~is_clear & (position > last_clear)].drop_duplicates(RECORD_KEY, keep="last")
+
+    cleared = _key_index(journal[is_clear], STUDENT_TERM_KEY)
+    replaced = _key_index(snapshot, STUDENT_TERM_KEY).isin(cleared) | \
+        _key_index(snapshot, RECORD_KEY).isin(_key_index(upserts, RECORD_KEY))
+    return concat_records([snapshot[~replaced], upserts.drop(columns="_Op")])
+
+
+class JournaledCsvBackend(CsvBackend):
+    # Flat files without whole-file rewrites: a save appends only its records
+    # to a journal, loads replay the journal over the last compacted snapshot,
+    # and compaction folds the journal back into progress_multi.csv.
+    kind = "journal"
+    needs_current = False
+
+    def __init__(self, progress_path=PROGRESS_FILE, school_info_path=SCHOOL_INFO_FILE,
+                 journal_path=JOURNAL_FILE, max_journal_bytes=JOURNAL_MAX_BYTES):
+        super().__init__(progress_path, school_info_path)
+        self.journal_path = journal_path
+        self.max_journal_bytes = max_journal_bytes
+        self._write_lock = threading.Lock()
+        self._compacting = threading.Event()
+
+    def signature(self):
+        return (file_signature(self.progress_path), file_signature(self.journal_path))
+
+    def journal_size(self):
+        signature = file_signature(self.journal_path)
+        return signature[1] if signature else 0
+
+    def _load_journal(self):
+        if self.journal_size() == 0:
+            return pd.DataFrame(columns=JOURNAL_COLUMNS)
+        return pd.read_csv(self.journal_path, dtype=CSV_DTYPES)
+
+    @contextmanager
+    def _locked(self):
+        # Threads of this process queue on the in-process lock first, then
+        # take the file lock other processes use
+        with self._write_lock, file_lock(self.lock_path):
+            yield
+
+    def load(self, term=None, session=None, class_name=None, columns=None):
+        # Under the lock so an append or compaction is never read half-done
+        with self._locked():
+            df = replay_journal(self._read_snapshot(columns), self._load_journal())
+        return filter_records(df, term, session, class_name, columns)
+
+    def _snapshot_exists(self):
+        return os.path.exists(self.progress_path)
+
+    def _write_snapshot(self, df):
+        atomic_to_csv(df, self.progress_path)
+
+    def save_records(self, records, replace_partitions=True, current=None, expected_signature=None,
+                     expected_versions=None, cleared=()):
+        entries = records.reindex(columns=JOURNAL_COLUMNS)
+        entries["_Op"] = "upsert"
+        clears = [pd.DataFrame([partition_key(*key) for key in cleared], columns=STUDENT_TERM_KEY)]
+        if replace_partitions:
+            clears.append(key_frame(records).drop_duplicates())
+        clears = pd.concat(clears, ignore_index=True).reindex(columns=JOURNAL_COLUMNS)
+        if len(clears):
+            clears["_Op"] = "clear"
+            entries = pd.concat([clears, entries], ignore_index=True)
+        with self._locked():
+            in_sync = expected_signature is None or self.signature() == expected_signature
+            if expected_versions and not in_sync:
+                # Someone else wrote since the caller's copy; check against the files
+                current = replay_journal(self._read_snapshot(), self._load_journal())
+                stale = stale_partitions(current, expected_versions)
+                if stale:
+                    raise StaleWriteError(stale)
+            entries.to_csv(self.journal_path, mode="a", header=self.journal_size() == 0, index=False)
+            signature = self.signature()
+        self.compact_in_background()
+        return signature if in_sync else None
+
+    def write_all(self, df):
+        with self._locked():
+            self._write_snapshot(df)
+            open(self.journal_path, "w").close()
+
+    def compact(self):
+        # Appends wait on the lock, so nothing lands in the journal between
+        # replaying it and truncating it
+        with self._locked():
+            if self.journal_size() == 0 and self._snapshot_exists():
+                return False
+            self._write_snapshot(replay_journal(self._read_snapshot(), self._load_journal()))
+            open(self.journal_path, "w").close()
+            return True
+
+    def compact_in_background(self, force=False):
+        if not force and self.journal_size() <= self.max_journal_bytes and self._snapshot_exists():
+            return
+        if self._compacting.is_set():
+            return
+        self._compacting.set()
+
+        def run():
+            try:
+                self.compact()
+            finally:
+                self._compacting.clear()
+
+        threading.Thread(target=run, name="journal-compaction", daemon=True).start()
+
+
+# ---------- Parquet Snapshot Backend ----------
+# Upgrades for snapshots written by older schema versions, keyed by the
+# version they upgrade from. Version 0 is any untyped Parquet file.
+_SNAPSHOT_MIGRATIONS = {
+    0: typed_frame,
+}
+
+
+def upgrade_snapshot(df, version):
+    while version < SCHEMA_VERSION:
+        df = _SNAPSHOT_MIGRATIONS[version](df)
+        version += 1
+    return df
+
+
+class ParquetBackend(JournaledCsvBackend):
+    # Journaled saves on top of a typed columnar snapshot: loads skip CSV parsing
+    # and read only the requested columns, scores are float64 with real nulls and
+    # text columns are categorical. On first use the snapshot is built from
+    # progress_multi.csv (and its journal).
+    kind = "parquet"
+
+    def __init__(self, parquet_path=PARQUET_FILE, school_info_path=SCHOOL_INFO_FILE,
+                 journal_path=JOURNAL_FILE, csv_path=PROGRESS_FILE, max_journal_bytes=JOURNAL_MAX_BYTES):
+        super().__init__(csv_path, school_info_path, journal_path, max_journal_bytes)
+        self.parquet_path = parquet_path
+
+    def cache_key(self):
+        return (self.kind, os.path.abspath(self.parquet_path))
+
+    def signature(self):
+        return (file_signature(self.parquet_path), file_signature(self.journal_path))
+
+    def _snapshot_exists(self):
+        return os.path.exists(self.parquet_path)
+
+    def schema_version(self):
+        metadata = pq.read_schema(self.parquet_path).metadata or {}
+        return int(metadata.get(SCHEMA_VERSION_KEY, 0))
+
+    def _read_snapshot(self, columns=None):
+        if not self._snapshot_exists():
+            return typed_frame(super()._read_snapshot(columns))
+        wanted = read_columns(columns)
+        available = pq.read_schema(self.parquet_path).names
+        df = pd.read_parquet(self.parquet_path,
+                             columns=[col for col in wanted if col in available] if wanted else None)
+        df = upgrade_snapshot(df, self.schema_version())
+        missing = [col for col in wanted or EXPECTED_COLUMNS if col not in df.columns]
+        return typed_frame(df.assign(**{col: None for col in missing})) if missing else df
+
+    def _write_snapshot(self, df):
+        table = pa.Table.from_pandas(typed_frame(df.reset_index(drop=True)), preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                               SCHEMA_VERSION_KEY: str(SCHEMA_VERSION).encode()})
+        tmp_path = f"{self.parquet_path}.tmp{os.getpid()}.{threading.get_ident()}"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, self.parquet_path)
+
+
+# ---------- SQLite Backend ----------
+# Normalized: a student (a name within a class, so namesakes in different
+# classes stay apart), and the number, comments and school of each term they
+# are enrolled for, are stored once and joined back onto the subject scores.
+# progress_records is the flat EXPECTED_COLUMNS layout the rest of the app reads.
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS schools (
+    id INTEGER PRIMARY KEY,
+    School_Name TEXT NOT NULL DEFAULT '',
+    School_Address TEXT NOT NULL DEFAULT '',
+    UNIQUE (School_Name, School_Address)
+);
+CREATE TABLE IF NOT EXISTS students (
+    id INTEGER PRIMARY KEY,
+    Student_Name TEXT NOT NULL,
+    Class TEXT NOT NULL DEFAULT '',
+    UNIQUE (Student_Name, Class)
+);
+CREATE TABLE IF NOT EXISTS enrollments (
+    id INTEGER PRIMARY KEY,
+    student_id INTEGER NOT NULL REFERENCES students (id),
+    Term TEXT NOT NULL,
+    Session TEXT NOT NULL,
+    Number TEXT,
+    Teacher_Comment TEXT,
+    Principal_Comment TEXT,
+    school_id INTEGER REFERENCES schools (id),
+    UNIQUE (student_id, Term, Session)
+);
+CREATE INDEX IF NOT EXISTS idx_enrollments_term ON enrollments (Term, Session);
+CREATE INDEX IF NOT EXISTS idx_students_class ON students (Class);
+CREATE TABLE IF NOT EXISTS scores (
+    enrollment_id INTEGER NOT NULL REFERENCES enrollments (id),
+    Subject TEXT NOT NULL,
+    CA1_Obt REAL, CA1_Max REAL,
+    CA2_Obt REAL, CA2_Max REAL,
+    Exam_Obt REAL, Exam_Max REAL,
+    Total_Obt REAL, Total_Max REAL,
+    Grade TEXT, Remark TEXT,
+    PRIMARY KEY (enrollment_id, Subject)
+);
+CREATE INDEX IF NOT EXISTS idx_scores_subject ON scores (Subject);
+CREATE VIEW IF NOT EXISTS progress_records AS
+SELECT students.Student_Name, NULLIF(students.Class, '') AS Class, enrollments.Number, enrollments.Term, enrollments.Session,
+       scores.Subject, scores.CA1_Obt, scores.CA1_Max, scores.CA2_Obt, scores.CA2_Max,
+       scores.Exam_Obt, scores.Exam_Max, scores.Total_Obt, scores.Total_Max, scores.Grade, scores.Remark,
+       enrollments.Teacher_Comment, enrollments.Principal_Comment, schools.School_Name, schools.School_Address,
+       scores.rowid AS record_id
+FROM scores
+JOIN enrollments ON enrollments.id = scores.enrollment_id
+JOIN students ON students.id = enrollments.student_id
+LEFT JOIN schools ON schools.id = enrollments.school_id;
+CREATE TABLE IF NOT EXISTS partition_revisions (
+    Student_Name TEXT NOT NULL,
+    Class TEXT NOT NULL DEFAULT '',
+    Term TEXT NOT NULL,
+    Session TEXT NOT NULL,
+    Revision INTEGER NOT NULL,
+    PRIMARY KEY (Student_Name, Class, Term, Session)
+);
+CREATE INDEX IF NOT EXISTS idx_partition_revisions ON partition_revisions (Revision);
+CREATE TABLE IF NOT EXISTS school_info (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    School_Name TEXT,
+    School_Address TEXT
+);
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO store_meta (key, value) VALUES ('revision', 0);
+INSERT OR IGNORE INTO store_meta (key, value) VALUES ('school_info_revision', 0);
+"""
+# Databases from before the current layout, converted when they are opened:
+# one wide `progress` row per subject, or students keyed on their name alone
+# with the class kept per enrollment, which merged namesakes into one student
+_LEGACY_LAYOUTS = {
+    "wide": ("", "SELECT * FROM progress ORDER BY rowid", ["progress"]),
+    "name_keyed": (
+        """
+        DROP VIEW progress_records;
+        DROP INDEX idx_enrollments_term_class;
+        DROP INDEX idx_scores_subject;
+        ALTER TABLE scores RENAME TO legacy_scores;
+        ALTER TABLE enrollments RENAME TO legacy_enrollments;
+        ALTER TABLE students RENAME TO legacy_students;
+        """,
+        """
+        SELECT students.Student_Name, enrollments.Class, enrollments.Number, enrollments.Term, enrollments.Session,
+               scores.Subject, scores.CA1_Obt, scores.CA1_Max, scores.CA2_Obt, scores.CA2_Max,
+               scores.Exam_Obt, scores.Exam_Max, scores.Total_Obt, scores.Total_Max, scores.Grade, scores.Remark,
+               enrollments.Teacher_Comment, enrollments.Principal_Comment, schools.School_Name, schools.School_Address
+        FROM legacy_scores AS scores
+        JOIN legacy_enrollments AS enrollments ON enrollments.id = scores.enrollment_id
+        JOIN legacy_students AS students ON students.id = enrollments.student_id
+        LEFT JOIN schools ON schools.id = enrollments.school_id
+        ORDER BY scores.rowid
+        """,
+        ["legacy_scores", "legacy_enrollments", "legacy_students"]
+    ),
+}
+
+
+def _sql_statements(script):
+    # The schema has no `;` inside a statement, so it can be run one statement
+    # at a time: executescript() would commit the open transaction first
+    return [statement for statement in (part.strip() for part in script.split(";")) if statement]
+
+
+_COLUMN_LIST = ", ".join(EXPECTED_COLUMNS)
+ENROLLMENT_COLUMNS = ["Number", "Teacher_Comment", "Principal_Comment"]
+SUBJECT_SCORE_COLUMNS = SCORE_COLUMNS + ["Grade", "Remark"]
+_ENROLLMENT_ID_SQL = ("(SELECT enrollments.id FROM enrollments JOIN students ON students.id = enrollments.student_id "
+                      "WHERE students.Student_Name = ? AND students.Class = ? "
+                      "AND enrollments.Term = ? AND enrollments.Session = ?)")
+_UPSERT_ENROLLMENT_SQL = (
+    f"INSERT INTO enrollments (student_id, Term, Session, {', '.join(ENROLLMENT_COLUMNS)}, school_id) "
+    "VALUES ((SELECT id FROM students WHERE Student_Name = ? AND Class = ?), ?, ?, "
+    f"{', '.join('?' * len(ENROLLMENT_COLUMNS))}, "
+    "(SELECT id FROM schools WHERE School_Name = ? AND School_Address = ?)) "
+    "ON CONFLICT (student_id, Term, Session) DO UPDATE SET "
+    + ", ".join(f"{col} = excluded.{col}" for col in ENROLLMENT_COLUMNS + ["school_id"])
+)
+_UPSERT_REVISION_SQL = (
+    "INSERT INTO partition_revisions (Student_Name, Class, Term, Session, Revision) VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT (Student_Name, Class, Term, Session) DO UPDATE SET Revision = excluded.Revision"
+)
+_UPSERT_SCORE_SQL = (
+    f"INSERT INTO scores (enrollment_id, Subject, {', '.join(SUBJECT_SCORE_COLUMNS)}) "
+    f"VALUES ({_ENROLLMENT_ID_SQL}, ?, {', '.join('?' * len(SUBJECT_SCORE_COLUMNS))}) "
+    "ON CONFLICT (enrollment_id, Subject) DO UPDATE SET "
+    + ", ".join(f"{col} = excluded.{col}" for col in SUBJECT_SCORE_COLUMNS)
+)
+
+
+def _sql_values(df, columns):
+    values = df[columns].astype(object)
+    values = values.where(values.notna(), None)
+    return list(values.itertuples(index=False, name=None))
+
+
+# Without stats SQLite would rather scan the whole term by
+# idx_enrollments_term; the unary + keeps lookups of one student's term on the
+# (name, class) index
+_BY_STUDENT_TERM = "Student_Name = ? AND IFNULL(Class, '') = ? AND +Term = ? AND +Session = ?"
+
+
+def _placeholders(values):
+    return ", ".join("?" * len(values))
+
+
+def _clear_partitions(conn, keys):
+    # Empties (student, class, term, session) partitions, e.g. the old class of
+    # a student whose class was corrected, and drops students left without any
+    for key in keys:
+        conn.execute(f"DELETE FROM scores WHERE enrollment_id = {_ENROLLMENT_ID_SQL}", key)
+        conn.execute(f"DELETE FROM enrollments WHERE id = {_ENROLLMENT_ID_SQL}", key)
+        conn.execute("DELETE FROM students WHERE Student_Name = ? AND Class = ? "
+                     "AND NOT EXISTS (SELECT 1 FROM enrollments WHERE student_id = students.id)", key[:2])
+
+
+def _write_normalized(conn, df, replace_partitions=True):
+    # Splits flat records into their students, schools, enrollments and scores;
+    # the last record of a (student, class, term, session) sets its enrollment details
+    df = df.reindex(columns=EXPECTED_COLUMNS).astype(object)
+    df[SCORE_COLUMNS] = df[SCORE_COLUMNS].replace("", None)
+    df["Class"] = df["Class"].fillna("")
+    schools = df[["School_Name", "School_Address"]].fillna("")
+    conn.executemany("INSERT OR IGNORE INTO students (Student_Name, Class) VALUES (?, ?)",
+                     _sql_values(df[STUDENT_KEY].drop_duplicates(), STUDENT_KEY))
+    conn.executemany("INSERT OR IGNORE INTO schools (School_Name, School_Address) VALUES (?, ?)",
+                     _sql_values(schools.drop_duplicates(), ["School_Name", "School_Address"]))
+    enrollments = df.assign(**schools).drop_duplicates(STUDENT_TERM_KEY, keep="last")
+    conn.executemany(_UPSERT_ENROLLMENT_SQL, _sql_values(
+        enrollments, STUDENT_TERM_KEY + ENROLLMENT_COLUMNS + ["School_Name", "School_Address"]))
+    if replace_partitions:
+        for key, subjects in df.groupby(STUDENT_TERM_KEY, sort=False)["Subject"].agg(list).items():
+            conn.execute(
+                f"DELETE FROM scores WHERE enrollment_id = {_ENROLLMENT_ID_SQL} "
+                f"AND Subject NOT IN ({_placeholders(subjects)})",
+                (*key, *subjects)
+            )
+    conn.executemany(_UPSERT_SCORE_SQL, _sql_values(df, RECORD_KEY + SUBJECT_SCORE_COLUMNS))
+
+
+class SqliteBackend:
+    # Indexed store for larger schools: a save is one transaction that upserts
+    # the changed subject rows, and every write bumps a revision so other
+    # processes can pick up just the partitions that changed.
+    kind = "sqlite"
+    needs_current = False
+    school = None
+
+    def __init__(self, db_path=SQLITE_FILE):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._create_schema()
+
+    def _connect(self):
+        # sqlite3 connections are not shared between Streamlit's script threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _columns(conn, table):
+        return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+    def _legacy_layout(self, conn):
+        names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+        if "progress" in names:
+            return "wide"
+        if "students" in names and "Class" not in self._columns(conn, "students"):
+            return "name_keyed"
+        return None
+
+    def _create_schema(self):
+        # Creates the tables, moving the records of an older layout into them
+        # in the same transaction
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            layout = self._legacy_layout(conn)
+            prepare, query, tables = _LEGACY_LAYOUTS[layout] if layout else ("", None, [])
+            # Revisions kept per (student, term, session) are rebuilt per class
+            rebuild_revisions = "Student_Name" in self._columns(conn, "partition_revisions") \
+                and "Class" not in self._columns(conn, "partition_revisions")
+            if rebuild_revisions:
+                prepare += "DROP TABLE partition_revisions;"
+            for statement in _sql_statements(prepare + _SQLITE_SCHEMA):
+                conn.execute(statement)
+            if query is not None:
+                _write_normalized(conn, pd.read_sql_query(query, conn))
+                for table in tables:
+                    conn.execute(f"DROP TABLE {table}")
+            if rebuild_revisions:
+                conn.execute(
+                    "INSERT INTO partition_revisions (Student_Name, Class, Term, Session, Revision) "
+                    "SELECT DISTINCT Student_Name, IFNULL(Class, ''), Term, Session, ? FROM progress_records",
+                    (self._meta("revision"),)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def cache_key(self):
+        return (self.kind, os.path.abspath(self.db_path))
+
+    def _meta(self, key):
+        return self._connect().execute("SELECT value FROM store_meta WHERE key = ?", (key,)).fetchone()[0]
+
+    def signature(self):
+        return self._meta("revision")
+
+    def changed_partitions(self, since):
+        if since is None:
+            return None
+        rows = self._connect().execute(
+            "SELECT Student_Name, Class, Term, Session FROM partition_revisions WHERE Revision > ?", (since,)
+        ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def _query(self, where="", params=(), columns=None):
+        column_list = ", ".join(col for col in columns if col in EXPECTED_COLUMNS) if columns else _COLUMN_LIST
+        df = pd.read_sql_query(f"SELECT {column_list} FROM progress_records {where} ORDER BY record_id",
+                               self._connect(), params=params)
+        return typed_frame(df)
+
+    def load(self, term=None, session=None, class_name=None, columns=None):
+        clauses, params = [], []
+        for col, value in (("Term", term), ("Session", session), ("Class", class_name)):
+            if value is not None:
+                clauses.append(f"{col} = ?")
+                params.append(value)
+        return self._query(f"WHERE {' AND '.join(clauses)}" if clauses else "", params, columns)
+
+    def load_partitions(self, keys):
+        # One indexed student and enrollment lookup per (student, class, term, session)
+        frames = {}
+        for key in keys:
+            frames[tuple(key)] = self._query(f"WHERE {_BY_STUDENT_TERM}", partition_key(*key))
+        return frames
+
+    def _begin_write(self, conn, expected_signature):
+        conn.execute("BEGIN IMMEDIATE")
+        revision = self._meta("revision")
+        in_sync = expected_signature is None or revision == expected_signature
+        conn.execute("UPDATE store_meta SET value = ? WHERE key = 'revision'", (revision + 1,))
+        return revision + 1, in_sync
+
+    def save_records(self, records, replace_partitions=True, current=None, expected_signature=None,
+                     expected_versions=None, cleared=()):
+        conn = self._connect()
+        revision, in_sync = self._begin_write(conn, expected_signature)
+        try:
+            if expected_versions and not in_sync:
+                # The write lock is held, so nothing changes between this check and the upsert
+                stale = [key for key, rows in self.load_partitions(expected_versions).items()
+                         if partition_version(rows) != expected_versions[key]]
+                if stale:
+                    raise StaleWriteError(stale)
+            cleared = [partition_key(*key) for key in cleared]
+            _clear_partitions(conn, cleared)
+            _write_normalized(conn, records, replace_partitions)
+            changed = set(cleared) | set(key_frame(records).drop_duplicates().itertuples(index=False, name=None))
+            conn.executemany(_UPSERT_REVISION_SQL, [(*key, revision) for key in changed])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return revision if in_sync else None
+
+    def write_all(self, df):
+        conn = self._connect()
+        revision, _ = self._begin_write(conn, None)
+        try:
+            conn.execute("DELETE FROM scores")
+            conn.execute("DELETE FROM enrollments")
+            conn.execute("DELETE FROM students")
+            conn.execute("DELETE FROM schools")
+            conn.execute("DELETE FROM partition_revisions")
+            _write_normalized(conn, df)
+            conn.execute(
+                "INSERT INTO partition_revisions (Student_Name, Class, Term, Session, Revision) "
+                "SELECT DISTINCT Student_Name, IFNULL(Class, ''), Term, Session, ? FROM progress_records", (revision,)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def load_school_info(self):
+        row = self._connect().execute("SELECT School_Name, School_Address FROM school_info WHERE id = 1").fetchone()
+        if row is None:
+            return DEFAULT_SCHOOL_NAME, DEFAULT_SCHOOL_ADDRESS
+        return row[0], row[1]
+
+    def school_info_signature(self):
+        return self._meta("school_info_revision")
+
+    def save_school_info(self, school_name, school_address):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO school_info (id, School_Name, School_Address) VALUES (1, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET School_Name = excluded.School_Name, "
+                "School_Address = excluded.School_Address",
+                (school_name, school_address)
+            )
+            conn.execute("UPDATE store_meta SET value = value + 1 WHERE key = 'school_info_revision'")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+# ---------- Backend Selection ----------
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(kind=None, school=None):
+    # The normalized SQLite store by default, seeded from the CSV files on first
+    # use (see `migrate` below); AMS_STORAGE=csv keeps the flat CSV files,
+    # AMS_STORAGE=journal adds append-only saves on top of them and
+    # AMS_STORAGE=parquet the same journal over a typed Parquet snapshot.
+    # With a `school` every file is the one in that school's shard, so its
+    # loads, caches and indexes never see another school's records.
+    kind = kind or os.environ.get("AMS_STORAGE", "sqlite")
+    key = (kind, school)
+    with _backends_lock:
+        if key not in _backends:
+            path = lambda name: school_path(school, name)
+            if school is not None:
+                create_school(school)
+            if kind == "csv":
+                backend = CsvBackend(path(PROGRESS_FILE), path(SCHOOL_INFO_FILE))
+            elif kind == "journal":
+                backend = JournaledCsvBackend(path(PROGRESS_FILE), path(SCHOOL_INFO_FILE), path(JOURNAL_FILE))
+                # Fold any journal left over from the last run past the threshold
+                backend.compact_in_background()
+            elif kind == "parquet":
+                backend = ParquetBackend(path(PARQUET_FILE), path(SCHOOL_INFO_FILE), path(JOURNAL_FILE),
+                                         path(PROGRESS_FILE))
+                # Builds the snapshot from progress_multi.csv on first use
+                backend.compact_in_background()
+            elif kind == "sqlite":
+                db_path = path(SQLITE_FILE) if school is not None else os.environ.get("AMS_SQLITE_PATH", SQLITE_FILE)
+                if not os.path.exists(db_path) and os.path.exists(path(PROGRESS_FILE)):
+                    # First start of an install that kept its records in CSV
+                    with file_lock(db_path):
+                        try:
+                            migrate_csv_to_sqlite(path(PROGRESS_FILE), path(SCHOOL_INFO_FILE), db_path,
+                                                  journal_path=path(JOURNAL_FILE))
+                        except RuntimeError:
+                            pass  # another process copied them meanwhile
+                backend = SqliteBackend(db_path)
+            else:
+                raise ValueError(f"Unknown storage backend: {kind}")
+            backend.school = school
+            _backends[key] = backend
+        return _backends[key]
+
+
+def migrate_csv_to_sqlite(csv_path=PROGRESS_FILE, school_info_path=SCHOOL_INFO_FILE,
+                          db_path=SQLITE_FILE, force=False, journal_path=JOURNAL_FILE):
+    # Reads through the journal too, so unflushed saves are carried over
+    source = JournaledCsvBackend(csv_path, school_info_path, journal_path)
+    target = SqliteBackend(db_path)
+    if not force and not target.load().empty:
+        raise RuntimeError(f"{db_path} already contains progress records; use --force to overwrite")
+    df = source.load()
+    target.write_all(df)
+    if os.path.exists(school_info_path):
+        target.save_school_info(*source.load_school_info())
+    return len(df)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Academic Management System storage tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate = commands.add_parser("migrate", help="Copy progress_multi.csv and school_info.csv into SQLite")
+    migrate.add_argument("--csv", default=PROGRESS_FILE)
+    migrate.add_argument("--school-info", default=SCHOOL_INFO_FILE)
+    migrate.add_argument("--db", default=SQLITE_FILE)
+    migrate.add_argument("--journal", default=JOURNAL_FILE, help="Journal of saves not yet compacted into --csv")
+    migrate.add_argument("--force", action="store_true", help="Replace records already in the database")
+    compact = commands.add_parser("compact", help="Fold the CSV journal back into progress_multi.csv")
+    compact.add_argument("--csv", default=PROGRESS_FILE)
+    compact.add_argument("--journal", default=JOURNAL_FILE)
+    compact.add_argument("--parquet", nargs="?", const=PARQUET_FILE, default=None,
+                         help="Compact into a typed Parquet snapshot instead of the CSV")
+    for command in (migrate, compact):
+        command.add_argument("--school", help=f"Use the files of this school's shard under {SCHOOLS_DIR}/")
+    add_school = commands.add_parser("create-school", help=f"Create a school's shard under {SCHOOLS_DIR}/")
+    add_school.add_argument("school")
+    add_school.add_argument("--copy-current", action="store_true",
+                            help="Start it with the records, school info, logo and grading scale "
+                                 "in the working directory")
+    args = parser.parse_args()
+
+    if getattr(args, "school", None) and args.command != "create-school":
+        # Relative file names are taken inside the shard
+        for name in ("csv", "school_info", "db", "journal", "parquet"):
+            if getattr(args, name, None):
+                setattr(args, name, school_path(args.school, getattr(args, name)))
+
+    if args.command == "create-school":
+        import shutil
+        from grading import GRADING_FILE
+        from report_card import LOGO_FILE
+        create_school(args.school)
+        copied = []
+        if args.copy_current:
+            for name in (PROGRESS_FILE, JOURNAL_FILE, PARQUET_FILE, SQLITE_FILE, SCHOOL_INFO_FILE,
+                         LOGO_FILE, GRADING_FILE):
+                if os.path.exists(name) and not os.path.exists(school_path(args.school, name)):
+                    shutil.copy2(name, school_path(args.school, name))
+                    copied.append(name)
+        print(f"Created {school_directory(args.school)}" + (f" with {', '.join(copied)}" if copied else ""))
+    elif args.command == "migrate":
+        count = migrate_csv_to_sqlite(args.csv, args.school_info, args.db, force=args.force,
+                                      journal_path=args.journal)
+        print(f"Migrated {count} progress records into {args.db}")
+    elif args.command == "compact":
+        if args.parquet:
+            backend = ParquetBackend(args.parquet, journal_path=args.journal, csv_path=args.csv)
+        else:
+            backend = JournaledCsvBackend(args.csv, journal_path=args.journal)
+        size = backend.journal_size()
+        if backend.compact():
+            print(f"Compacted {size} journal bytes into {args.parquet or args.csv}")
+        else:
+            print("Journal is empty; nothing to compact")
@@ -0,0 +1,154 @@
+import re
+import bisect
+import difflib
+import threading
+import pandas as pd
+from storage import STUDENT_TERM_KEY, partition_key
+
+PAGE_SIZE = 20
+# Fuzzy matching kicks in for words of at least this length with no prefix match
+FUZZY_MIN_LENGTH = 3
+FUZZY_CUTOFF = 0.75
+
+
+def name_tokens(text):
+    return re.findall(r"\w+", str(text).casefold())
+
+
+def _text(value):
+    return "" if value is None or (not isinstance(value, str) and pd.isna(value)) else str(value)
+
+
+class StudentIndex:
+    # Search over the students of the progress store, one entry per (name,
+    # class, session), so two students who share a name but not a class are
+    # listed apart with their class and number. Name words are kept in a
+    # sorted list for bisect prefix lookups; words with no prefix match fall
+    # back to difflib's close matches. Built once per store and patched in
+    # place with the partitions each save changes.
+
+    def __init__(self, store):
+        self._lock = threading.Lock()
+        self._entries = {}  # (name, class, session) -> {"number": ..., "terms": set of terms}
+        self._partitions = {}  # (name, class, term, session) -> entry key it belongs to
+        self._words = []  # sorted (word, entry key)
+        self._vocabulary = None  # first letter -> distinct words, for fuzzy matching
+        df = store.df
+        if not df.empty:
+            firsts = df.drop_duplicates(STUDENT_TERM_KEY)
+            for name, class_name, term, session, number in firsts[
+                    STUDENT_TERM_KEY + ["Number"]].itertuples(index=False, name=None):
+                if pd.notna(name):
+                    self._add(partition_key(name, class_name, term, session), number, sort=False)
+        self._words.sort()
+
+    def _add(self, partition, number, sort=True):
+        name, class_name, term, session = partition
+        key = (name, class_name, _text(session))
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = {"number": _text(number), "terms": set(),
+                                          "order": (str(name).casefold(), key[1], _reverse(key[2]))}
+            self._vocabulary = None
+            for word in set(name_tokens(name)):
+                if sort:
+                    bisect.insort(self._words, (word, key))
+                else:
+                    self._words.append((word, key))
+        elif _text(number):
+            entry["number"] = _text(number)
+        entry["terms"].add(term)
+        self._partitions[partition] = key
+
+    def _remove(self, partition):
+        key = self._partitions.pop(partition, None)
+        if key is None:
+            return
+        entry = self._entries[key]
+        entry["terms"].discard(partition[2])
+        if not entry["terms"]:
+            del self._entries[key]
+            self._vocabulary = None
+            for word in set(name_tokens(key[0])):
+                position = bisect.bisect_left(self._words, (word, key))
+                if position < len(self._words) and self._words[position] == (word, key):
+                    del self._words[position]
+
+    def partitions_changed(self, frames):
+        # Called by ProgressStore.apply_partitions with the rows now stored for
+        # each (student, class, term, session)
+        with self._lock:
+            for partition, rows in frames.items():
+                partition = partition_key(*partition)
+                self._remove(partition)
+                if len(rows):
+                    self._add(partition, rows.iloc[0].get("Number"))
+
+    def _prefix(self, word):
+        # Entry keys with a name word starting with `word`
+        keys = set()
+        words = self._words
+        for position in range(bisect.bisect_left(words, (word,)), len(words)):
+            found, key = words[position]
+            if not found.startswith(word):
+                break
+            keys.add(key)
+        return keys
+
+    def _fuzzy(self, word):
+        if len(word) < FUZZY_MIN_LENGTH:
+            return set()
+        # Typos seldom hit the first letter, so only words sharing it are compared
+        if self._vocabulary is None:
+            self._vocabulary = {}
+            for found in sorted({found for found, _ in self._words}):
+                self._vocabulary.setdefault(found[0], []).append(found)
+        keys = set()
+        for close in difflib.get_close_matches(word, self._vocabulary.get(word[0], []), n=10, cutoff=FUZZY_CUTOFF):
+            keys |= self._prefix(close)
+        return keys
+
+    def _match(self, key):
+        entry = self._entries[key]
+        return dict(student_name=key[0], student_class=key[1], session=key[2],
+                    number=entry["number"], terms=sorted(entry["terms"], key=str))
+
+    def match(self, student_name, class_name, session):
+        # The search match for one entry, or None once it has no records left
+        with self._lock:
+            key = (student_name, class_name, session)
+            return self._match(key) if key in self._entries else None
+
+    def classes(self, session=None):
+        with self._lock:
+            return sorted({key[1] for key in self._entries if key[1] and (session is None or key[2] == session)},
+                          key=str)
+
+    def search(self, query="", class_name=None, session=None, page=0, page_size=PAGE_SIZE):
+        # (matches on this page, total matches). Every word of the query has to
+        # start a word of the name, or failing that be close to one; matches are
+        # ordered by name, class, then newest session first.
+        words = name_tokens(query)
+        with self._lock:
+            if words:
+                keys = None
+                for word in words:
+                    found = self._prefix(word) or self._fuzzy(word)
+                    keys = found if keys is None else keys & found
+            else:
+                keys = self._entries.keys()
+            keys = [key for key in keys if (class_name is None or key[1] == class_name)
+                    and (session is None or key[2] == session)]
+            keys.sort(key=lambda key: self._entries[key]["order"])
+            start = page * page_size
+            matches = [self._match(key) for key in keys[start:start + page_size]]
+            return matches, len(keys)
+
+
+def _reverse(text):
+    # Sort key putting later sessions ("2025/2026") before earlier ones
+    return tuple(-ord(char) for char in text)
+
+
+def student_index(store):
+    return store.derived("student_index", StudentIndex)
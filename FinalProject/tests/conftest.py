@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The app's modules sit side by side in FinalProject/ rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
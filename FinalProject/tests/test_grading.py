@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+import pytest
+from grading import GradingScale, load_scale
+
+CASES = [(76, 100), (70, 100), (69.9, 100), (40, 100), (0, 100), (-5, 100), (120, 100), (35, 50), ("45", "100"),
+         (" 60 ", 100), (5, 0), ("", 100), (50, ""), (None, 100), (np.nan, 100), ("abc", 100), (pd.NA, 100),
+         (float("inf"), 100), (np.int64(64), np.float64(100.0))]
+
+
+@pytest.mark.parametrize("scale", [GradingScale(), GradingScale([(0, "F", "Fail"), (55.5, "P", "Pass")])])
+def test_grade_matches_grade_arrays(scale):
+    grades, remarks = scale.grade_arrays([obtained for obtained, _ in CASES], [maximum for _, maximum in CASES])
+    assert [scale.grade(obtained, maximum) for obtained, maximum in CASES] == list(zip(grades, remarks))
+
+
+@pytest.mark.parametrize("grade", [None, np.nan, pd.NA, "", "  "])
+def test_a_band_without_a_grade_is_refused(grade):
+    edited = pd.DataFrame(GradingScale().to_records())
+    edited.loc[len(edited)] = [30, grade, "Weak"]
+    with pytest.raises(ValueError, match="grade"):
+        GradingScale.from_records(edited.to_dict("records"))
+
+
+def test_blank_editor_cells_are_not_saved_as_nan(tmp_path):
+    edited = pd.DataFrame(GradingScale().to_records())
+    edited.loc[len(edited)] = [30, "E2", np.nan]
+    with pytest.raises(ValueError, match="percentage"):
+        GradingScale.from_records(pd.concat([edited, pd.DataFrame([[np.nan, "E3", "Weak"]],
+                                                                  columns=edited.columns)]).to_dict("records"))
+    GradingScale.from_records(edited.to_dict("records")).save(tmp_path / "grading_scale.json")
+    assert load_scale(tmp_path / "grading_scale.json").grade(35, 100) == ("E2", "")
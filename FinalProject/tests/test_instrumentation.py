@@ -0,0 +1,26 @@
+import sys
+import threading
+import tracemalloc
+from instrumentation import RerunTimer
+
+
+def test_rerun_before_finish_stops_tracing_and_profiling():
+    # st.rerun() ends the run before timer.finish(); the next run on the thread cleans up
+    RerunTimer(True, profile=True, trace_memory=True).start()
+    assert tracemalloc.is_tracing()
+    timer = RerunTimer(True, profile=True, trace_memory=True).start()
+    timer.finish()
+    assert timer.memory_peak_kb is not None
+    assert timer.profile_text
+    assert not tracemalloc.is_tracing()
+    assert sys.getprofile() is None
+
+
+def test_stopped_run_on_another_thread_is_cleaned_up():
+    # st.stop() ends the script thread with tracing still on
+    thread = threading.Thread(target=lambda: RerunTimer(True, trace_memory=True).start())
+    thread.start()
+    thread.join()
+    assert tracemalloc.is_tracing()
+    RerunTimer(False).start()
+    assert not tracemalloc.is_tracing()
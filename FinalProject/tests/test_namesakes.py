@@ -0,0 +1,62 @@
+import pandas as pd
+import pytest
+from storage import EXPECTED_COLUMNS, CsvBackend, JournaledCsvBackend, NamesakeError, SqliteBackend
+from progress_store import ProgressStore
+
+NAME, TERM, SESSION = "Ada Obi", "First Term", "2024/2025"
+
+
+def key(class_name):
+    return (NAME, class_name, TERM, SESSION)
+
+
+def records(class_name, total):
+    return pd.DataFrame([{"Student_Name": NAME, "Class": class_name, "Term": TERM, "Session": SESSION,
+                          "Subject": "Mathematics", "Total_Obt": total, "Total_Max": 100}],
+                        columns=EXPECTED_COLUMNS)
+
+
+def saved(rows):
+    return sorted(zip(rows["Class"].astype(object).fillna(""), rows["Total_Obt"].astype(float)))
+
+
+@pytest.fixture(params=["csv", "journal", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        backend = SqliteBackend(str(tmp_path / "progress.db"))
+    elif request.param == "journal":
+        backend = JournaledCsvBackend(str(tmp_path / "progress_multi.csv"), str(tmp_path / "school_info.csv"),
+                                      str(tmp_path / "progress_journal.csv"))
+    else:
+        backend = CsvBackend(str(tmp_path / "progress_multi.csv"), str(tmp_path / "school_info.csv"))
+    backend.write_all(records("JSS1A", 70))
+    return ProgressStore(backend, backend.load(), backend.signature())
+
+
+def test_namesakes_in_different_classes_are_kept_apart(store):
+    store.save_records(records("JSS2B", 40), new_partitions=[key("JSS2B")])
+    assert saved(store.backend.load()) == [("JSS1A", 70.0), ("JSS2B", 40.0)]
+    assert saved(store.student_rows(*key("JSS1A"))) == [("JSS1A", 70.0)]
+    assert saved(store.student_rows(*key("JSS2B"))) == [("JSS2B", 40.0)]
+
+
+def test_new_student_is_not_merged_into_a_namesake_of_the_same_class(store):
+    with pytest.raises(NamesakeError) as raised:
+        store.save_records(records("JSS1A", 40), new_partitions=[key("JSS1A")])
+    assert raised.value.partitions == [key("JSS1A")]
+    assert saved(store.backend.load()) == [("JSS1A", 70.0)]
+
+
+def test_moving_a_student_to_another_class_clears_the_old_one(store):
+    # The editor loaded the JSS1A student and corrected their class
+    store.save_records(records("JSS1B", 75), expected_versions={key("JSS1A"): store.partition_version(*key("JSS1A"))},
+                       new_partitions=[key("JSS1B")], cleared=[key("JSS1A")])
+    assert saved(store.backend.load()) == [("JSS1B", 75.0)]
+    assert store.student_rows(*key("JSS1A")).empty
+
+
+def test_students_without_a_class_are_one_partition(store):
+    store.save_records(records(None, 55))
+    store.save_records(records("", 60))
+    assert saved(store.student_rows(NAME, None, TERM, SESSION)) == [("", 60.0)]
+    assert saved(store.backend.load()) == [("", 60.0), ("JSS1A", 70.0)]
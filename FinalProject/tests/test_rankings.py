@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+from benchmark import synthetic_progress
+from storage import CsvBackend, typed_frame
+from progress_store import ProgressStore
+from rankings import RankingViews, class_table
+
+TERM, SESSION = "First Term", "2024/2025"
+
+
+@pytest.fixture(params=["text", "typed"])
+def store(request, tmp_path):
+    df = synthetic_progress(120, 4, 1, 1, seed=5)
+    # Ties and subjects without scores
+    df.loc[df.index % 7 == 0, ["Total_Obt", "Total_Max"]] = [50.0, 100.0]
+    df.loc[df.index % 13 == 0, "Total_Obt"] = None
+    if request.param == "typed":
+        df = typed_frame(df)
+    return ProgressStore(CsvBackend(str(tmp_path / "progress_multi.csv")), df)
+
+
+def assert_tables_equal(left, right):
+    for part in ("totals", "subjects"):
+        pd.testing.assert_frame_equal(left[part], right[part])
+
+
+def test_term_tables_match_the_per_class_tables(store):
+    views = RankingViews(store)
+    combined = views.overall_ranking(TERM, SESSION)
+    assert len(combined) == store.term_rows(TERM, SESSION)["Student_Name"].nunique()
+    for class_name in store.classes(TERM, SESSION):
+        assert_tables_equal(views._class_tables[(TERM, SESSION, class_name)][1],
+                            class_table(store.class_rows(TERM, SESSION, class_name)))
+
+
+def test_a_save_rebuilds_only_its_class(store):
+    views = RankingViews(store)
+    views.overall_ranking(TERM, SESSION)
+    first, *others = store.classes(TERM, SESSION)
+    before = {class_name: views._class_tables[(TERM, SESSION, class_name)][1] for class_name in others}
+    student = store.class_rows(TERM, SESSION, first)["Student_Name"].iloc[0]
+    rows = store.student_rows(student, first, TERM, SESSION).copy()
+    rows["Total_Obt"] = rows["Total_Max"]
+    store.save_records(rows)
+    totals = views.overall_ranking(TERM, SESSION, first)
+    assert totals.loc[totals["Student_Name"] == student, "Position"].iloc[0] == "1st"
+    assert_tables_equal(views._class_tables[(TERM, SESSION, first)][1],
+                        class_table(store.class_rows(TERM, SESSION, first)))
+    for class_name in others:
+        assert views._class_tables[(TERM, SESSION, class_name)][1] is before[class_name]
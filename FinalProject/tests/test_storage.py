@@ -0,0 +1,217 @@
+import sqlite3
+import time
+import pandas as pd
+import pytest
+from storage import (EXPECTED_COLUMNS, RECORD_KEY, SCHEMA_VERSION, CsvBackend, JournaledCsvBackend, ParquetBackend,
+                     SqliteBackend, StaleWriteError, key_frame, partition_key, replay_journal)
+from progress_store import ProgressStore
+
+TERM, SESSION = "First Term", "2024/2025"
+BACKENDS = ["csv", "journal", "parquet", "sqlite"]
+
+
+def records(*rows):
+    # rows: (student, class, subject, total)
+    return pd.DataFrame([{"Student_Name": name, "Class": class_name, "Term": TERM, "Session": SESSION,
+                          "Subject": subject, "Total_Obt": total, "Total_Max": 100, "Teacher_Comment": "Good"}
+                         for name, class_name, subject, total in rows], columns=EXPECTED_COLUMNS)
+
+
+SAVED = records(("Ada Obi", "JSS1A", "Mathematics", 70), ("Ada Obi", "JSS1A", "English", 65),
+                ("Bola Ade", "JSS1B", "Mathematics", 48), ("Chi Eze", None, "Mathematics", 81))
+
+
+def saved(df):
+    # The records as (student, class, term, session, subject, total, comment), whatever the backend's dtypes
+    keys = key_frame(df, RECORD_KEY).itertuples(index=False, name=None)
+    return sorted((*key, float(total), str(comment))
+                  for key, total, comment in zip(keys, df["Total_Obt"].astype(float), df["Teacher_Comment"]))
+
+
+def open_backend(kind, tmp_path, **options):
+    # A fresh backend object on the files in tmp_path, as another process would open them
+    progress, school_info, journal = (str(tmp_path / name) for name in
+                                      ("progress_multi.csv", "school_info.csv", "progress_journal.csv"))
+    if kind == "sqlite":
+        return SqliteBackend(str(tmp_path / "progress.db"))
+    if kind == "parquet":
+        return ParquetBackend(str(tmp_path / "progress_multi.parquet"), school_info, journal, progress, **options)
+    if kind == "journal":
+        return JournaledCsvBackend(progress, school_info, journal, **options)
+    return CsvBackend(progress, school_info)
+
+
+def wait_for_compaction(backend):
+    deadline = time.monotonic() + 10
+    while backend._compacting.is_set():
+        assert time.monotonic() < deadline, "background compaction did not finish"
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize("kind", BACKENDS)
+def test_saves_survive_reopening_and_compaction(kind, tmp_path):
+    backend = open_backend(kind, tmp_path)
+    backend.write_all(SAVED)
+    backend.save_records(records(("Ada Obi", "JSS1A", "Mathematics", 90)))
+    backend.save_records(records(("Bola Ade", "JSS1B", "English", 55)), replace_partitions=False)
+    backend.save_records(records(("Dayo Ola", "JSS1A", "Mathematics", 62)), cleared=[("Chi Eze", "", TERM, SESSION)])
+    expected = saved(records(("Ada Obi", "JSS1A", "Mathematics", 90), ("Bola Ade", "JSS1B", "Mathematics", 48),
+                             ("Bola Ade", "JSS1B", "English", 55), ("Dayo Ola", "JSS1A", "Mathematics", 62)))
+    assert saved(backend.load()) == expected
+    assert saved(open_backend(kind, tmp_path).load()) == expected
+    if kind in ("journal", "parquet"):
+        assert backend.journal_size() > 0
+        assert backend.compact()
+        assert backend.journal_size() == 0
+        assert not backend.compact()
+        assert saved(open_backend(kind, tmp_path).load()) == expected
+    assert saved(open_backend(kind, tmp_path).load(TERM, SESSION, "JSS1B")) == [row for row in expected
+                                                                                 if row[1] == "JSS1B"]
+
+
+def test_replay_applies_journal_entries_in_order():
+    journal = pd.concat([records(("Ada Obi", "JSS1A", "Mathematics", 75)).assign(_Op="upsert"),
+                         records(("Ada Obi", "JSS1A", None, None)).assign(_Op="clear"),
+                         records(("Ada Obi", "JSS1A", "English", 80)).assign(_Op="upsert"),
+                         records(("Chi Eze", "", None, None)).assign(_Op="clear"),
+                         records(("Bola Ade", "JSS1B", "Mathematics", 50)).assign(_Op="upsert"),
+                         records(("Bola Ade", "JSS1B", "Mathematics", 52)).assign(_Op="upsert")])
+    assert saved(replay_journal(SAVED, journal)) == saved(records(
+        ("Ada Obi", "JSS1A", "English", 80), ("Bola Ade", "JSS1B", "Mathematics", 52)))
+
+
+@pytest.mark.parametrize("kind", ["journal", "parquet"])
+def test_a_long_journal_is_compacted_in_the_background(kind, tmp_path):
+    backend = open_backend(kind, tmp_path, max_journal_bytes=0)
+    backend.write_all(SAVED)
+    backend.save_records(records(("Ada Obi", "JSS1A", "Mathematics", 90)))
+    wait_for_compaction(backend)
+    assert backend.journal_size() == 0
+    assert saved(open_backend(kind, tmp_path).load()) == saved(pd.concat(
+        [SAVED[SAVED["Student_Name"] != "Ada Obi"], records(("Ada Obi", "JSS1A", "Mathematics", 90))]))
+
+
+def test_parquet_snapshot_from_an_older_schema_is_upgraded(tmp_path):
+    # Version 0: an untyped snapshot without the schema version in its metadata
+    SAVED.to_parquet(tmp_path / "progress_multi.parquet", index=False)
+    backend = open_backend("parquet", tmp_path)
+    assert backend.schema_version() == 0
+    df = backend.load()
+    assert isinstance(df["Subject"].dtype, pd.CategoricalDtype)
+    assert saved(df) == saved(SAVED)
+    backend.save_records(records(("Bola Ade", "JSS1B", "Mathematics", 60)))
+    assert backend.compact()
+    assert backend.schema_version() == SCHEMA_VERSION
+    assert saved(open_backend("parquet", tmp_path).load(TERM, SESSION, "JSS1B")) == saved(
+        records(("Bola Ade", "JSS1B", "Mathematics", 60)))
+
+
+# The normalized layout before students were keyed on their name and class
+NAME_KEYED_SCHEMA = """
+CREATE TABLE schools (id INTEGER PRIMARY KEY, School_Name TEXT NOT NULL DEFAULT '',
+                      School_Address TEXT NOT NULL DEFAULT '', UNIQUE (School_Name, School_Address));
+CREATE TABLE students (id INTEGER PRIMARY KEY, Student_Name TEXT NOT NULL UNIQUE);
+CREATE TABLE enrollments (id INTEGER PRIMARY KEY, student_id INTEGER NOT NULL REFERENCES students (id),
+                          Term TEXT NOT NULL, Session TEXT NOT NULL, Class TEXT, Number TEXT, Teacher_Comment TEXT,
+                          Principal_Comment TEXT, school_id INTEGER REFERENCES schools (id),
+                          UNIQUE (student_id, Term, Session));
+CREATE INDEX idx_enrollments_term_class ON enrollments (Term, Session, Class);
+CREATE TABLE scores (enrollment_id INTEGER NOT NULL REFERENCES enrollments (id), Subject TEXT NOT NULL,
+                     CA1_Obt REAL, CA1_Max REAL, CA2_Obt REAL, CA2_Max REAL, Exam_Obt REAL, Exam_Max REAL,
+                     Total_Obt REAL, Total_Max REAL, Grade TEXT, Remark TEXT, PRIMARY KEY (enrollment_id, Subject));
+CREATE INDEX idx_scores_subject ON scores (Subject);
+CREATE VIEW progress_records AS SELECT students.Student_Name FROM students;
+CREATE TABLE partition_revisions (Student_Name TEXT NOT NULL, Term TEXT NOT NULL, Session TEXT NOT NULL,
+                                  Revision INTEGER NOT NULL, PRIMARY KEY (Student_Name, Term, Session));
+INSERT INTO schools (id, School_Name, School_Address) VALUES (1, '', '');
+INSERT INTO students (id, Student_Name) VALUES (1, 'Ada Obi'), (2, 'Chi Eze');
+INSERT INTO enrollments (id, student_id, Term, Session, Class, Teacher_Comment, school_id)
+VALUES (1, 1, 'First Term', '2024/2025', 'JSS1A', 'Good', 1), (2, 2, 'First Term', '2024/2025', NULL, 'Good', 1);
+INSERT INTO scores (enrollment_id, Subject, Total_Obt, Total_Max)
+VALUES (1, 'Mathematics', 70, 100), (1, 'English', 65, 100), (2, 'Mathematics', 81, 100);
+INSERT INTO partition_revisions VALUES ('Ada Obi', 'First Term', '2024/2025', 3);
+CREATE TABLE store_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT INTO store_meta (key, value) VALUES ('revision', 3), ('school_info_revision', 0);
+"""
+
+
+def assert_migrated(backend, expected):
+    assert saved(backend.load()) == saved(expected)
+    assert {partition_key(*key) for key in backend.changed_partitions(0)} == \
+        set(key_frame(expected).itertuples(index=False, name=None))
+    # The converted database takes ordinary saves
+    backend.save_records(records(("Ada Obi", "JSS1A", "Mathematics", 99)))
+    assert ("Ada Obi", "JSS1A", TERM, SESSION, "Mathematics", 99.0, "Good") in saved(backend.load())
+
+
+def test_sqlite_wide_layout_is_converted(tmp_path):
+    conn = sqlite3.connect(tmp_path / "progress.db")
+    SAVED.to_sql("progress", conn, index=False)
+    conn.close()
+    backend = open_backend("sqlite", tmp_path)
+    tables = {row[0] for row in backend._connect().execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert "progress" not in tables
+    # Revisions start from the conversion, so no partition counts as changed
+    assert backend.changed_partitions(0) == []
+    assert saved(backend.load()) == saved(SAVED)
+
+
+def test_sqlite_name_keyed_layout_is_converted(tmp_path):
+    conn = sqlite3.connect(tmp_path / "progress.db")
+    conn.executescript(NAME_KEYED_SCHEMA)
+    conn.close()
+    backend = open_backend("sqlite", tmp_path)
+    tables = {row[0] for row in backend._connect().execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert not {name for name in tables if name.startswith("legacy_")}
+    assert_migrated(backend, SAVED[SAVED["Student_Name"] != "Bola Ade"])
+
+
+def test_sqlite_revisions_without_a_class_are_rebuilt(tmp_path):
+    open_backend("sqlite", tmp_path).write_all(SAVED)
+    conn = sqlite3.connect(tmp_path / "progress.db")
+    conn.executescript("""
+        DROP TABLE partition_revisions;
+        CREATE TABLE partition_revisions (Student_Name TEXT NOT NULL, Term TEXT NOT NULL, Session TEXT NOT NULL,
+                                          Revision INTEGER NOT NULL, PRIMARY KEY (Student_Name, Term, Session));
+        UPDATE store_meta SET value = 1 WHERE key = 'revision';
+    """)
+    conn.close()
+    assert_migrated(open_backend("sqlite", tmp_path), SAVED)
+
+
+@pytest.mark.parametrize("kind", BACKENDS)
+def test_saving_over_someone_elses_change_raises(kind, tmp_path):
+    open_backend(kind, tmp_path).write_all(SAVED)
+    key = ("Ada Obi", "JSS1A", TERM, SESSION)
+    stores = []
+    for _ in range(2):
+        backend = open_backend(kind, tmp_path)
+        stores.append(ProgressStore(backend, backend.load(), backend.signature()))
+    first, second = stores
+    first.save_records(records(("Ada Obi", "JSS1A", "Mathematics", 90)),
+                       expected_versions={key: first.partition_version(*key)})
+    with pytest.raises(StaleWriteError) as raised:
+        second.save_records(records(("Ada Obi", "JSS1A", "Mathematics", 40)),
+                            expected_versions={key: second.partition_version(*key)})
+    assert raised.value.partitions == [key]
+    # A partition nobody else touched still saves from the same stale copy
+    second.save_records(records(("Bola Ade", "JSS1B", "Mathematics", 60)),
+                        expected_versions={("Bola Ade", "JSS1B", TERM, SESSION):
+                                           second.partition_version("Bola Ade", "JSS1B", TERM, SESSION)})
+    assert saved(open_backend(kind, tmp_path).load(TERM, SESSION, "JSS1A")) == saved(
+        records(("Ada Obi", "JSS1A", "Mathematics", 90)))
+    assert saved(open_backend(kind, tmp_path).load(TERM, SESSION, "JSS1B")) == saved(
+        records(("Bola Ade", "JSS1B", "Mathematics", 60)))
+
+
+def test_a_failed_school_info_save_leaves_the_database_usable(tmp_path):
+    backend = open_backend("sqlite", tmp_path)
+    backend.save_school_info("Hill School", "1 Hill Road")
+    revision = backend.school_info_signature()
+    with pytest.raises(sqlite3.Error):
+        backend.save_school_info(["not", "text"], "1 Hill Road")
+    assert backend.load_school_info() == ("Hill School", "1 Hill Road")
+    assert backend.school_info_signature() == revision
+    backend.save_records(records(("Ada Obi", "JSS1A", "Mathematics", 90)))
+    backend.save_school_info("Hill School", "2 Hill Road")
+    assert open_backend("sqlite", tmp_path).load_school_info() == ("Hill School", "2 Hill Road")